@@ -0,0 +1,338 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+from response_layer import FastJSONResponse
+
+# Limit the requests per consumer and the concurrent work per route class, otherwise all the requests are accepted
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Seconds a scheduled report waits for a free slot of the AI agent before failing, it has no client waiting for it
+ADMISSION_BATCH_WAIT = float(os.getenv("ADMISSION_BATCH_WAIT", "600"))
+# Rate limit buckets kept in memory, the full ones (of consumers idle long enough) are dropped beyond it
+ADMISSION_MAX_BUCKETS = int(os.getenv("ADMISSION_MAX_BUCKETS", "10000"))
+
+# Priorities of the queued requests, lower first
+INTERACTIVE = 0
+BATCH = 1
+
+# The route class of a request is the first one whose pattern matches its path
+ROUTE_PATTERNS = [
+    (re.compile(r"^/smartfactory/agent/"), "agent"),
+    (re.compile(r"^/smartfactory/reports/generate$"), "report"),
+    (re.compile(r"^/smartfactory/(calculate|predict|historical)$"), "compute"),
+]
+# Paths that are never limited
+EXEMPT_PATHS = {"/metrics"}
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Attributes:
+        status_code (int): 429 if the consumer exceeded its rate, 503 if the route class is overloaded.
+        reason (str): rate_limited, shed or timeout.
+        retry_after (int): Seconds after which the request can be sent again.
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+
+
+class TokenBucket:
+    """
+    A bucket of burst tokens refilled at rate tokens per second, a request takes one token.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (float): Maximum number of tokens.
+    """
+
+    __slots__ = ("rate", "burst", "_tokens", "_updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def take(self) -> float:
+        """
+        Take a token.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def full(self) -> bool:
+        """Whether no token has been taken since the bucket was last refilled, a new bucket would be the same."""
+        self._refill()
+        return self._tokens >= self.burst
+
+
+class RouteClass:
+    """
+    The limits of a class of routes.
+
+    Attributes:
+        name (str): The name of the class.
+        rate (float): Requests per second allowed to every consumer, 0 for no limit.
+        burst (float): Requests a consumer can send at once above the rate.
+        concurrency (int): Requests of the class served at the same time by the process, 0 for no limit.
+        queue_size (int): Requests waiting for a free slot, the following ones are shed.
+        queue_timeout (float): Seconds a request waits for a free slot before being shed.
+    """
+
+    def __init__(self, name: str, rate: float = 0, burst: float = 1, concurrency: int = 0, queue_size: int = 0,
+                 queue_timeout: float = 10.0):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "RouteClass":
+        """Create a class whose limits can be set with ADMISSION_<NAME>_<LIMIT>, e.g. ADMISSION_AGENT_RATE."""
+        prefix = f"ADMISSION_{name.upper()}_"
+        types = {"rate": float, "burst": float, "concurrency": int, "queue_size": int, "queue_timeout": float}
+        return cls(name, **{limit: types[limit](os.getenv(prefix + limit.upper(), value))
+                            for limit, value in defaults.items()})
+
+
+class AdmissionController:
+    """
+    Admits the requests of every consumer (the microservice owning the API key) per route class.
+
+    A request first takes a token from its bucket for the class, and is rejected with 429 if there is none. The
+    bucket is the one of its rate key (e.g. the user of the GUI sending it), or of its consumer if it has none.
+    Beyond max_buckets, the full buckets are dropped. Then, if the class has a concurrency limit and all its slots
+    are busy, the request waits in a queue ordered by priority, so that interactive requests are served before
+    batch work (the scheduled reports). When the queue is full a batch request is shed to make room for an
+    interactive one, otherwise the new request is shed with 503; a request still queued after queue_timeout is shed
+    as well.
+
+    Must be used on the event loop.
+
+    Attributes:
+        classes (dict): The RouteClass of every class name; requests of an unknown class use "default".
+        enabled (bool): Whether the requests are limited.
+        max_buckets (int): Rate limit buckets kept in memory before dropping the full ones.
+    """
+
+    def __init__(self, classes: list, enabled: bool = ADMISSION_ENABLED,
+                 max_buckets: int = ADMISSION_MAX_BUCKETS):
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.enabled = enabled
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._in_flight = {name: 0 for name in self.classes}
+        self._queues = {name: [] for name in self.classes}
+        self._sequence = itertools.count()
+        self._counters = {}
+
+    def _count(self, principal: str, name: str, result: str):
+        key = (principal, name, result)
+        self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _reject(self, principal: str, route_class: RouteClass, reason: str, retry_after: float) -> Rejected:
+        self._count(principal, route_class.name, reason)
+        if reason == "rate_limited":
+            return Rejected(429, reason, retry_after, f"Too many {route_class.name} requests, retry later")
+        return Rejected(503, reason, retry_after, f"The service is overloaded by {route_class.name} requests, "
+                                                  f"retry later")
+
+    def _bucket(self, rate_key: str, route_class: RouteClass) -> TokenBucket:
+        bucket = self._buckets.get((rate_key, route_class.name))
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                for key in [key for key, idle in self._buckets.items() if idle.full()]:
+                    del self._buckets[key]
+            bucket = self._buckets[(rate_key, route_class.name)] = TokenBucket(route_class.rate, route_class.burst)
+        return bucket
+
+    async def acquire(self, principal: str, name: str, priority: int = INTERACTIVE, rate_limited: bool = True,
+                      timeout: float = None, rate_key: str = None) -> RouteClass:
+        """
+        Wait until a request can be served; release must be called once it has been.
+
+        Args:
+            principal (str): The consumer sending the request, in the counters.
+            name (str): The route class of the request.
+            priority (int): INTERACTIVE or BATCH.
+            rate_limited (bool): Whether the request takes a token from its bucket.
+            timeout (float, optional): Seconds to wait for a slot, the queue_timeout of the class if None.
+            rate_key (str, optional): The key of the bucket of the request, the principal if None.
+
+        Returns:
+            RouteClass: The class the request was admitted in, to be released.
+
+        Raises:
+            Rejected: If the request is not admitted.
+        """
+        route_class = self.classes.get(name) or self.classes["default"]
+        if route_class.rate > 0 and rate_limited:
+            wait = self._bucket(rate_key or principal, route_class).take()
+            if wait > 0:
+                raise self._reject(principal, route_class, "rate_limited", wait)
+
+        queue = self._queues[route_class.name]
+        if route_class.concurrency <= 0 or (self._in_flight[route_class.name] < route_class.concurrency
+                                            and not queue):
+            self._in_flight[route_class.name] += 1
+            self._count(principal, route_class.name, "admitted")
+            return route_class
+
+        if len(queue) >= route_class.queue_size:
+            worst = max(queue) if queue else None
+            if worst is None or worst[0] <= priority:
+                raise self._reject(principal, route_class, "shed", route_class.queue_timeout)
+            # the newest of the lowest priority requests leaves its place
+            queue.remove(worst)
+            heapq.heapify(queue)
+            worst[3].set_exception(self._reject(worst[2], route_class, "shed", route_class.queue_timeout))
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), principal, waiter)
+        heapq.heappush(queue, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.queue_timeout if timeout is None else timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            # the slot may have been handed over just before the timeout or the cancellation: it is given back
+            if not self._dequeue(route_class, entry) and waiter.done() and waiter.exception() is None:
+                self.release(route_class)
+            if isinstance(error, asyncio.TimeoutError):
+                raise self._reject(principal, route_class, "timeout", route_class.queue_timeout)
+            raise
+        self._count(principal, route_class.name, "admitted")
+        return route_class
+
+    def _dequeue(self, route_class: RouteClass, entry: tuple) -> bool:
+        queue = self._queues[route_class.name]
+        if entry in queue:
+            queue.remove(entry)
+            heapq.heapify(queue)
+            return True
+        return False
+
+    def release(self, route_class: RouteClass):
+        """Free the slot of an admitted request, handing it to the first request of the queue."""
+        queue = self._queues[route_class.name]
+        while queue:
+            waiter = heapq.heappop(queue)[3]
+            if not waiter.done():
+                # the slot is handed over, in_flight does not change
+                waiter.set_result(None)
+                return
+        self._in_flight[route_class.name] -= 1
+
+    @asynccontextmanager
+    async def admit(self, principal: str, name: str, priority: int = INTERACTIVE, rate_limited: bool = True,
+                    timeout: float = None):
+        """
+        Serve a request within the limits of its class, see acquire.
+
+        Raises:
+            Rejected: If the request is not admitted.
+        """
+        if not self.enabled:
+            yield
+            return
+        route_class = await self.acquire(principal, name, priority, rate_limited, timeout)
+        try:
+            yield
+        finally:
+            self.release(route_class)
+
+    def stats(self) -> dict:
+        """
+        Return the state and the counters of the controller.
+
+        Returns:
+            dict: In flight and queued requests per class, and the requests admitted, rate_limited, shed and
+                  timed out (timeout) per (consumer, class, result).
+        """
+        return {
+            "in_flight": dict(self._in_flight),
+            "queued": {name: len(queue) for name, queue in self._queues.items()},
+            "requests": dict(self._counters)
+        }
+
+
+def route_class_of(path: str) -> str:
+    """Return the route class of a path, default if no pattern matches."""
+    for pattern, name in ROUTE_PATTERNS:
+        if pattern.match(path):
+            return name
+    return "default"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting every HTTP request through an AdmissionController before it is served.
+
+    Rejected requests are answered with 429 or 503, a JSON detail and a Retry-After header.
+
+    Attributes:
+        controller (AdmissionController): The controller.
+        principal (callable): Called with the X-API-Key header (None if missing), returns the consumer.
+        rate_key (callable, optional): Called with the ASGI scope and the X-API-Key header, returns the key of the
+            rate limit bucket of the request (None for the bucket of the consumer).
+    """
+
+    def __init__(self, app, controller: AdmissionController, principal, rate_key=None):
+        self.app = app
+        self.controller = controller
+        self.principal = principal
+        self.rate_key = rate_key
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        api_key = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+                break
+        rate_key = self.rate_key(scope, api_key) if self.rate_key is not None else None
+        try:
+            route_class = await self.controller.acquire(self.principal(api_key), route_class_of(scope["path"]),
+                                                        rate_key=rate_key)
+        except Rejected as rejected:
+            response = FastJSONResponse(content={"detail": str(rejected)}, status_code=rejected.status_code,
+                                        headers={"Retry-After": str(rejected.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+
+admission = AdmissionController([
+    RouteClass.from_env("agent", rate=2, burst=20, concurrency=4, queue_size=32, queue_timeout=30),
+    RouteClass.from_env("report", rate=0.5, burst=5),
+    RouteClass.from_env("compute", rate=50, burst=100, concurrency=32, queue_size=128, queue_timeout=10),
+    RouteClass.from_env("default", rate=200, burst=400),
+])
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import select
+import threading
+
+from database.connection import open_dedicated_connection
+
+# Share the alerts between API processes through Postgres LISTEN/NOTIFY, otherwise only this process is notified
+ALERT_HUB_NOTIFY = os.getenv("ALERT_HUB_NOTIFY", "false").lower() == "true"
+# Alerts waiting to be sent to a connection, the following ones are dropped until the client catches up
+ALERT_STREAM_QUEUE = int(os.getenv("ALERT_STREAM_QUEUE", "100"))
+# Seconds between two keep-alive comments on an idle alert stream
+ALERT_STREAM_HEARTBEAT = float(os.getenv("ALERT_STREAM_HEARTBEAT", "15"))
+
+ALERT_CHANNEL = "smartfactory_alerts"
+NOTIFY_MAX_IDS = 500
+# Seconds between two attempts to reopen the LISTEN connection
+LISTEN_RETRY = 5
+
+
+class AlertHub:
+    """
+    Pushes the saved alerts to the users connected to the alert stream.
+
+    Every connection of a user has its own queue, filled on the event loop. An alert is published after the
+    transaction saving it commits: without notify it is dispatched to the connections of this process only; with
+    notify the transaction sends its ID on a Postgres channel, and every API process listening on it loads the
+    alert once for its own connected recipients.
+
+    Attributes:
+        notify (bool): Whether the alerts are shared through LISTEN/NOTIFY.
+        queue_size (int): Maximum number of alerts waiting to be sent to a connection.
+    """
+
+    def __init__(self, notify: bool = ALERT_HUB_NOTIFY, queue_size: int = ALERT_STREAM_QUEUE):
+        self.notify = notify
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._load = None
+        self._listener = None
+        self._stopped = threading.Event()
+        self._counters = {"published": 0, "delivered": 0, "dropped": 0}
+
+    def start(self, load=None):
+        """
+        Bind the hub to the running event loop and, with notify, start listening to the alert channel.
+
+        Args:
+            load (callable, optional): Called with a list of alert IDs and a list of user IDs, returns
+                                       (alert dict, recipient IDs) for the alerts with recipients among the users.
+                                       Required with notify.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._load = load
+        self._stopped.clear()
+        if self.notify and self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name="alert-hub", daemon=True)
+            self._listener.start()
+
+    def stop(self):
+        """Stop listening to the alert channel and close the open streams."""
+        self._stopped.set()
+        with self._lock:
+            queues = [queue for queues in self._subscribers.values() for queue in queues]
+        for queue in queues:
+            self._offer(queue, None)
+        self._listener = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """
+        Open a stream for a user. Must be called on the event loop.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            asyncio.Queue: The alerts for the user, as dicts; None when the hub stops.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        """Close a stream opened with subscribe."""
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def connected_users(self) -> list:
+        """Return the IDs of the users with an open stream in this process."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def notify_in_transaction(self, cursor, *alert_ids: int):
+        """
+        With notify, send the IDs of alerts on the alert channel, in as few notifications as possible; Postgres
+        delivers them when the transaction commits, and never if it rolls back.
+
+        Args:
+            cursor: The cursor of the transaction saving the alerts.
+            alert_ids (int): The IDs of the alerts.
+        """
+        if not self.notify:
+            return
+        # a notification carries at most 8000 bytes
+        for start in range(0, len(alert_ids), NOTIFY_MAX_IDS):
+            payload = ",".join(str(alert_id) for alert_id in alert_ids[start:start + NOTIFY_MAX_IDS])
+            cursor.execute("SELECT pg_notify(%s, %s)", (ALERT_CHANNEL, payload))
+
+    def publish(self, alert: dict, user_ids: list):
+        """
+        Push a committed alert to its connected recipients. Can be called from any thread.
+
+        With notify this does nothing, the alert is pushed when its notification is received.
+
+        Args:
+            alert (dict): The alert.
+            user_ids (list): The IDs of the recipients.
+        """
+        self.publish_batch([(alert, user_ids)])
+
+    def publish_batch(self, alerts: list):
+        """
+        Push committed alerts to their connected recipients in a single dispatch. Can be called from any thread.
+
+        Args:
+            alerts (list): (alert dict, IDs of the recipients) of every alert.
+        """
+        if not self.notify and alerts:
+            self._dispatch_threadsafe(alerts)
+
+    def _dispatch_threadsafe(self, alerts: list):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(alerts)
+            return
+        try:
+            loop.call_soon_threadsafe(self._dispatch, alerts)
+        except RuntimeError:
+            pass  # the loop was closed in the meantime
+
+    def _dispatch(self, alerts: list):
+        for alert, user_ids in alerts:
+            self._counters["published"] += 1
+            with self._lock:
+                queues = [queue for user_id in user_ids for queue in self._subscribers.get(user_id, ())]
+            for queue in queues:
+                self._offer(queue, alert)
+
+    def _offer(self, queue: asyncio.Queue, alert):
+        try:
+            queue.put_nowait(alert)
+            if alert is not None:
+                self._counters["delivered"] += 1
+        except asyncio.QueueFull:
+            # a slow client misses the push, it still finds the alert in its feed
+            self._counters["dropped"] += 1
+
+    def _listen(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = open_dedicated_connection()
+                connection.cursor().execute("LISTEN " + ALERT_CHANNEL)
+                logging.info("Listening to %s", ALERT_CHANNEL)
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], LISTEN_RETRY) == ([], [], []):
+                        continue
+                    connection.poll()
+                    alert_ids = [int(alert_id) for notification in connection.notifies
+                                 for alert_id in notification.payload.split(",")]
+                    connection.notifies.clear()
+                    user_ids = self.connected_users()
+                    if alert_ids and user_ids:
+                        self._dispatch_threadsafe(self._load(alert_ids, user_ids))
+            except Exception as e:
+                logging.error("Alert hub: %s", str(e))
+                self._stopped.wait(LISTEN_RETRY)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the hub.
+
+        Returns:
+            dict: Open streams, alerts published, pushed to a stream and dropped for slow clients.
+        """
+        with self._lock:
+            streams = sum(len(queues) for queues in self._subscribers.values())
+        return {"streams": streams, **self._counters}
+
+
+alert_hub = AlertHub()
@@ -0,0 +1,321 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from fastapi import Depends, HTTPException
+from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+
+from AES_lib import decrypt_data, encrypt_data
+from api_auth.api_auth import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY, oauth2_scheme
+from database.connection import transaction
+
+# Seconds a user is served from memory after being read, changes made through another API process are seen after it
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+# Maximum number of users and of validated tokens kept in memory
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+
+# Whether the requests about a user must carry the bearer token of the user, besides the API key of the GUI;
+# otherwise the token is only checked when present
+USER_TOKEN_REQUIRED = os.getenv("USER_TOKEN_REQUIRED", "false").lower() == "true"
+
+# The token is optional while the GUI authenticates with its API key only
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/smartfactory/login", auto_error=False)
+
+# The columns of a principal, the password is only read to check it
+PRINCIPAL_COLUMNS = "UserID, Username, Email, Role, SiteName"
+
+
+class ExpiringCache:
+    """
+    Thread-safe LRU cache whose entries expire.
+
+    Attributes:
+        maxsize (int): Maximum number of entries, the least recently used one is dropped beyond it.
+        ttl (float): Default seconds an entry is kept.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        """Return the value of a key, None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value, ttl: float = None):
+        """Store the value of a key for ttl seconds, the default ttl if None."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop a key, or every key if None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Return the number of entries, hits and misses."""
+        with self._lock:
+            return {"size": len(self._entries), **self._counters}
+
+
+principal_cache = ExpiringCache(SESSION_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+token_cache = ExpiringCache(SESSION_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# Time of the last logout of every user, the tokens issued before it are rejected until they expire
+revoked_tokens = ExpiringCache(SESSION_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+@lru_cache(maxsize=1)
+def aes_key() -> bytes:
+    """The key encrypting the personal data of the users, parsed once from AES_KEY."""
+    return bytes.fromhex(os.getenv("AES_KEY").strip())
+
+
+def encrypt_lookup(value: str) -> str:
+    """
+    Encrypt a username or email as stored in Users.
+
+    The encryption is deterministic, so the encrypted value can be looked up with the Username and Email indexes.
+    """
+    return encrypt_data(value, aes_key())
+
+
+def principal_from_row(row) -> dict:
+    """
+    Decrypt a user read with PRINCIPAL_COLUMNS.
+
+    Args:
+        row (tuple): UserID, Username, Email, Role and SiteName.
+
+    Returns:
+        dict: userId, username, email, role and site of the user.
+    """
+    key = aes_key()
+    return {
+        "userId": row[0],
+        "username": decrypt_data(row[1], key),
+        "email": decrypt_data(row[2], key),
+        "role": row[3],
+        "site": decrypt_data(row[4], key)
+    }
+
+
+def get_principal(user_id: int):
+    """
+    Return a user by id, from memory if it was read in the last PRINCIPAL_CACHE_TTL seconds.
+
+    Args:
+        user_id (int): The id of the user.
+
+    Returns:
+        dict or None: The user (see principal_from_row), None if it does not exist.
+    """
+    user_id = int(user_id)
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    with transaction() as cursor:
+        cursor.execute(f"SELECT {PRINCIPAL_COLUMNS} FROM Users WHERE UserID = %s", (user_id,))
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    principal = principal_from_row(row)
+    principal_cache.put(user_id, principal)
+    return principal
+
+
+def invalidate_principal(user_id: int = None):
+    """Drop a user from memory, or every user if None."""
+    principal_cache.invalidate(None if user_id is None else int(user_id))
+
+
+def authenticate(user: str, is_email: bool, password: str):
+    """
+    Check the credentials of a user, with a single lookup on the Username or Email index.
+
+    The user is kept in memory, so the requests following the login do not read it again.
+
+    Args:
+        user (str): The username or the email of the user.
+        is_email (bool): Whether user is the email.
+        password (str): The password of the user.
+
+    Returns:
+        dict or None: The user (see principal_from_row), None if the credentials are invalid.
+    """
+    column = "Email" if is_email else "Username"
+    with transaction() as cursor:
+        cursor.execute(f"SELECT {PRINCIPAL_COLUMNS}, Password FROM Users WHERE {column} = %s LIMIT 1",
+                       (encrypt_lookup(user),))
+        row = cursor.fetchone()
+    if row is None or not hmac.compare_digest(str(row[5]).encode(), password.encode()):
+        return None
+    principal = principal_from_row(row)
+    principal_cache.put(principal["userId"], principal)
+    return principal
+
+
+def register_user(username: str, email: str, role: str, password: str, site: str):
+    """
+    Insert a user if no user has the same username or email, in a single statement.
+
+    Args:
+        username (str): The username of the user.
+        email (str): The email of the user.
+        role (str): The role of the user.
+        password (str): The password of the user.
+        site (str): The site of the user.
+
+    Returns:
+        int or None: The id of the new user, None if the user is already registered.
+    """
+    enc_username, enc_email = encrypt_lookup(username), encrypt_lookup(email)
+    with transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO Users (Username, Email, Role, Password, SiteName) "
+            "SELECT %s, %s, %s, %s, %s "
+            "WHERE NOT EXISTS (SELECT 1 FROM Users WHERE Username = %s OR Email = %s) RETURNING UserID",
+            (enc_username, enc_email, role, password, encrypt_lookup(site), enc_username, enc_email)
+        )
+        row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def create_access_token(principal: dict) -> str:
+    """
+    Create the JWT of a user.
+
+    Args:
+        principal (dict): The user, see principal_from_row.
+
+    Returns:
+        str: The token, with the encrypted username (sub), the id (uid), the role of the user and the time it was
+            issued (iat, with the fractions of second, compared with the logouts).
+    """
+    return jwt.encode(
+        {
+            "sub": encrypt_lookup(principal["username"]),
+            "uid": principal["userId"],
+            "role": principal["role"],
+            "iat": time.time(),
+            "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        },
+        SECRET_KEY,
+        algorithm=ALGORITHM
+    )
+
+
+def validate_token(token: str) -> dict:
+    """
+    Verify a JWT, memoizing the result until the token expires.
+
+    The memoized tokens are still checked against the logouts (see revoke_tokens).
+
+    Args:
+        token (str): The token.
+
+    Returns:
+        dict: The claims of the token.
+
+    Raises:
+        JWTError: If the token is invalid, expired or revoked.
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        expires_in = payload["exp"] - time.time() if "exp" in payload else None
+        token_cache.put(key, payload, expires_in)
+    revoked_at = revoked_tokens.get(payload.get("uid"))
+    if revoked_at is not None and payload.get("iat", 0) <= revoked_at:
+        token_cache.invalidate(key)
+        raise JWTError("Token revoked")
+    return payload
+
+
+def revoke_tokens(user_id: int):
+    """
+    Reject the tokens issued to a user until now, at the logout.
+
+    The logout is kept in memory by the process serving it, as long as a token issued before it can be valid.
+
+    Args:
+        user_id (int): The id of the user.
+    """
+    revoked_tokens.put(int(user_id), time.time())
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """
+    Retrieve the current user based on the provided JWT token.
+
+    The token is verified once and the user is read once, both are then served from memory.
+
+    Args:
+        token (str): The JWT token provided by the user.
+
+    Returns:
+        dict: The user, see principal_from_row.
+
+    Raises:
+        HTTPException: If the token is invalid or the user does not exist.
+    """
+    try:
+        payload = validate_token(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = payload.get("uid")
+    principal = await run_in_threadpool(get_principal, user_id) if user_id is not None else None
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return principal
+
+
+async def verify_user_token(userId: str, token: str = Depends(optional_oauth2_scheme)):
+    """
+    Check that a request about a user carries a token of that user.
+
+    The token is required if USER_TOKEN_REQUIRED is true, otherwise the requests without a token are let through,
+    authenticated by the API key only.
+
+    Args:
+        userId (str): The id of the user in the path or in the query of the request.
+        token (str): The bearer token of the request, None if missing.
+
+    Returns:
+        dict or None: The user of the token, see principal_from_row, None if the request has no token.
+
+    Raises:
+        HTTPException: 401 if the token is missing and required or invalid, 403 if it belongs to another user.
+    """
+    if token is None:
+        if USER_TOKEN_REQUIRED:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        return None
+    principal = await get_current_user(token)
+    if str(principal["userId"]) != str(userId):
+        raise HTTPException(status_code=403, detail="The token does not belong to the user")
+    return principal
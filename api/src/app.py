@@ -1,30 +1,35 @@
 import asyncio
+import hashlib
 import json
 import logging
-import sys
+import re
+import time
 from contextlib import asynccontextmanager
-from datetime import timedelta, timezone
-from io import BytesIO
+from datetime import datetime
 from pathlib import Path
 from typing import Annotated, List
+from urllib.parse import parse_qs
 
-import requests
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import Body, Depends, FastAPI, HTTPException, status
+from fastapi import Body, Depends, FastAPI, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from fpdf import FPDF
-from jose import jwt
+from fastapi.responses import Response, StreamingResponse
+from jose import JWTError
 from langchain_core.prompts import PromptTemplate
 
-from AES_lib import encrypt_data, decrypt_data
-from api_auth.api_auth import ACCESS_TOKEN_EXPIRE_MINUTES, get_verify_api_key, SECRET_KEY, ALGORITHM
+from admission import ADMISSION_BATCH_WAIT, BATCH, INTERACTIVE, AdmissionMiddleware, admission
+from catalog_cache import catalog_cache
+from api_auth.api_auth import api_key_cache, get_verify_api_key
+from api_auth.session import authenticate, create_access_token, get_principal, invalidate_principal, principal_cache, \
+    register_user, revoke_tokens, token_cache, validate_token, verify_user_token
 from constants import *
-from database.connection import get_db_connection, query_db_with_params, close_connection
-from database.druid_connection import execute_druid_query
+from database.connection import get_db_connection, query_db_with_params, close_connection, pool_stats, reset_pool
 from database.minio_connection import *
+from historical_query import stream_historical_data
+from instrumentation import instrument, register_callback, timed_upstream
 # TODO: how to import modules from rag directory ??
 from model.agent import Answer, Question, AgentRequest
 from model.alert import Alert
@@ -35,45 +40,106 @@ from model.prediction import Json_in, Json_out
 from model.report import ReportResponse, Report, ScheduledReport
 from model.task import *
 from model.user import *
-from notification_service import send_notification, retrieve_alerts, send_report
-from user_settings_service import persist_user_settings, retrieve_user_settings, persist_dashboard_settings, \
-    load_dashboard_settings
+from report_jobs import create_report, report_jobs
+from response_layer import CompressionMiddleware, FastJSONResponse
+from single_flight import flight_key, flight_stats, flights
+from report_scheduler import ReportScheduler, list_schedules, save_schedule
+from upstream import UpstreamUnavailable, close_upstreams, upstream_stats, upstreams
+from alert_hub import ALERT_STREAM_HEARTBEAT, alert_hub
+from mail_outbox import mail_outbox
+from notification_service import ALERT_BATCH_MAX, ALERT_PAGE_MAX, ALERT_PAGE_SIZE, count_unread_alerts, \
+    retrieve_alerts, retrieve_pushed_alerts, save_alerts, send_notification, send_report
+from user_settings_service import DASHBOARD_SETTINGS, USER_SETTINGS, get_settings_entry, patch_settings, \
+    save_settings, settings_response
 
 env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 logging.basicConfig(level=logging.INFO)
 
-tasks: dict[str, Task] = dict()
-tasks_lock = asyncio.Lock()
-last_task_id = 0
+
+async def generate_and_send_report(userId: str, params: ScheduledReport):
+    """
+    This function generates a schedules report and sends it via email.
+    Args:
+        userId: the id of the user.
+        params: the settings of the report.
+    """
+    logging.info("Started scheduled report generation")
+    _, pdf = await produce_report(userId, params, True)
+    await run_in_threadpool(send_report, params.email, params.name, pdf)
 
 
-async def task_scheduler():
-    """Central scheduler that runs periodic tasks."""
-    while True:
-        async with tasks_lock:
-            for t in tasks.values():
-                logging.info(t.getDict().name)
-                if t.shouldRun():
-                    logging.info("Run task " + t.getDict().name)
-                    await t.run()
-        await asyncio.sleep(1)
+report_scheduler = ReportScheduler(job=generate_and_send_report)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager to start and stop the scheduler."""
-    scheduler_task = asyncio.create_task(task_scheduler())
+    scheduler_task = asyncio.create_task(report_scheduler.run(get_minio=get_minio_connection))
+    alert_hub.start(load=retrieve_pushed_alerts)
+    # the API keys are loaded in background, so that the admission control knows the consumers from the start
+    asyncio.get_running_loop().run_in_executor(None, api_key_cache.get, "gui")
     try:
         yield
     finally:
+        alert_hub.stop()  # Close the alert streams
         scheduler_task.cancel()  # Cancel the scheduler on application shutdown
+        report_jobs.shutdown()  # Cancel the report generations and stop the rendering processes
+        await run_in_threadpool(mail_outbox.close)  # Send the queued emails
+        reset_pool()  # Close the pooled database connections
+        await close_upstreams()  # Close the connections to the other services
         await scheduler_task  # Ensure it exits cleanly
 
 
-app = FastAPI(lifespan=lifespan)
+def api_key_principal(api_key: str) -> str:
+    """
+    The consumer of a request for the admission control: the microservice owning its API key.
+
+    A key is unverified while the API keys have not been loaded yet, unknown if it matches none of them.
+    """
+    if api_key is None:
+        return "anonymous"
+    return api_key_cache.principal(api_key) or ("unknown" if api_key_cache.loaded else "unverified")
+
 
+# The requests about a user, with its id in the path; the others may have it in the userId query parameter
+USER_PATH = re.compile(r"^/smartfactory/(?:alerts|settings|dashboardSettings|agent|user)/(\d+)")
+
+
+def rate_limit_key(scope, api_key: str):
+    """
+    The rate limit bucket of a request, so that the users of the GUI, who share its API key, do not share a bucket.
+
+    The bucket is the one of the user of the bearer token if the request has a valid one, otherwise of the user the
+    request is about, among the requests with the same API key, otherwise of the API key. Keys not matched yet (e.g.
+    before the API keys are loaded) are identified by their hash.
+
+    Args:
+        scope (dict): The ASGI scope of the request.
+        api_key (str): The X-API-Key header, None if missing.
+
+    Returns:
+        str or None: The key of the bucket, None for the bucket of the consumer (see api_key_principal).
+    """
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            try:
+                return f"user:{validate_token(value[7:].decode('latin-1'))['uid']}"
+            except (JWTError, KeyError):
+                break
+    if api_key is None:
+        return None
+    key_id = api_key_cache.principal(api_key) or "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    match = USER_PATH.match(scope["path"])
+    user_id = match.group(1) if match else parse_qs(scope["query_string"].decode("latin-1")).get("userId", [None])[0]
+    return f"{key_id}:user:{user_id}" if user_id is not None else key_id
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# inside CORS, so that the rejections can be read by the GUI
+app.add_middleware(AdmissionMiddleware, controller=admission, principal=api_key_principal, rate_key=rate_limit_key)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[FRONTEND_HOST],
@@ -81,6 +147,90 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+instrument(app)
+
+
+def register_metrics():
+    """Expose the usage of the pools, caches and queues of the API layer on /metrics."""
+    def pick(stats, *keys):
+        return {key: stats[key] for key in keys}
+
+    register_callback("db_pool_connections", "Pooled database connections, by state.",
+                      lambda: pick(pool_stats(), "in_use", "idle"), ("state",))
+    register_callback("db_pool_events_total", "Connections handed out, discarded and requests timed out.",
+                      lambda: pick(pool_stats(), "acquired", "discarded", "timeouts"), ("event",), kind="counter")
+    register_callback("cache_entries", "Entries kept in memory, by cache.",
+                      lambda: {"catalog": len(catalog_cache.stats()["catalogs"]),
+                               "principal": principal_cache.stats()["size"],
+                               "token": token_cache.stats()["size"]}, ("cache",))
+    register_callback("cache_lookups_total", "Lookups of the caches, by cache and result.",
+                      lambda: {(name, result): stats[result]
+                               for name, stats in (("catalog", catalog_cache.stats()),
+                                                   ("principal", principal_cache.stats()),
+                                                   ("token", token_cache.stats()))
+                               for result in ("hits", "misses")}, ("cache", "result"), kind="counter")
+    register_callback("upstream_circuit_open", "Whether the circuit breaker of an upstream is open.",
+                      lambda: {name: int(stats["circuit"] == "open") for name, stats in upstream_stats().items()},
+                      ("upstream",))
+    register_callback("mail_outbox_queued", "Emails waiting to be sent.", lambda: mail_outbox.stats()["queued"])
+    register_callback("mail_outbox_emails_total", "Emails sent, failed and dropped.",
+                      lambda: pick(mail_outbox.stats(), "sent", "failed", "dropped"), ("result",), kind="counter")
+    register_callback("alert_streams", "Open alert streams.", lambda: alert_hub.stats()["streams"])
+    register_callback("alert_hub_alerts_total", "Alerts published, pushed to a stream and dropped for slow clients.",
+                      lambda: pick(alert_hub.stats(), "published", "delivered", "dropped"), ("event",),
+                      kind="counter")
+    register_callback("single_flight_in_flight", "Upstream calls in flight, by flight.",
+                      lambda: {name: stats["in_flight"] for name, stats in flight_stats().items()}, ("flight",))
+    register_callback("single_flight_requests_total", "Requests making an upstream call (leader), merged into one "
+                      "in flight (merged), and failed calls (error), by flight.",
+                      lambda: {(name, result): stats[counter] for name, stats in flight_stats().items()
+                               for result, counter in (("leader", "leaders"), ("merged", "merged"),
+                                                       ("error", "errors"))},
+                      ("flight", "result"), kind="counter")
+    register_callback("admission_in_flight", "Requests being served, by route class.",
+                      lambda: admission.stats()["in_flight"], ("class",))
+    register_callback("admission_queue_depth", "Requests waiting for a free slot, by route class.",
+                      lambda: admission.stats()["queued"], ("class",))
+    register_callback("admission_requests_total", "Requests admitted, rate_limited (429), shed and timed out "
+                      "(timeout, 503), by consumer and route class.",
+                      lambda: admission.stats()["requests"], ("principal", "class", "result"), kind="counter")
+
+
+register_metrics()
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    """Answer 503 without waiting for a service whose circuit breaker is open."""
+    logging.error("UpstreamUnavailable: %s", str(exc))
+    return FastJSONResponse(content={"detail": str(exc)}, status_code=503)
+
+
+def validate_alert(alert: Alert):
+    """
+    Check that an alert can be notified.
+    Args:
+        alert (Alert): The alert object containing notification details.
+    Raises:
+        HTTPException: If any validation check fails.
+    """
+    if not alert.title:
+        logging.error("Missing notification title")
+        raise HTTPException(status_code=400, detail="Missing notification title")
+
+    if not alert.description:
+        logging.error("Missing notification description")
+        raise HTTPException(status_code=400, detail="Missing notification description")
+
+    if not alert.isPush and not alert.isEmail:
+        logging.error("No notification method selected")
+        raise HTTPException(status_code=400, detail="No notification method selected")
+
+    if not alert.recipients or len(alert.recipients) == 0:
+        logging.error("No recipients specified")
+        raise HTTPException(status_code=400, detail="No recipients specified")
 
 
 @app.post("/smartfactory/postAlert")
@@ -100,28 +250,13 @@ async def post_alert(alert: Alert, api_key: str = Depends(get_verify_api_key(["d
 
     try:
         logging.info("Received alert with title: %s", alert.description)
-
-        if not alert.title:
-            logging.error("Missing notification title")
-            raise HTTPException(status_code=400, detail="Missing notification title")
-
-        if not alert.description:
-            logging.error("Missing notification description")
-            raise HTTPException(status_code=400, detail="Missing notification description")
-
-        if not alert.isPush and not alert.isEmail:
-            logging.error("No notification method selected")
-            raise HTTPException(status_code=400, detail="No notification method selected")
-
-        if not alert.recipients or len(alert.recipients) == 0:
-            logging.error("No recipients specified")
-            raise HTTPException(status_code=400, detail="No recipients specified")
+        validate_alert(alert)
 
         logging.info("Sending notification")
-        send_notification(alert)
+        await run_in_threadpool(send_notification, alert)
         logging.info("Notification sent successfully")
 
-        return JSONResponse(content={"message": "Notification sent successfully"}, status_code=200)
+        return FastJSONResponse(content={"message": "Notification sent successfully"}, status_code=200)
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
         raise e
@@ -134,31 +269,124 @@ async def post_alert(alert: Alert, api_key: str = Depends(get_verify_api_key(["d
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/smartfactory/postAlerts")
+async def post_alerts(alerts: List[Alert], api_key: str = Depends(get_verify_api_key(["data"]))):
+    """
+    Endpoint to post a batch of alerts.
+    The alerts are validated as in /smartfactory/postAlert, the repetitions of an alert of the same machine,
+    type and title within ALERT_DEDUP_WINDOW seconds are discarded and the others are saved in a single
+    transaction; their recipients are then notified once for the whole batch.
+    Args:
+        alerts (List[Alert]): The alerts, at most ALERT_BATCH_MAX.
+    Returns:
+        Response: A Json with the number of alerts received and discarded as duplicates, and the ids of the
+        saved alerts.
+    Raises:
+        HTTPException: If any alert fails the validation checks or an unexpected error occurs.
+    """
+    if not alerts:
+        return FastJSONResponse(content={"received": 0, "duplicates": 0, "alertIds": []}, status_code=200)
+    if len(alerts) > ALERT_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {ALERT_BATCH_MAX} alerts per batch")
+    for index, alert in enumerate(alerts):
+        try:
+            validate_alert(alert)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Alert {index}: {e.detail}")
+
+    try:
+        result = await run_in_threadpool(save_alerts, alerts)
+        return FastJSONResponse(content=result, status_code=200)
+    except ValueError as e:
+        logging.error("ValueError: %s", str(e))
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/smartfactory/alerts/{userId}")
-def get_alerts(userId: str, all: bool = True, api_key: str = Depends(get_verify_api_key(["gui"]))):
+@app.get("/smartfactory/alerts/{userId}", dependencies=[Depends(verify_user_token)])
+def get_alerts(userId: str, all: bool = True, since_id: int = None, limit: int = ALERT_PAGE_SIZE,
+               api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
-    Retrieve alerts for a given user and return them as a JSON response.
+    Retrieve a page of alerts for a given user and return them as a JSON response.
 
     Args:
         userId (str): The ID of the user for whom to retrieve alerts.
         all (bool): Flag to indicate whether to retrieve all alerts or only active ones.
+        since_id (int): Only the alerts after this one are returned, the nextSinceId of the previous page.
+        limit (int): The maximum number of alerts in the page.
 
     Returns:
-        JSONResponse: A JSON response containing the list of alerts for the user.
+        JSONResponse: A JSON response containing the list of alerts for the user, the cursor of the next page
+        and whether more alerts may follow.
     """
     logging.info("Retrieving alerts for user: %s", userId)
-    list = retrieve_alerts(userId, all)
+    list = retrieve_alerts(userId, all, since_id, limit)
     logging.info("Alerts retrieved successfully for user: %s", userId)
 
-    return JSONResponse(content={"alerts": list}, status_code=200)
+    return FastJSONResponse(content={
+        "alerts": list,
+        "nextSinceId": list[-1]["alertId"] if list else since_id,
+        "hasMore": len(list) >= min(max(limit, 1), ALERT_PAGE_MAX)
+    }, status_code=200)
+
+
+@app.get("/smartfactory/alerts/{userId}/unread", dependencies=[Depends(verify_user_token)])
+def get_unread_alerts_count(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
+    """
+    Count the unread alerts of a user, without reading them.
+
+    Args:
+        userId (str): The ID of the user.
+
+    Returns:
+        JSONResponse: A JSON response with the number of unread alerts.
+    """
+    return FastJSONResponse(content={"unread": count_unread_alerts(userId)}, status_code=200)
+
+
+@app.get("/smartfactory/alerts/{userId}/stream", dependencies=[Depends(verify_user_token)])
+async def stream_alerts(userId: int, request: Request, api_key: str = Depends(get_verify_api_key(["gui"]))):
+    """
+    Push the new alerts of a user as Server-Sent Events, as soon as they are saved.
+
+    Every alert is an "alert" event with the alert as data and its ID as event ID; a comment is sent every
+    ALERT_STREAM_HEARTBEAT seconds to keep the connection open. Alerts missed while disconnected are read from
+    /smartfactory/alerts/{userId}.
 
+    Args:
+        userId (int): The ID of the user.
 
-@app.post("/smartfactory/settings/{userId}")
+    Returns:
+        StreamingResponse: The text/event-stream of the alerts.
+    """
+    queue = alert_hub.subscribe(userId)
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    alert = await asyncio.wait_for(queue.get(), timeout=ALERT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if alert is None:
+                    break
+                yield f"event: alert\nid: {alert['alertId']}\ndata: {json.dumps(alert, default=str)}\n\n"
+        finally:
+            alert_hub.unsubscribe(userId, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"})
+
+
+@app.post("/smartfactory/settings/{userId}", dependencies=[Depends(verify_user_token)])
 def save_user_settings(userId: str, settings: dict, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to save user settings.
@@ -167,35 +395,67 @@ def save_user_settings(userId: str, settings: dict, api_key: str = Depends(get_v
         userId (str): The ID of the user.
         settings (dict): The settings to be saved.
     Returns:
-        Response: A response object with status code 200 if the settings are saved successfully.
+        Response: A response object with status code 200 if the settings are saved successfully, with the ETag
+        of the saved settings.
     Raises:
-        HTTPException: If an unexpected error occurs.
+        HTTPException: If the user is not found or an unexpected error occurs.
     """
     try:
-        if persist_user_settings(userId, settings) == False:
+        entry = save_settings(userId, USER_SETTINGS, settings)
+        if entry is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        return JSONResponse(content={"message": "Settings saved successfully"}, status_code=200)
+        return FastJSONResponse(content={"message": "Settings saved successfully"}, status_code=200,
+                            headers={"ETag": entry.etag})
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/smartfactory/settings/{userId}")
-def get_user_settings(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
+@app.patch("/smartfactory/settings/{userId}", dependencies=[Depends(verify_user_token)])
+def update_user_settings(userId: str, changes: dict, api_key: str = Depends(get_verify_api_key(["gui"]))):
+    """
+    Endpoint to change some user settings.
+    The top-level keys received replace the saved ones, the keys set to null are removed.
+    Args:
+        userId (str): The ID of the user.
+        changes (dict): The settings to change.
+    Returns:
+        Response: The updated settings, with their ETag.
+    Raises:
+        HTTPException: If the user is not found or an unexpected error occurs.
+    """
+    try:
+        entry = patch_settings(userId, USER_SETTINGS, changes)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return settings_response(entry)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error("Exception: %s", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/smartfactory/settings/{userId}", dependencies=[Depends(verify_user_token)])
+def get_user_settings(userId: str, request: Request, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to get user settings.
-    This endpoint receives a user ID and returns the settings for that user.
+    This endpoint receives a user ID and returns the settings for that user. Clients sending the ETag of their
+    copy in If-None-Match receive a 304 without body while the settings are unchanged.
     Args:
         userId (str): The ID of the user.
+        request (Request): The request, its If-None-Match header is checked against the ETag of the settings.
     Returns:
         dict: A dictionary containing the user settings.
     Raises:
         HTTPException: If an unexpected error occurs.
     """
     try:
-        settings = retrieve_user_settings(userId)
-        return JSONResponse(content=settings, status_code=200)
+        entry = get_settings_entry(userId, USER_SETTINGS)
+        return settings_response(entry, request.headers.get("if-none-match"))
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -214,43 +474,24 @@ def login(body: Login, api_key: str = Depends(get_verify_api_key(["gui"]))):
         HTTPException: If any validation check fails or an unexpected error occurs.
     """
     try:
-        connection, cursor = get_db_connection()
-        query = "SELECT * FROM Users WHERE " + ("Email" if body.isEmail else "Username") + "=%s"
-        key = bytes.fromhex(os.getenv("AES_KEY").strip())
-        response = query_db_with_params(cursor, connection, query, (encrypt_data(body.user, key),))
-
-        if not response or (body.password != response[0][4]):
+        principal = authenticate(body.user, body.isEmail, body.password)
+        if principal is None:
             logging.error("Invalid credentials")
             raise HTTPException(status_code=401, detail="Invalid username or password")
-
-        result = response[0]
-        close_connection(connection, cursor)
         logging.info("User logged in successfully")
 
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = jwt.encode(
-            {"sub": result[1], "role": result[3], "exp": datetime.now(timezone.utc) + access_token_expires},
-            SECRET_KEY,
-            algorithm=ALGORITHM
-        )
-        logging.info(result)
-        dec_username, dec_email, dec_site = decrypt_data(result[1], key), decrypt_data(result[2], key), decrypt_data(
-            result[5], key)
-        user = UserInfo(userId=result[0], username=dec_username, email=dec_email, role=result[3],
-                        access_token=access_token, site=dec_site)
-        return JSONResponse(content=user.to_dict(), status_code=200)
+        user = UserInfo(**principal, access_token=create_access_token(principal))
+        return FastJSONResponse(content=user.to_dict(), status_code=200)
 
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
-        close_connection(connection, cursor)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/smartfactory/logout")
+@app.post("/smartfactory/logout", dependencies=[Depends(verify_user_token)])
 def logout(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to logout a user.
@@ -263,21 +504,16 @@ def logout(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
         HTTPException: If the user is not present in the database.
     """
     try:
-        connection, cursor = get_db_connection()
-        query = "SELECT UserID FROM Users WHERE UserID=%s"
-        response = query_db_with_params(cursor, connection, query, (int(userId),))
-        logging.info(response)
-        if (len(response) == 0):
+        if get_principal(int(userId)) is None:
             raise HTTPException(status_code=404, detail="User not found")
-        close_connection(connection, cursor)
-        return JSONResponse(content={"message": "User logged out successfully"}, status_code=200)
+        invalidate_principal(int(userId))
+        revoke_tokens(int(userId))
+        return FastJSONResponse(content={"message": "User logged out successfully"}, status_code=200)
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
-        close_connection(connection, cursor)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -294,40 +530,24 @@ def register(body: Register, api_key: str = Depends(get_verify_api_key(["gui"]))
         HTTPException: If the user is already present in the database.
     """
     try:
-        connection, cursor = get_db_connection()
-        # Check if user already exists
-        query = "SELECT * FROM Users WHERE Username = %s OR Email = %s"
-        key = bytes.fromhex(os.getenv("AES_KEY").strip())
-        enc_username, enc_email = encrypt_data(body.username, key), encrypt_data(body.email, key)
-        response = query_db_with_params(cursor, connection, query, (enc_username, enc_email))
-        user_exists = response
-        logging.info(user_exists)
-
-        if user_exists:
+        # the user is inserted only if it does not exist yet
+        userid = register_user(body.username, body.email, body.role, body.password, body.site)
+        if userid is None:
             logging.error("User already registered")
             raise HTTPException(status_code=400, detail="User already registered")
-        else:
-            enc_site = encrypt_data(body.site, key)
-            # Insert new user into the database
-            query_insert = "INSERT INTO Users (Username, Email, Role, Password, SiteName) VALUES (%s, %s, %s, %s, %s) RETURNING UserID;"
-            cursor.execute(query_insert, (enc_username, enc_email, body.role, body.password, enc_site))
-            connection.commit()
-            userid = cursor.fetchone()[0]
-            close_connection(connection, cursor)
-            return UserInfo(userId=str(userid), username=body.username, email=body.email, role=body.role,
-                            site=body.site, access_token='')
+        return UserInfo(userId=str(userid), username=body.username, email=body.email, role=body.role,
+                        site=body.site, access_token='')
 
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
-        close_connection(connection, cursor)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.put("/smartfactory/user/{userId}", status_code=status.HTTP_201_CREATED)
+@app.put("/smartfactory/user/{userId}", status_code=status.HTTP_201_CREATED,
+         dependencies=[Depends(verify_user_token)])
 def change_password(userId: str, body: ChangePassword, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to change a user's password.
@@ -339,8 +559,11 @@ def change_password(userId: str, body: ChangePassword, api_key: str = Depends(ge
     Raises:
         HTTPException: If the user is not present in the database, the old password is incorrect, or an unexpected error occurs
     """
+    connection, cursor = None, None
     try:
         connection, cursor = get_db_connection()
+        if connection is None:
+            raise HTTPException(status_code=503, detail="Database connection failed")
         # Check if old password is correct
         query = "SELECT Password FROM Users WHERE UserID = %s"
         response = query_db_with_params(cursor, connection, query, (userId,))
@@ -349,7 +572,7 @@ def change_password(userId: str, body: ChangePassword, api_key: str = Depends(ge
         try:
             if not body.old_password == response[0][0]:
                 logging.error("Invalid old password")
-                return JSONResponse(content={"message": "Invalid old password"}, status_code=401)
+                return FastJSONResponse(content={"message": "Invalid old password"}, status_code=401)
         except ValueError as e:
             # logging.error("Password not hashed")
             raise HTTPException(status_code=500, detail=f"ERROR: {str(e)}")
@@ -363,27 +586,29 @@ def change_password(userId: str, body: ChangePassword, api_key: str = Depends(ge
         if result == 0:
             raise HTTPException(status_code=404, detail="User not found")
 
-        close_connection(connection, cursor)
-        return JSONResponse(content={"message": "Password changed successfully"}, status_code=200)
+        return FastJSONResponse(content={"message": "Password changed successfully"}, status_code=200)
 
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
 
     except Exception as e:
         logging.error("Exception: %s", str(e))
-        close_connection(connection, cursor)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # the connection goes back to the pool on every path
+        close_connection(connection, cursor)
 
 
-@app.get("/smartfactory/dashboardSettings/{userId}")
-def retrieve_dashboard_settings(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
+@app.get("/smartfactory/dashboardSettings/{userId}", dependencies=[Depends(verify_user_token)])
+def retrieve_dashboard_settings(userId: str, request: Request, api_key: str = Depends(get_verify_api_key(["gui"]))):
     '''
     Endpoint to load dashboard disposition from the Database.
     This endpoint receives a user ID and returns the JSON string containing the (tree-like) disposition of the user's dashboards.
+    Clients sending the ETag of their copy in If-None-Match receive a 304 without body while it is unchanged.
     Args:
         userId (str): The ID of the user of whom to retrieve data.
+        request (Request): The request, its If-None-Match header is checked against the ETag of the disposition.
     Returns:
         dashboard_settings: JSON string containing the dashboard disposition.
     Raises:
@@ -391,14 +616,14 @@ def retrieve_dashboard_settings(userId: str, api_key: str = Depends(get_verify_a
 
     '''
     try:
-        settings = load_dashboard_settings(userId)
-        return JSONResponse(content=settings, status_code=200)
+        entry = get_settings_entry(userId, DASHBOARD_SETTINGS)
+        return settings_response(entry, request.headers.get("if-none-match"))
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/smartfactory/dashboardSettings/{userId}")
+@app.post("/smartfactory/dashboardSettings/{userId}", dependencies=[Depends(verify_user_token)])
 def post_dashboard_settings(userId: str, dashboard_settings: dict, api_key: str = Depends(get_verify_api_key(["gui"]))):
     '''
     Endpoint to save the dashboard disposition to the Database.
@@ -407,21 +632,51 @@ def post_dashboard_settings(userId: str, dashboard_settings: dict, api_key: str
         userId (str): The ID of the user.
         dashboard_settings (dict): The dashboard disposition to be saved.
     Returns:
-        Response: A response object with status code 200 if the dashboard disposition is saved successfully.
+        Response: A response object with status code 200 if the dashboard disposition is saved successfully, with
+        the ETag of the saved disposition.
     Raises:
-        HTTPException: If an unexpected error occurs.
+        HTTPException: If the user is not found or an unexpected error occurs.
     '''
     try:
-        if persist_dashboard_settings(userId, dashboard_settings) == False:
+        entry = save_settings(userId, DASHBOARD_SETTINGS, dashboard_settings)
+        if entry is None:
             raise HTTPException(status_code=404, detail="User not found")
 
-        return JSONResponse(content={"message": "Settings saved successfully"}, status_code=200)
+        return FastJSONResponse(content={"message": "Settings saved successfully"}, status_code=200,
+                            headers={"ETag": entry.etag})
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/smartfactory/reports")
+@app.patch("/smartfactory/dashboardSettings/{userId}", dependencies=[Depends(verify_user_token)])
+def update_dashboard_settings(userId: str, changes: dict, api_key: str = Depends(get_verify_api_key(["gui"]))):
+    '''
+    Endpoint to change part of the dashboard disposition.
+    The top-level keys received replace the saved ones, the keys set to null are removed.
+    Args:
+        userId (str): The ID of the user.
+        changes (dict): The keys of the disposition to change.
+    Returns:
+        Response: The updated disposition, with its ETag.
+    Raises:
+        HTTPException: If the user is not found or an unexpected error occurs.
+    '''
+    try:
+        entry = patch_settings(userId, DASHBOARD_SETTINGS, changes)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return settings_response(entry)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error("Exception: %s", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/smartfactory/reports", dependencies=[Depends(verify_user_token)])
 def retrieve_reports(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to retrieve a user's reports.
@@ -433,22 +688,29 @@ def retrieve_reports(userId: str, api_key: str = Depends(get_verify_api_key(["gu
     Raises:
         HTTPException: If a server exception occurs.
     """
+    connection, cursor = None, None
     try:
         connection, cursor = get_db_connection()
+        if connection is None:
+            raise HTTPException(status_code=503, detail="Database connection failed")
         query = "SELECT ReportID, Name, Type, FilePath FROM Reports WHERE OwnerID = %s"
         response = query_db_with_params(cursor, connection, query, (int(userId),))
         if not response or response[0] is None:
             logging.info("No reports for userID %s", str(userId))
-            return JSONResponse(content={"data": []}, status_code=200)
+            return FastJSONResponse(content={"data": []}, status_code=200)
         reports = []
         for row in response:
             rep = ReportResponse(id=row[0], name=row[1], type=row[2])
             reports.append(rep.model_dump())
-        close_connection(connection, cursor)
-        return JSONResponse(content={"data": reports}, status_code=200)
+        return FastJSONResponse(content={"data": reports}, status_code=200)
+    except HTTPException as e:
+        logging.error("HTTPException: %s", e.detail)
+        raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        close_connection(connection, cursor)
 
 
 @app.get("/smartfactory/reports/download/{report_id}")
@@ -463,34 +725,47 @@ def download_report(report_id: int, api_key: str = Depends(get_verify_api_key(["
     Raises:
         HTTPException: If a server exception occurs or the report is not found.
     """
+    connection, cursor = None, None
     try:
         connection, cursor = get_db_connection()
+        if connection is None:
+            raise HTTPException(status_code=503, detail="Database connection failed")
         query = "SELECT ReportID, Name, OwnerID, FilePath FROM Reports WHERE ReportID = %s"
         response = query_db_with_params(cursor, connection, query, (report_id,))
         if not response or response[0] is None:
             raise HTTPException(status_code=404, detail="Report not found")
         file_name = response[0][1]
         ownerID = str(response[0][2])
-        tmp_path = "/tmp/" + ownerID + "_" + file_name + ".pdf"
-        minio = get_minio_connection()
-        download_object(minio, "reports", ownerID + "/" + file_name, tmp_path)
+        # given back before the download, which can take long
         close_connection(connection, cursor)
-        return FileResponse(
-            path=tmp_path,
+        minio = get_minio_connection()
+        with timed_upstream("minio"):
+            obj = minio.get_object("reports", ownerID + "/" + file_name)
+
+        def content():
+            # the object is sent as it is read from MinIO, without a temporary file
+            try:
+                yield from obj.stream(64 * 1024)
+            finally:
+                obj.close()
+                obj.release_conn()
+
+        return StreamingResponse(
+            content(),
             media_type="application/pdf",
-            filename="downloaded_example.pdf"
+            headers={"Content-Disposition": 'attachment; filename="downloaded_example.pdf"'}
         )
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
-        close_connection(connection, cursor)
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        close_connection(connection, cursor)
 
 
-def call_ai_agent(input: Question):
+async def call_ai_agent(input: Question):
     """
     This function performs a call to the RAG AI agent.
     Args:
@@ -508,176 +783,108 @@ def call_ai_agent(input: Question):
         'requestType': input.requestType
     }
     print(f"sending request to RAG API: {body}")
-    response = requests.post(os.getenv('RAG_API_ENDPOINT'), headers=headers, json=body)
+    response = await upstreams["rag"].post(os.getenv('RAG_API_ENDPOINT'), headers=headers, json=body)
     response.raise_for_status()
     return response
 
 
-def create_report_pdf(answer: Answer, userId: str, tmp_path: str, obj_name: str, type: str = None):
+async def produce_report(userId: str, params: Union[Report, ScheduledReport], is_scheduled: bool = False) -> tuple:
     """
-    This function inserts the report PDF in the DB.
+    This function asks the AI agent for the content of a report and creates its PDF.
     Args:
-        answer: the Answer object from the AI agent.
         userId: the id of the user.
-        tmp_path: the path where to save the .
-        type: the type of the report.
+        params: the settings of the report to generate, as Report or ScheduledReport.
+        is_scheduled: check if the generate comes from a scheduled process.
     Returns:
-        The id of the report.
+        The id of the report and the content of the PDF.
+    Raises:
+        Rejected: If the AI agent is too busy to accept the report, see admission.
     """
-    connection, cursor = get_db_connection()
-    obj_path = "/reports/" + userId + "/" + obj_name + ".pdf"
-    # if answer is a dict, access the data via ['data']
-    if isinstance(answer, dict):
-        create_pdf(answer["data"], answer["textExplanation"], tmp_path)
+    if is_scheduled:
+        now = time.time()
+        now_str = datetime.fromtimestamp(now).strftime("%d/%m/%Y")
+        start_str = datetime.fromtimestamp((now - params.recurrence.seconds)).strftime("%d/%m/%Y")
+        period = start_str + " - " + now_str
     else:
-        create_pdf(answer.data, answer.textExplanation, tmp_path)
-    minio = get_minio_connection()
-    upload_object(minio, "reports", userId + "/" + obj_name + ".pdf", tmp_path, "application/pdf")
-    query_insert = "INSERT INTO Reports (Name, Type, OwnerId, GeneratedAt, FilePath, SiteName) VALUES (%s, %s, %s, %s, %s, %s) RETURNING ReportID, Name, Type;"
-    cursor.execute(query_insert,
-                   (obj_name + ".pdf", type or "Standard", int(userId), datetime.now(), obj_path, "Test",))
-    connection.commit()
-    # return the report id
-    response = cursor.fetchone()
-    close_connection(connection, cursor)
-    return response[0]
-
-
-def create_pdf(text: str, appendix: str, path: str):
-    """
-    This function creates a PDF file.
-    Args:
-        text: the text of the PDF.
-        appendix: the appendix of the PDF.
-        path: the path where to save the PDF.
-    """
-    pdf = FPDF()
-    try:
-        pdf.set_font('Arial', '', 12)
-        pdf.add_page()
-        lines = text.split("\n")
-        for line in lines:
-            if len(line) > 0:
-                pdf.multi_cell(190, 5, line)
-            else:
-                pdf.ln()
-        pdf.add_page()
-        pdf.set_font('Arial', 'B', 12)
-        pdf.cell(190, 5, "Explanation")
-        pdf.ln()
-        pdf.ln()
-        pdf.set_font('Arial', '', 12)
-        appendix = json.loads(appendix)
-        for obj in appendix:
-            if obj.get("context", None) is not None and obj.get("reference_number", None) is not None and obj.get(
-                    "source_name", None) is not None:
-                pdf.cell(190, 5, "[" + str(obj["reference_number"]) + "]")
-                pdf.ln()
-                pdf.cell(190, 5, "Context:")
-                lines = obj["context"].split("\n")
-                for line in lines:
-                    if len(line) > 0:
-                        pdf.multi_cell(190, 5, line)
-                    else:
-                        pdf.ln()
-                pdf.ln()
-                pdf.set_text_color(0, 0, 255)
-                pdf.cell(190, 5, "Source: " + str(obj["source_name"]))
-                pdf.set_text_color(0, 0, 0)
-                pdf.ln()
-                pdf.ln()
-    except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-        print(exc_type, fname, exc_tb.tb_lineno)
-    pdf.output(name=path, dest="F")
-
-
-@app.post("/smartfactory/reports/generate", status_code=status.HTTP_201_CREATED)
-def generate_report(userId: Annotated[str, Body()], params: Annotated[Union[Report, ScheduledReport], Body()],
-                    is_scheduled: bool = False, api_key: str = Depends(get_verify_api_key(["gui"]))):
+        period = params.period
+    prompt = PromptTemplate(
+        input_variables=["period", "kpi", "machines"],
+        template=(
+            "Generate the periodic report for the period {period}, including the "
+            "following KPIs: {kpi}; the KPIs concern the specified machines: {machines}."
+        )
+    )
+    filled_prompt = prompt.format(
+        period=period,
+        kpi=",".join(params.kpis),
+        machines=",".join(params.machines)
+    )
+    question = Question(userInput=filled_prompt, userId=userId, requestType="scheduledReport")
+    # the reports share the slots of the AI agent with the chat, the scheduled ones after the interactive requests
+    async with admission.admit("scheduler" if is_scheduled else "reports", "agent",
+                               BATCH if is_scheduled else INTERACTIVE, rate_limited=False,
+                               timeout=ADMISSION_BATCH_WAIT if is_scheduled else None):
+        ai_response = (await call_ai_agent(question)).json()
+    logging.info(ai_response)
+    answer = Answer.model_validate(ai_response)
+    return await create_report(answer, userId, params.name + ("_periodic" if is_scheduled else ""),
+                               "Periodic" if is_scheduled else params.type)
+
+
+@app.post("/smartfactory/reports/generate", status_code=status.HTTP_202_ACCEPTED)
+async def generate_report(userId: Annotated[str, Body()], params: Annotated[Union[Report, ScheduledReport], Body()],
+                          api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
-    Endpoint to download a report.
-    This endpoint receives the report id and sends back the report data in pdf format.
+    Endpoint to generate a report.
+    This endpoint receives the settings of a report and queues its generation, which runs in the background.
     Args:
         userId: the id of the user.
         params: the settings of the report to generate, as Report or ScheduledReport.
-        is_scheduled: check if the generate comes from a scheduled process.
     Returns:
-        A PDF file.
+        The id of the job generating the report, see /smartfactory/reports/jobs/{job_id}.
     Raises:
         HTTPException: If a server exception occurs or the user is not found.
     """
     try:
-        connection, cursor = get_db_connection()
-        query = "SELECT UserID FROM Users WHERE UserID = %s"
-        response = query_db_with_params(cursor, connection, query, (int(userId),))
-        if not response:
+        principal = await run_in_threadpool(get_principal, int(userId))
+        if principal is None:
             logging.error("User not found")
             raise HTTPException(status_code=404, detail="User not found")
-        userId = str(response[0][0])
-        period = ""
-        if is_scheduled:
-            now = time.time()
-            now_str = datetime.fromtimestamp(now).strftime("%d/%m/%Y")
-            start_str = datetime.fromtimestamp((now - params.recurrence.seconds)).strftime("%d/%m/%Y")
-            period = start_str + " - " + now_str
-        else:
-            period = params.period
-        prompt = PromptTemplate(
-            input_variables=["period", "kpi", "machines"],
-            template=(
-                "Generate the periodic report for the period {period}, including the "
-                "following KPIs: {kpi}; the KPIs concern the specified machines: {machines}."
-            )
-        )
-        filled_prompt = prompt.format(
-            period=period,
-            kpi=",".join(params.kpis),
-            machines=",".join(params.machines)
-        )
-        question = Question(userInput=filled_prompt, userId=userId, requestType="scheduledReport")
-        ai_response = call_ai_agent(question).json()
-        logging.info(ai_response)
-        answer = Answer.model_validate(ai_response)
-        tmp_path = "/tmp/" + userId + "_" + params.name + ".pdf"
-        create_report_pdf(answer, userId, tmp_path, params.name + ("_periodic" if is_scheduled else ""),
-                          "Periodic" if is_scheduled else params.type)
-        close_connection(connection, cursor)
-        if is_scheduled:
-            return (params.name, params.email, tmp_path)
-        return FileResponse(
-            path=tmp_path,
-            media_type="application/pdf",
-            filename="downloaded_example.pdf"
-        )
+        userId = str(principal["userId"])
+
+        async def work():
+            report_id, _ = await produce_report(userId, params)
+            return report_id
+
+        job_id = await report_jobs.submit(int(userId), work)
+        return FastJSONResponse(content={"jobId": job_id, "status": "queued"}, status_code=status.HTTP_202_ACCEPTED)
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-        print(exc_type, fname, exc_tb.tb_lineno)
         logging.error("Exception: %s", str(e))
-        close_connection(connection, cursor)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def generate_and_send_report(userId: str, email: str, params: ScheduledReport, api_key: str):
+@app.get("/smartfactory/reports/jobs/{job_id}")
+async def retrieve_report_job(job_id: int, wait: float = 0, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
-    This function generates a schedules report and sends it via email.
+    Endpoint to retrieve the status of a report generation.
     Args:
-        userId: the id of the user.
-        email: the email where to send the report.
-        params: the settings of the report.
+        job_id: the id of the job, returned by /smartfactory/reports/generate.
+        wait: seconds to wait for the completion of the job before answering (at most 30), 0 to answer at once.
+    Returns:
+        A Json with jobId, status (queued, running, done or failed), reportId when done and error when failed.
+    Raises:
+        HTTPException: If the job is not found.
     """
-    logging.info("Started scheduled report generation")
-    report_name, to_email, tmp_path = generate_report(userId, params, True, api_key)
-    send_report(to_email, report_name, tmp_path)
+    job = await report_jobs.status(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(content=job, status_code=200)
 
 
-@app.get("/smartfactory/reports/schedule")
+@app.get("/smartfactory/reports/schedule", dependencies=[Depends(verify_user_token)])
 def retrieve_schedules(userId: str, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to retrieve the schedules.
@@ -686,23 +893,14 @@ def retrieve_schedules(userId: str, api_key: str = Depends(get_verify_api_key(["
         userId: the id of the user.
     Returns:
         A Json file with the list of ScheduledReport objects.
+    Raises:
+        HTTPException: If a server exception occurs.
     """
-    schedules = []
-    minio = get_minio_connection()
-    objects = minio.list_objects(bucket_name="settings", recursive=True)
-    matching_files = []
-    for obj in objects:
-        logging.info(obj.object_name)
-        if obj.object_name.endswith("_scheduling.json") and (userId + "/") in obj.object_name:
-            matching_files.append(obj.object_name.split('/')[-1])
-    logging.info(matching_files)
-    for file_name in matching_files:
-        response = minio.get_object("settings", userId + "/" + file_name)
-        json_str = response.read().decode("utf-8")
-        logging.info(json_str)
-        sched = json.loads(json_str)
-        schedules.append(sched)
-    return JSONResponse(content={"data": schedules}, status_code=200)
+    try:
+        return FastJSONResponse(content={"data": list_schedules(int(userId))}, status_code=200)
+    except Exception as e:
+        logging.error("Exception: %s", str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/smartfactory/reports/schedule", status_code=status.HTTP_200_OK)
@@ -718,57 +916,39 @@ async def schedule_report(userId: Annotated[str, Body()], params: Annotated[Sche
         HTTPException: If a server exception occurs or the user is not found.
     """
     try:
-        connection, cursor = get_db_connection()
-        query = "SELECT UserID, Email FROM Users WHERE UserID = %s"
-        response = query_db_with_params(cursor, connection, query, (int(userId),))
-        if not response:
+        if await run_in_threadpool(get_principal, int(userId)) is None:
             logging.error("User not found")
             raise HTTPException(status_code=404, detail="User not found")
-        email = response[0][1]
-        close_connection(connection, cursor)
-        logging.info(params.id)
-        if params.id is None:
-            logging.info("Insert scheduling")
-            global last_task_id
-            last_task_id = last_task_id + 1
-            params.id = last_task_id
-        elif str(params.id) in tasks.keys():
-            logging.info("Update scheduling")
-            params.name = tasks.get(str(params.id)).getDict().name
-        json_str = params.model_dump_json()
-        minio = get_minio_connection()
-        minio.put_object("settings", userId + "/" + params.name + "_scheduling.json", BytesIO(json_str.encode("utf-8")),
-                         length=len(json_str), content_type="application/json")
-        async with tasks_lock:
-            tasks[str(params.id)] = Task(func=generate_and_send_report, args=(userId, email, params, api_key),
-                                         delay=params.recurrence.seconds, json=params, start_date=params.startDate)
+        logging.info("%s scheduling %s", "Update" if params.id is not None else "Insert", params.id)
+        # the schedule is stored in ReportSchedules, where the scheduler of any API process picks it up
+        await run_in_threadpool(save_schedule, int(userId), params)
     except HTTPException as e:
         logging.error("HTTPException: %s", e.detail)
-        close_connection(connection, cursor)
         raise e
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/smartfactory/kpi", status_code=status.HTTP_200_OK)
-def get_kpi(_: str = Depends(get_verify_api_key(["gui"]))):
+async def get_kb_catalog(name: str, request: Request) -> Response:
     """
-    Retrieve all Key Performance Indicators (KPIs) from the knowledge base.
+    Serve a catalog of the knowledge base (KPIs or machines) from the catalog cache.
 
-    This function constructs a URL using the host and port specified in the environment variables
-    `KB_HOST` and `KB_PORT`. It then sends a GET request to the constructed URL to retrieve KPIs.
-    The request includes an API key in the headers for authentication.
+    The catalog is downloaded from the knowledge base only when it is not cached or when the version of the
+    ontology changed since it was cached; concurrent requests missing the cache share a single download. The
+    response carries an ETag, so that clients sending it back in If-None-Match receive a 304 without body while
+    the catalog is unchanged.
 
     Args:
-        _: str: A dependency injection placeholder for API key verification.
+        name (str): The name of the catalog endpoint of the knowledge base, retrieveKPIs or retrieveMachines.
+        request (Request): The request of the client.
 
     Returns:
-        JSONResponse: A JSON response containing the KPIs retrieved from the knowledge base with a status code of 200.
+        Response: The catalog, 304 if the client copy is current, or the error of the knowledge base with its
+            status.
     """
     KB_HOST = os.getenv("KB_HOST", "kb")
     KB_PORT = os.getenv("KB_PORT", "8000")
-    url = f"http://{KB_HOST}:{KB_PORT}/kb/retrieveKPIs"
 
     api_key = os.getenv("API_KEY")
     headers = {
@@ -776,40 +956,69 @@ def get_kpi(_: str = Depends(get_verify_api_key(["gui"]))):
         'x-api-key': api_key
     }
 
+    async def refresh():
+        # the version is read before the catalog, a change in between is caught at the next check
+        version = None
+        response = await upstreams["kb"].get(f"http://{KB_HOST}:{KB_PORT}/kb/version", headers=headers)
+        if response.status_code == 200:
+            version = response.json().get("version")
+        entry = catalog_cache.revalidate(name, version)
+        if entry is not None:
+            return entry, None
+
+        response = await upstreams["kb"].get(f"http://{KB_HOST}:{KB_PORT}/kb/{name}", headers=headers)
+        if response.status_code != 200:
+            return None, response
+        return catalog_cache.put(name, response.json(), version), None
+
+    entry = catalog_cache.get(name)
+    if entry is None:
+        entry, error = await flights["catalog"].do(flight_key(name), refresh)
+        if entry is None:
+            # the error of the knowledge base is forwarded with its status
+            return Response(content=error.content, status_code=error.status_code, media_type="application/json")
+
+    return catalog_cache.response(entry, request.headers.get("if-none-match"))
+
+
+@app.get("/smartfactory/kpi", status_code=status.HTTP_200_OK)
+async def get_kpi(request: Request, _: str = Depends(get_verify_api_key(["gui"]))):
+    """
+    Retrieve all Key Performance Indicators (KPIs) from the knowledge base.
+
+    The KPIs are served from the catalog cache, see get_kb_catalog.
+
+    Args:
+        request (Request): The request, its If-None-Match header is checked against the ETag of the catalog.
+        _: str: A dependency injection placeholder for API key verification.
+
+    Returns:
+        Response: A JSON response containing the KPIs retrieved from the knowledge base with a status code of 200,
+                  or 304 if they did not change.
+    """
     logging.info("Retrieving all KPIs")
-    response = requests.get(url, headers=headers)
-    return JSONResponse(content=response.json(), status_code=200)
+    return await get_kb_catalog("retrieveKPIs", request)
 
 
 @app.get("/smartfactory/retrieveMachines", status_code=status.HTTP_200_OK)
-def get_machines(_: str = Depends(get_verify_api_key(["gui"]))):
+async def get_machines(request: Request, _: str = Depends(get_verify_api_key(["gui"]))):
     """
     Retrieve all machines from the knowledge base.
 
-    This function sends a GET request to the knowledge base service to retrieve
-    information about all machines. It requires an API key for authentication.
+    The machines are served from the catalog cache, see get_kb_catalog.
 
     Args:
+        request (Request): The request, its If-None-Match header is checked against the ETag of the catalog.
         _: A dependency injection placeholder for API key verification.
 
     Returns:
-        JSONResponse: A JSON response containing the list of machines and a status code of 200.
+        Response: A JSON response containing the list of machines and a status code of 200, or 304 if it did not
+                  change.
     """
-    KB_HOST = os.getenv("KB_HOST", "kb")
-    KB_PORT = os.getenv("KB_PORT", "8000")
-    url = f"http://{KB_HOST}:{KB_PORT}/kb/retrieveMachines"
-
-    api_key = os.getenv("API_KEY")
-    headers = {
-        'Content-Type': 'application/json',
-        'x-api-key': api_key
-    }
-
     logging.info("Retrieving all Machines")
-    response = requests.get(url, headers=headers)
-    return JSONResponse(content=response.json(), status_code=200)
+    return await get_kb_catalog("retrieveMachines", request)
 
-def validate_kpi(kpi: str) -> str:
+async def validate_kpi(kpi: str) -> str:
     """
     Ask the knowledge base to validate the KPI.
     
@@ -836,7 +1045,7 @@ def validate_kpi(kpi: str) -> str:
         kpi = {"is_valid": False, "error": "An invalid JSON has been generated."}
         return json.dumps(kpi)
 
-    response = requests.post(url, json=kpi, headers=headers)
+    response = await upstreams["kb"].post(url, json=kpi, headers=headers)
 
     kpi["is_valid"] = response.json()["Status"] == 0
 
@@ -844,7 +1053,7 @@ def validate_kpi(kpi: str) -> str:
 
 
 @app.post("/smartfactory/kpi", status_code=status.HTTP_200_OK)
-def insert_kpi(kpi: Kpi_info, _: str = Depends(get_verify_api_key(["gui"]))):
+async def insert_kpi(kpi: Kpi_info, _: str = Depends(get_verify_api_key(["gui"]))):
     """
     Inserts a KPI (Key Performance Indicator) into the knowledge base.
 
@@ -873,23 +1082,25 @@ def insert_kpi(kpi: Kpi_info, _: str = Depends(get_verify_api_key(["gui"]))):
 
     kpi_dict = kpi.to_dict()
 
-    response = requests.post(url, json=kpi_dict, headers=headers)
+    response = await upstreams["kb"].post(url, json=kpi_dict, headers=headers)
     response_data = response.json()
 
     if response_data['Status'] == 0:
-        return JSONResponse(content=kpi_dict["id"], status_code=200)
+        catalog_cache.invalidate("retrieveKPIs")
+        return FastJSONResponse(content=kpi_dict["id"], status_code=200)
     else:
-        return JSONResponse(content=response_data, status_code=400)
+        return FastJSONResponse(content=response_data, status_code=400)
 
 
 @app.post("/smartfactory/calculate", status_code=status.HTTP_200_OK)
-def calculate_kpi(request: List[KpiRequest], _: str = Depends(get_verify_api_key(["gui"]))):
+async def calculate_kpi(request: List[KpiRequest], _: str = Depends(get_verify_api_key(["gui"]))):
     """
     Calculate KPI based on the provided request data.
 
     This function sends a POST request to the KPI engine to calculate KPIs.
     The KPI engine host and port are retrieved from environment variables.
-    The request data is converted to JSON and sent to the KPI engine.
+    The request data is converted to JSON and sent to the KPI engine; identical requests in flight at the
+    same time share a single call.
 
     Args:
         request (List[KpiRequest]): A list of KPI request objects.
@@ -907,16 +1118,20 @@ def calculate_kpi(request: List[KpiRequest], _: str = Depends(get_verify_api_key
         'Content-Type': 'application/json',
         'x-api-key': api_key
     }
-    kpi_request = json.dumps([req.to_dict() for req in request])
+    kpi_requests = [req.to_dict() for req in request]
+    kpi_request = json.dumps(kpi_requests)
     logging.info("Calculating KPIs: %s", kpi_request)
 
-    response = requests.post(url, headers=headers,
-                             data=kpi_request)  # TODO Check when the kpi-engine will push its code
-    return JSONResponse(content=response.json(), status_code=200)
+    response = await flights["calculate"].do(
+        flight_key(url, kpi_requests),
+        lambda: upstreams["kpi-engine"].post(url, headers=headers, content=kpi_request)
+    )  # TODO Check when the kpi-engine will push its code
+    # the JSON of the KPI engine is forwarded as it is, without decoding and encoding it again, with its status
+    return Response(content=response.content, status_code=response.status_code, media_type="application/json")
 
 
-@app.post("/smartfactory/agent/{userId}", response_model=Answer)
-def ai_agent_interaction(userId: str, agent_request: AgentRequest,
+@app.post("/smartfactory/agent/{userId}", response_model=Answer, dependencies=[Depends(verify_user_token)])
+async def ai_agent_interaction(userId: str, agent_request: AgentRequest,
                          api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to interact with the AI agent.
@@ -940,13 +1155,13 @@ def ai_agent_interaction(userId: str, agent_request: AgentRequest,
         # Send the user input to the RAG API and get the response
         # build the Question object
         question = Question(userInput=userInput, userId=userId, requestType=requestType)
-        response = call_ai_agent(question)
+        response = await call_ai_agent(question)
         answer = response.json()
         
         if answer["label"] == 'new_kpi':
             # add new kpi
             try:
-                answer["data"] = validate_kpi(answer["data"])
+                answer["data"] = await validate_kpi(answer["data"])
                 #insert_kpi(answer["data"], os.getenv("API_KEY"))
             except Exception as e:
                 logging.error("Exception: %s", str(e))
@@ -956,10 +1171,9 @@ def ai_agent_interaction(userId: str, agent_request: AgentRequest,
             # generate report
             # name is based on the current datetime
             report_name = "report_" + str(datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-            tmp_path = "/tmp/" + report_name + ".pdf"
             try:
                 logging.info("Generating report: %s", answer["data"])
-                report_id = create_report_pdf(answer, userId, tmp_path, report_name)
+                report_id, _ = await create_report(answer, userId, report_name)
                 # replace the data with the report id
                 answer["data"] = str(report_id)
                 answer["textResponse"] = report_name
@@ -968,6 +1182,8 @@ def ai_agent_interaction(userId: str, agent_request: AgentRequest,
                 logging.error("Exception: %s", str(e))
                 raise HTTPException(status_code=500, detail=str(e))
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
@@ -976,120 +1192,32 @@ def ai_agent_interaction(userId: str, agent_request: AgentRequest,
 
 
 @app.post('/smartfactory/historical')
-def retrieve_historical_data(historical_params: HistoricalQueryParams,
-                             api_key: str = Depends(get_verify_api_key(["gui"]))):
+async def retrieve_historical_data(historical_params: HistoricalQueryParams,
+                                   api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to retrieve historical data.
     This endpoint receives a set of parameters and retrieves historical data from the database based on those parameters.
+    The query is built by historical_query with parameters for every client value, and the result is streamed
+    from the database to the client without being buffered.
     Args:
         historical_params (HistoricalQueryParams): The parameters for the historical data query.
     Returns:
-        response: The historical data retrieved from the database.
+        response: The historical data retrieved from the database, as a JSON array or as NDJSON.
     Raises:
-        HTTPException: If the query parameters are malformed or an unexpected error occurs.
+        HTTPException: If the query parameters are malformed or the database fails the query.
     """
-
-    # check if group_time has valid values
-    if historical_params.group_time and historical_params.group_time not in ['P1D', 'P1W', 'P1M']:
-        raise HTTPException(status_code=400, detail="Invalid group_time value")
-
-    # check if necessary fields are not empty
-    if not historical_params.kpi or not historical_params.timeframe or not historical_params.machines:
-        raise HTTPException(status_code=400, detail="Missing required fields")
-
-    # The database only supports the following fields for a KPI ID
-    # the others will need to be requested using the calculate KPI endpoint
-    valid_fields = {"sum", "min", "max", "avg"}
-    kpi_id = historical_params.kpi
-    kpi_name, field = None, None
-
-    # Check the last 3 characters of the KPI ID
-    # Extract the suffix to get the field
-    if kpi_id[-3:] in valid_fields:
-        # Find the last underscore
-        split_index = kpi_id.rfind("_")
-
-        # Dividi il nome del KPI
-        kpi_name = kpi_id[:split_index]
-        field = kpi_id[split_index + 1:]
-
-    # check if the kpi is valid and was split correctly
-    if not kpi_name or not field:
-        raise HTTPException(status_code=400, detail="Invalid KPI ID")
-
-    # substitute square brackets with parentheses in machine list
-    historical_params.machines = tuple(historical_params.machines)
-
-    # remove commas from machines string in case it's a single one
-    if len(historical_params.machines) == 1:
-        machines = str(historical_params.machines).replace(",", "")
-    else:
-        machines = str(historical_params.machines)
-
+    logging.info("Retrieving historical data: %s", historical_params)
     try:
-        # Build the query body
-
-        # group_time is optional and has values:
-        # 'P1D'for daily intervals
-        # 'P1W' for weekly intervals
-        # 'P1M' for monthly intervals.
-
-        ''' previous code
-        query = """SELECT name, TIME_FORMAT(__time, 'yyyy-MM-dd') AS timeframe FROM \"timeseries\" WHERE kpi = '{}' AND '__time' >= '{}' AND __time < '{}' 
-                    AND name IN {} GROUP BY 
-        """.format(
-            historical_params.kpi, historical_params.timeframe["start_date"],
-            historical_params.timeframe["end_date"], machines
-        )
-
-        # append optional group by time clause
-        if historical_params.group_time:
-            query += f"""TIME_FLOOR(__time, '{historical_params.group_time}'),"""
-
-        query += "name, __time"
-        '''
-
-        # Base SELECT and FROM
-        query = f"""
-                    SELECT name,
-                """
-
-        # Include time formatting only for time series (group_time is present)
-        if historical_params.group_time:
-            query += f"TIME_FORMAT(TIME_FLOOR(__time, '{historical_params.group_time}'), 'yyyy-MM-dd') AS \"timestamp\", "
-
-        # Add KPI field aggregation, since max,avg etc. are keywords, they need to be enclosed in double quotes
-        query += f"SUM(\"{field}\") AS {kpi_id} FROM \"timeseries\" WHERE kpi = '{kpi_name}'"
-
-        # Add WHERE clause for timeframe and machines
-        query += f"""
-                      AND __time >= TIMESTAMP '{historical_params.timeframe["start_date"]}'
-                      AND __time < TIMESTAMP '{historical_params.timeframe["end_date"]}'
-                      AND name IN {machines}
-                """
-
-        # Add GROUP BY clause
-        query += " GROUP BY name"
-        # Group by time if present
-        if historical_params.group_time:
-            query += f", TIME_FLOOR(__time, '{historical_params.group_time}')"
-
-        # Execute the query
-        response = execute_druid_query(os.getenv('DRUID_QUERY_ENDPOINT'), {"query": query})
-        if response:
-            print("Query response:", response)
-        else:
-            print("Failed to retrieve query response.")
-
+        return await stream_historical_data(historical_params)
+    except (HTTPException, UpstreamUnavailable):
+        raise
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
-    return response
-
 
 @app.post('/smartfactory/predict', response_model=Json_out)
-def get_prediction(pred_request: Json_in, api_key: str = Depends(get_verify_api_key(["gui"]))):
+async def get_prediction(pred_request: Json_in, api_key: str = Depends(get_verify_api_key(["gui"]))):
     """
     Endpoint to get a prediction from the ML model.
     This endpoint receives a set of parameters and retrieves a prediction from the ML model based on those parameters.
@@ -1112,12 +1240,25 @@ def get_prediction(pred_request: Json_in, api_key: str = Depends(get_verify_api_
     logging.info("sending request to %s: %s", url, pred_request)
     try:
         # Send the prediction request to the data processing module and get the response
-        response = requests.post(url, json=jsonable_encoder(pred_request), headers=headers)
+        response = await upstreams["data-processing"].post(url, json=jsonable_encoder(pred_request), headers=headers)
         response.raise_for_status()
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logging.error("Exception: %s", str(e))
         raise HTTPException(status_code=500, detail=str(e))
-    return response.json()
+    # data-processing already answers with a Json_out, it is forwarded without validating it again
+    return Response(content=response.content, status_code=response.status_code, media_type="application/json")
+
+
+@app.get("/smartfactory/upstreams")
+async def get_upstream_stats(api_key: str = Depends(get_verify_api_key(["gui"]))):
+    """
+    Endpoint to monitor the services the API layer forwards requests to.
+    Returns:
+        JSONResponse: Requests, errors, retries, circuit breaker state and latency histogram of every upstream.
+    """
+    return FastJSONResponse(content=upstream_stats(), status_code=200)
 
 
 @app.get("/smartfactory/dummy")
@@ -1127,7 +1268,7 @@ async def dummy_endpoint(api_key: str = Depends(get_verify_api_key(["gui"]))):
     Returns:
         JSONResponse: A JSON response with a dummy message.
     """
-    return JSONResponse(content={"message": "This is a dummy endpoint"}, status_code=200)
+    return FastJSONResponse(content={"message": "This is a dummy endpoint"}, status_code=200)
 
 
 if __name__ == "__main__":
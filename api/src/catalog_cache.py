@@ -0,0 +1,163 @@
+import hashlib
+import os
+import time
+
+from fastapi import Response
+
+from response_layer import dumps
+
+# Seconds after which a cached catalog is checked against the version of the KB ontology
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+
+
+class CatalogEntry:
+    """
+    A catalog response of the KB, serialized once.
+
+    Attributes:
+        body (bytes): The JSON body of the response.
+        etag (str): The strong entity tag of the body.
+        version (str): The version of the ontology the catalog was read from, if known.
+        checked_at (float): Monotonic time of the last check against the KB.
+    """
+
+    __slots__ = ("body", "etag", "version", "checked_at")
+
+    def __init__(self, body: bytes, version: str = None):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+class CatalogCache:
+    """
+    Cache of the catalog endpoints of the KB (KPI and machine hierarchies).
+
+    The catalogs change only when the ontology is modified, so they are served from memory: after ttl
+    seconds the version of the ontology is compared with the one the entry was read from and the catalog
+    is downloaded again only if it changed. Inserting a KPI through the API layer invalidates the cache.
+
+    Attributes:
+        ttl (float): Seconds after which an entry has to be checked again.
+    """
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._counters = {"hits": 0, "misses": 0, "revalidations": 0, "not_modified": 0}
+
+    def get(self, name: str):
+        """
+        Return an entry still within its ttl.
+
+        Args:
+            name (str): The name of the catalog.
+
+        Returns:
+            CatalogEntry or None: The entry, None if missing or to be checked again.
+        """
+        entry = self._entries.get(name)
+        if entry is None or time.monotonic() - entry.checked_at >= self.ttl:
+            return None
+        self._counters["hits"] += 1
+        return entry
+
+    def revalidate(self, name: str, version: str):
+        """
+        Renew the ttl of an entry if the ontology did not change since it was read.
+
+        Args:
+            name (str): The name of the catalog.
+            version (str): The current version of the ontology.
+
+        Returns:
+            CatalogEntry or None: The renewed entry, None if it has to be downloaded again.
+        """
+        entry = self._entries.get(name)
+        if entry is None or version is None or entry.version != version:
+            return None
+        entry.checked_at = time.monotonic()
+        self._counters["revalidations"] += 1
+        return entry
+
+    def put(self, name: str, data, version: str = None) -> CatalogEntry:
+        """
+        Store a catalog.
+
+        Args:
+            name (str): The name of the catalog.
+            data: The catalog, as decoded from the KB response.
+            version (str, optional): The version of the ontology the catalog was read from.
+
+        Returns:
+            CatalogEntry: The new entry.
+        """
+        self._counters["misses"] += 1
+        entry = CatalogEntry(dumps(data), version)
+        self._entries[name] = entry
+        return entry
+
+    def invalidate(self, name: str = None):
+        """
+        Drop a catalog, or all of them.
+
+        Args:
+            name (str, optional): The name of the catalog, None to drop all.
+        """
+        if name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(name, None)
+
+    def response(self, entry: CatalogEntry, if_none_match: str = None) -> Response:
+        """
+        Build the response of a catalog endpoint.
+
+        Args:
+            entry (CatalogEntry): The catalog to send.
+            if_none_match (str, optional): The If-None-Match header of the request.
+
+        Returns:
+            Response: 304 without body if the client already has this version, 200 with the catalog otherwise.
+                      Clients are asked to revalidate every time (no-cache), so changes are seen immediately.
+        """
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            self._counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the cache.
+
+        Returns:
+            dict: Cached catalogs, hits, misses, revalidations and 304 responses.
+        """
+        return {"catalogs": list(self._entries), **self._counters}
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check an If-None-Match header against an entity tag (weak comparison, as required for GET).
+
+    Args:
+        if_none_match (str): The header value, a list of entity tags or *.
+        etag (str): The current entity tag.
+
+    Returns:
+        bool: True if the client copy is current.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+catalog_cache = CatalogCache()
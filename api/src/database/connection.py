@@ -1,31 +1,201 @@
 import os
+import threading
+import weakref
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import extensions, pool
+
+from instrumentation import timed_upstream
+
+# Connections are reused through a pool shared by all the threads of the service
+POOL_MIN_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MIN', '1'))
+POOL_MAX_CONNECTIONS = int(os.getenv('POSTGRES_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', '5')) # seconds to wait for a free connection
+STATEMENT_TIMEOUT = int(os.getenv('POSTGRES_STATEMENT_TIMEOUT', '30000')) # milliseconds, 0 disables it
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+_pool_counters = {'acquired': 0, 'timeouts': 0, 'discarded': 0}
+
+
+class PooledConnection:
+    """
+    A pooled psycopg2 connection: it behaves as the connection it wraps, but close() gives it back
+    to the pool instead of closing it. A transaction left open is rolled back before the connection
+    is reused, broken connections are discarded. A connection dropped without being closed is given
+    back when it is garbage collected, so that it does not hold a slot of the pool forever.
+    """
+
+    def __init__(self, connection, connection_pool, slots):
+        self._connection = connection
+        # runs once, at close() or when the wrapper is collected
+        self._release = weakref.finalize(self, _release, connection, connection_pool, slots)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        self._release()
+
+
+class TimedCursor(extensions.cursor):
+    """A cursor recording the duration of every statement as a call to the postgres upstream."""
+
+    def execute(self, query, vars=None):
+        with timed_upstream("postgres"):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with timed_upstream("postgres"):
+            return super().executemany(query, vars_list)
+
+
+def _get_pool():
+    """
+    Create the connection pool at the first use.
+
+    Returns:
+        ThreadedConnectionPool: The pool of the service.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = pool.ThreadedConnectionPool(POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, **_connection_params())
+        return _pool
+
+
+def _connection_params():
+    """The connection parameters, from environment variables."""
+    return {
+        'dbname': os.getenv('POSTGRES_DB'),
+        'user': os.getenv('POSTGRES_USER'),
+        'password': os.getenv('POSTGRES_PASSWORD'),
+        'host': os.getenv('POSTGRES_HOST'),
+        'port': os.getenv('POSTGRES_PORT'),
+        'options': f"-c statement_timeout={STATEMENT_TIMEOUT}"
+    }
+
+
+def open_dedicated_connection():
+    """
+    Opens a connection outside of the pool, for a long-lived use such as LISTEN.
+
+    Returns:
+        connection: An autocommit connection, the caller closes it.
+    """
+    connection = psycopg2.connect(**_connection_params())
+    connection.autocommit = True
+    return connection
+
+
+def _release(connection, connection_pool, slots):
+    """Give a connection back to the pool it was taken from, closing it if it is no longer usable."""
+    broken = bool(connection.closed)
+    if not broken and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            connection.rollback()
+        except Exception:
+            broken = True
+    try:
+        with _pool_lock:
+            if connection_pool is _pool:
+                if broken:
+                    _pool_counters['discarded'] += 1
+                connection_pool.putconn(connection, close=broken)
+            elif not connection.closed: # the pool was reset while the connection was in use
+                connection.close()
+    finally:
+        slots.release()
+
 
 def get_db_connection():
     """
-    Establishes a connection to the PostgreSQL database using credentials from environment variables.
+    Takes a connection from the pool of the service, opening it if needed with the credentials from environment variables.
+
+    When all the connections are in use it waits up to POSTGRES_POOL_TIMEOUT seconds for one to be released.
+    Closing the returned connection gives it back to the pool, the statements run with the cursor are timed on /metrics.
+
     Returns:
         tuple: A tuple containing the database connection and cursor objects.
                If the connection fails, returns (None, None).
     Raises:
         Exception: If there is an error connecting to the PostgreSQL database, it prints the error message.
     """
+    slots = _pool_slots
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        _pool_counters['timeouts'] += 1
+        print(f"Error connecting to PostgreSQL database: no free connection after {POOL_TIMEOUT} seconds")
+        return None, None
     try:
-        connection = psycopg2.connect(
-            dbname=os.getenv('POSTGRES_DB'),
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            host=os.getenv('POSTGRES_HOST'),
-            port=os.getenv('POSTGRES_PORT')
-        )
+        connection_pool = _get_pool()
+        connection = connection_pool.getconn()
+        _pool_counters['acquired'] += 1
+        connection = PooledConnection(connection, connection_pool, slots)
         
-        cursor = connection.cursor()
+        cursor = connection.cursor(cursor_factory=TimedCursor)
         
         return connection, cursor
     except Exception as error:
+        slots.release()
         print(f"Error connecting to PostgreSQL database: {error}")
         return None, None
 
+@contextmanager
+def transaction():
+    """
+    Runs a block of statements in a single transaction on a pooled connection.
+
+    The transaction is committed if the block completes, rolled back if it raises; the connection
+    is then given back to the pool.
+
+    Yields:
+        cursor: The cursor to execute the statements with.
+
+    Raises:
+        psycopg2.OperationalError: If no connection could be obtained.
+    """
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise psycopg2.OperationalError("Database connection failed")
+    try:
+        yield cursor
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        close_connection(connection, cursor)
+
+def pool_stats():
+    """
+    Returns the metrics of the connection pool.
+
+    Returns:
+        dict: Pool size, open, in use and idle connections, connections handed out, discarded and requests timed out.
+    """
+    with _pool_lock:
+        in_use = len(_pool._used) if _pool is not None else 0
+        idle = len(_pool._pool) if _pool is not None else 0
+        return {
+            'max_connections': POOL_MAX_CONNECTIONS,
+            'open': in_use + idle,
+            'in_use': in_use,
+            'idle': idle,
+            **_pool_counters
+        }
+
+def reset_pool():
+    """
+    Closes all the connections of the pool, the next request opens a new one.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+
 def query_db(cursor, connection, query: str):
     """
     Executes a given SQL query using the provided cursor and connection.
@@ -0,0 +1,42 @@
+def lttb(xs: list, ys: list, threshold: int) -> list:
+    """
+    Select the points of a series to keep with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and the last points are always kept. The points in between are split into threshold - 2 buckets,
+    and from every bucket the point forming the largest triangle with the point selected in the previous bucket
+    and the average of the next bucket is kept, so peaks and drops survive the downsampling.
+
+    Args:
+        xs (list): The x coordinates of the points, in increasing order.
+        ys (list): The y coordinates of the points.
+        threshold (int): The maximum number of points to keep.
+
+    Returns:
+        list: The indices of the points to keep, in increasing order.
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 0)]
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # average of the next bucket, the last point for the last bucket
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        count = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / count
+        avg_y = sum(ys[avg_start:avg_end]) / count
+
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
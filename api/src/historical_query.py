@@ -0,0 +1,266 @@
+import os
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from downsampling import lttb
+from model.historical import HistoricalQueryParams
+from response_layer import FastJSONResponse, dumps
+from single_flight import flight_key, flights
+from upstream import upstreams
+
+# Aggregated fields stored in Druid for every KPI, a KPI ID ends with one of them (e.g. energy_consumed_sum)
+KPI_FIELDS = ("sum", "min", "max", "avg")
+# Functions that can aggregate the values of a field over a group of rows
+AGGREGATES = {"sum": "SUM", "min": "MIN", "max": "MAX", "avg": "AVG"}
+# Grouping periods from the finest to the coarsest ('P1D' for daily intervals, 'P1W' for weekly intervals...),
+# with their approximate length in seconds
+GROUP_TIMES = {"PT1H": 3600, "P1D": 86400, "P1W": 604800, "P1M": 2629746, "P3M": 7889238, "P1Y": 31556952}
+# The GUI asks for hourly intervals as P1H
+GROUP_TIME_ALIASES = {"P1H": "PT1H"}
+# Output formats: a JSON array, or one JSON object per line
+FORMATS = {"json": ("object", "application/json"), "ndjson": ("objectLines", "application/x-ndjson")}
+
+DRUID_DATASOURCE = "timeseries"
+
+
+def parse_kpi_id(kpi_id: str) -> tuple:
+    """
+    Split a KPI ID into the name of the KPI and the field stored in the database.
+
+    Args:
+        kpi_id (str): The KPI ID, e.g. energy_consumed_sum.
+
+    Returns:
+        tuple: The name of the KPI and the field, e.g. (energy_consumed, sum).
+
+    Raises:
+        ValueError: If the KPI ID does not end with one of the fields stored in the database, such KPIs need
+                    to be requested using the calculate KPI endpoint.
+    """
+    kpi_name, _, field = kpi_id.rpartition("_")
+    if not kpi_name or field not in KPI_FIELDS:
+        raise ValueError(f"Invalid KPI ID: {kpi_id}")
+    return kpi_name, field
+
+
+def parse_date(value: str) -> datetime:
+    """Parse an ISO 8601 date of the timeframe."""
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+
+def resolve_group_time(params: HistoricalQueryParams):
+    """
+    Return the grouping period of a query.
+
+    Without max_points it is the requested group_time. With max_points the finest period producing at most
+    max_points intervals in the timeframe is chosen, but never finer than the requested group_time.
+
+    Args:
+        params (HistoricalQueryParams): The parameters of the query.
+
+    Returns:
+        str or None: The grouping period, None if the data is not grouped by time.
+
+    Raises:
+        ValueError: If group_time or max_points are invalid.
+    """
+    group_time = GROUP_TIME_ALIASES.get(params.group_time, params.group_time)
+    if group_time and group_time not in GROUP_TIMES:
+        raise ValueError("Invalid group_time value")
+    if params.max_points is None:
+        return group_time
+    if params.max_points < 1:
+        raise ValueError("Invalid max_points value")
+
+    span = (parse_date(params.timeframe["end_date"]) - parse_date(params.timeframe["start_date"])).total_seconds()
+    finest = GROUP_TIMES[group_time] if group_time else 0
+    candidates = [period for period, seconds in GROUP_TIMES.items() if seconds >= finest]
+    for period in candidates:
+        if span / GROUP_TIMES[period] <= params.max_points:
+            return period
+    return candidates[-1]
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a column alias, aliases can not be passed as parameters."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_historical_query(params: HistoricalQueryParams) -> dict:
+    """
+    Build the body of a Druid SQL request for historical data.
+
+    Every value coming from the client is sent as a query parameter; only the KPI fields, the aggregate and the
+    grouping period are part of the SQL text, and they are checked against fixed lists. Every KPI becomes a
+    column of the result, so several KPIs (or several fields of the same KPI) are read in a single scan.
+
+    Args:
+        params (HistoricalQueryParams): The parameters of the query.
+
+    Returns:
+        dict: The body of the request, with query and parameters.
+
+    Raises:
+        ValueError: If the parameters are missing or invalid.
+    """
+    kpi_ids = list(params.kpis or []) or ([params.kpi] if params.kpi else [])
+    if not kpi_ids or not params.timeframe or not params.machines:
+        raise ValueError("Missing required fields")
+    aggregate = AGGREGATES.get(params.aggregate or "sum")
+    if aggregate is None:
+        raise ValueError("Invalid aggregate value")
+    try:
+        start_date, end_date = params.timeframe["start_date"], params.timeframe["end_date"]
+    except KeyError:
+        raise ValueError("Missing required fields")
+    group_time = resolve_group_time(params)
+
+    kpis = [(kpi_id, *parse_kpi_id(kpi_id)) for kpi_id in dict.fromkeys(kpi_ids)]
+    kpi_names = list(dict.fromkeys(kpi_name for _, kpi_name, _ in kpis))
+    parameters = []
+
+    def parameter(value) -> str:
+        parameters.append({"type": "VARCHAR", "value": str(value)})
+        return "?"
+
+    columns = ["name"]
+    if group_time:
+        time_format = "yyyy-MM-dd''T''HH:mm:ss" if GROUP_TIMES[group_time] < GROUP_TIMES["P1D"] else "yyyy-MM-dd"
+        columns.append(f"TIME_FORMAT(TIME_FLOOR(__time, '{group_time}'), '{time_format}') AS \"timestamp\"")
+    for kpi_id, kpi_name, field in kpis:
+        # max, avg etc. are keywords, so the fields are enclosed in double quotes
+        column = f'"{field}"' if len(kpi_names) == 1 else f'CASE WHEN kpi = {parameter(kpi_name)} THEN "{field}" END'
+        columns.append(f"{aggregate}({column}) AS {quote_identifier(kpi_id)}")
+
+    query = f"SELECT {', '.join(columns)} FROM \"{DRUID_DATASOURCE}\""
+    query += f" WHERE kpi IN ({', '.join(parameter(kpi_name) for kpi_name in kpi_names)})"
+    query += f" AND __time >= TIME_PARSE({parameter(start_date)}) AND __time < TIME_PARSE({parameter(end_date)})"
+    query += f" AND name IN ({', '.join(parameter(machine) for machine in params.machines)})"
+    query += " GROUP BY name"
+    if group_time:
+        query += f", TIME_FLOOR(__time, '{group_time}')"
+
+    return {"query": query, "parameters": parameters}
+
+
+def downsample_rows(rows: list, kpi_ids: list, max_points: int) -> list:
+    """
+    Reduce every machine series to at most max_points rows with LTTB.
+
+    With several KPIs the points are shared between them, and a row is kept if it is selected for any KPI.
+
+    Args:
+        rows (list): The rows of the result, with name, timestamp and a column per KPI.
+        kpi_ids (list): The KPI columns.
+        max_points (int): The maximum number of rows per machine.
+
+    Returns:
+        list: The kept rows, by machine and in time order.
+    """
+    series = {}
+    for row in rows:
+        series.setdefault(row.get("name"), []).append(row)
+
+    result = []
+    threshold = max(max_points // len(kpi_ids), 1)
+    for machine_rows in series.values():
+        machine_rows.sort(key=lambda row: row["timestamp"])
+        if len(machine_rows) <= max_points:
+            result.extend(machine_rows)
+            continue
+        xs = [parse_date(row["timestamp"]).timestamp() for row in machine_rows]
+        kept = set()
+        for kpi_id in kpi_ids:
+            indices = [i for i, row in enumerate(machine_rows) if row.get(kpi_id) is not None]
+            selected = lttb([xs[i] for i in indices], [machine_rows[i][kpi_id] for i in indices], threshold)
+            kept.update(indices[i] for i in selected)
+        result.extend(machine_rows[i] for i in sorted(kept))
+    return result
+
+
+async def stream_historical_data(params: HistoricalQueryParams):
+    """
+    Run a historical query on Druid and stream the result to the client as it arrives.
+
+    The rows are never collected in memory: Druid produces them in the requested format (a JSON array or
+    newline delimited JSON objects) and the chunks are forwarded as they are received. With max_points the
+    result is bounded by the chosen granularity, so it is read whole and downsampled before being sent; only
+    these queries are merged with the identical ones in flight, sharing a stream would mean buffering it.
+
+    Args:
+        params (HistoricalQueryParams): The parameters of the query.
+
+    Returns:
+        Response: The rows of the result.
+
+    Raises:
+        HTTPException: 400 if the parameters are invalid, 502 if Druid fails the query.
+    """
+    result_format, media_type = FORMATS.get(params.format or "json", (None, None))
+    if result_format is None:
+        raise HTTPException(status_code=400, detail="Invalid format value")
+    try:
+        body = build_historical_query(params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if params.max_points is not None:
+        return await downsampled_historical_data(params, body, media_type)
+    body["resultFormat"] = result_format
+
+    response = await upstreams["druid"].post(os.getenv("DRUID_QUERY_ENDPOINT"), json=body, stream=True)
+    if response.status_code != 200:
+        detail = (await response.aread()).decode("utf-8", errors="replace")
+        await response.aclose()
+        raise HTTPException(status_code=502, detail=f"Historical query failed: {detail}")
+
+    async def rows():
+        try:
+            if result_format == "objectLines":
+                # Druid ends the lines with an empty one, which is not valid NDJSON
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line + "\n"
+            else:
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(rows(), media_type=media_type)
+
+
+async def downsampled_historical_data(params: HistoricalQueryParams, body: dict, media_type: str):
+    """
+    Run a historical query with max_points and send at most max_points rows per machine.
+
+    Identical queries in flight at the same time share the Druid call and the downsampling.
+
+    Args:
+        params (HistoricalQueryParams): The parameters of the query.
+        body (dict): The body of the Druid request.
+        media_type (str): The media type of the response.
+
+    Returns:
+        Response: The downsampled rows, as a JSON array or NDJSON.
+
+    Raises:
+        HTTPException: 502 if Druid fails the query.
+    """
+    body["resultFormat"] = "object"
+    kpi_ids = list(dict.fromkeys(params.kpis or [params.kpi]))
+
+    async def query():
+        response = await upstreams["druid"].post(os.getenv("DRUID_QUERY_ENDPOINT"), json=body)
+        if response.status_code != 200:
+            raise HTTPException(status_code=502, detail=f"Historical query failed: {response.text}")
+        return downsample_rows(response.json(), kpi_ids, params.max_points)
+
+    rows = await flights["historical"].do(flight_key(body, kpi_ids, params.max_points), query)
+    if media_type == "application/x-ndjson":
+        return StreamingResponse((dumps(row) + b"\n" for row in rows), media_type=media_type)
+    return FastJSONResponse(content=rows)
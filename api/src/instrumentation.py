@@ -0,0 +1,360 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from fastapi.responses import Response
+
+# Upper bounds, in seconds, of the latency histogram buckets (the last bucket is +Inf)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Serve the metrics on /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Read the trace ID of a request from X-Trace-Id, or generate one, and send it along with the calls to the other services
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+
+TRACE_HEADER = "X-Trace-Id"
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette adds the charset
+# A trace ID received from a client is only propagated if it looks like one
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing value, per combination of label values.
+
+    Attributes:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        """Add amount to the value of the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        """Return the value of the given label values."""
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """A value that goes up and down, per combination of label values."""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        """Subtract amount from the value of the given label values."""
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """
+    The distribution of observed values, per combination of label values, in cumulative buckets.
+
+    Attributes:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        labelnames (tuple): The names of the labels.
+        buckets (tuple): The upper bounds of the buckets, +Inf excluded.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        """Record a value for the given label values."""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        """Return the number of values observed for the given label values."""
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series is not None else 0
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield self.name + "_bucket" + _format_labels(self.labelnames, labels, le), cumulative
+            yield self.name + "_sum" + _format_labels(self.labelnames, labels), total
+            yield self.name + "_count" + _format_labels(self.labelnames, labels), cumulative
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose values are read when the metrics are collected, e.g. from the stats of a cache.
+
+    Attributes:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        read (callable): Returns a number, or a dict from label values (a tuple, or a string with one label) to numbers.
+        labelnames (tuple): The names of the labels.
+        kind (str): gauge or counter.
+    """
+
+    def __init__(self, name: str, documentation: str, read, labelnames: tuple = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self):
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            if value is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Registry:
+    """The metrics of a service, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, replacing the one with the same name. Returns the metric."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Return all the metrics in the text exposition format, a metric whose callback fails is left out."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logging.error("Error collecting metric %s: %s", metric.name, str(e))
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{sample} {_format_value(value)}" for sample, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram("http_request_duration_seconds", "Duration of the HTTP requests, by route.",
+                                      ("method", "route"))
+REQUESTS = registry.counter("http_requests_total", "HTTP requests answered, by route and status code.",
+                            ("method", "route", "status"))
+REQUESTS_IN_PROGRESS = registry.gauge("http_requests_in_progress", "HTTP requests being served.")
+UPSTREAM_DURATION = registry.histogram("upstream_request_duration_seconds",
+                                       "Duration of the calls to the services and stores this service depends on.",
+                                       ("upstream",))
+UPSTREAM_ERRORS = registry.counter("upstream_errors_total", "Failed calls to the services and stores, by upstream.",
+                                   ("upstream",))
+
+
+def register_callback(name: str, documentation: str, read, labelnames: tuple = (), kind: str = "gauge"):
+    """
+    Expose values read when the metrics are collected, e.g. the usage of a cache or of a pool.
+
+    Args:
+        name (str): The name of the metric.
+        documentation (str): The help text of the metric.
+        read (callable): Returns a number, or a dict from label values to numbers.
+        labelnames (tuple): The names of the labels.
+        kind (str): gauge, or counter for values that only increase.
+    """
+    registry.register(CallbackMetric(name, documentation, read, labelnames, kind))
+
+
+def observe_upstream(upstream: str, elapsed: float, error: bool = False):
+    """
+    Record a call to an upstream.
+
+    Args:
+        upstream (str): The name of the service or store, e.g. druid, postgres, minio, kb, llm.
+        elapsed (float): The duration of the call in seconds.
+        error (bool): Whether the call failed.
+    """
+    UPSTREAM_DURATION.observe(elapsed, upstream)
+    if error:
+        UPSTREAM_ERRORS.inc(upstream)
+
+
+@contextmanager
+def timed_upstream(upstream: str):
+    """
+    Record the duration of the block as a call to an upstream, failed if the block raises.
+
+    Args:
+        upstream (str): The name of the service or store.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        observe_upstream(upstream, time.perf_counter() - start, error=True)
+        raise
+    observe_upstream(upstream, time.perf_counter() - start)
+
+
+def current_trace_id():
+    """Return the trace ID of the request being served, None outside of a request or with tracing disabled."""
+    return _trace_id.get()
+
+
+def trace_headers(headers: dict = None) -> dict:
+    """
+    Add the trace ID of the request being served to the headers of a call to another service.
+
+    Args:
+        headers (dict, optional): The headers of the call, e.g. with the x-api-key; they are not modified.
+
+    Returns:
+        dict: A copy of the headers, with X-Trace-Id if there is a trace ID.
+    """
+    headers = dict(headers or {})
+    trace_id = _trace_id.get()
+    if trace_id is not None:
+        headers[TRACE_HEADER] = trace_id
+    return headers
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the duration and the status of every HTTP request, labelled with the route
+    template (e.g. /smartfactory/alerts/{userId}) so that the number of series stays bounded.
+
+    With tracing, the trace ID of the request is taken from X-Trace-Id or generated, made available to
+    trace_headers and sent back in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        if TRACING_ENABLED:
+            for name, value in scope["headers"]:
+                if name == b"x-trace-id":
+                    trace_id = value.decode("latin-1")
+                    break
+            if trace_id is None or not _TRACE_ID_PATTERN.match(trace_id):
+                trace_id = uuid.uuid4().hex
+        token = _trace_id.set(trace_id)
+        status = [500]
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if trace_id is not None:
+                    message["headers"] = list(message.get("headers", [])) + \
+                                         [(b"x-trace-id", trace_id.encode("latin-1"))]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_PROGRESS.dec()
+            # the router stores the matched route in the scope, requests matching no route share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_DURATION.observe(elapsed, scope["method"], route)
+            REQUESTS.inc(scope["method"], route, str(status[0]))
+            _trace_id.reset(token)
+
+
+def metrics_response() -> Response:
+    """The metrics of the service, as expected by a Prometheus scrape."""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
+def instrument(app):
+    """
+    Record the requests of a FastAPI application and, unless METRICS_ENABLED is false, serve its metrics on /metrics.
+
+    Args:
+        app (FastAPI): The application, before it starts.
+    """
+    app.add_middleware(MetricsMiddleware)
+    if METRICS_ENABLED:
+        app.add_api_route("/metrics", metrics_response, methods=["GET"], include_in_schema=False)
@@ -0,0 +1,130 @@
+import logging
+import os
+import queue
+import smtplib
+import threading
+
+# Seconds an unused SMTP connection is kept open
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "30"))
+# Maximum number of emails waiting to be sent, further emails are dropped
+SMTP_OUTBOX_SIZE = int(os.getenv("SMTP_OUTBOX_SIZE", "10000"))
+
+
+class MailOutbox:
+    """
+    Queue of emails sent by a background thread over a single SMTP connection.
+
+    The connection is opened and authenticated at the first email and reused for the following ones; it is closed
+    after idle_timeout seconds without emails and reopened when needed. An email whose connection was dropped by the
+    server is sent again on a new connection.
+
+    Attributes:
+        idle_timeout (float): Seconds an unused connection is kept open.
+        maxsize (int): Maximum number of queued emails.
+    """
+
+    def __init__(self, idle_timeout: float = SMTP_IDLE_TIMEOUT, maxsize: int = SMTP_OUTBOX_SIZE):
+        self.idle_timeout = idle_timeout
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._server = None
+        self._counters = {"sent": 0, "failed": 0, "dropped": 0, "connections": 0}
+
+    def enqueue(self, message) -> bool:
+        """
+        Queue an email, without waiting for it to be sent.
+
+        Args:
+            message (email.message.Message): The email, with From and To set.
+
+        Returns:
+            bool: False if the outbox is full and the email was dropped.
+        """
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name="mail-outbox", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self._counters["dropped"] += 1
+            logging.error("Mail outbox full, email to %s dropped", message["To"])
+            return False
+
+    def _connect(self):
+        self._server = smtplib.SMTP(os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT')))
+        self._server.login(os.getenv('SMTP_EMAIL'), os.getenv('SMTP_PASSWORD'))
+        self._counters["connections"] += 1
+
+    def _disconnect(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def _send(self, message):
+        for attempt in range(2):
+            if self._server is None:
+                self._connect()
+            try:
+                self._server.send_message(message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                # the server closed the connection while it was idle, the email is sent again on a new one
+                self._server = None
+                if attempt:
+                    raise
+
+    def _work(self):
+        while True:
+            try:
+                message = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            try:
+                if message is None:
+                    self._disconnect()
+                    return
+                self._send(message)
+                self._counters["sent"] += 1
+                logging.info("Email sent to %s", message["To"])
+            except Exception as e:
+                self._counters["failed"] += 1
+                logging.error("Error sending email to %s: %s", message["To"], str(e))
+                self._disconnect()
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the outbox.
+
+        Returns:
+            dict: Sent, failed and dropped emails, SMTP connections opened and emails waiting.
+        """
+        return {**self._counters, "queued": self._queue.qsize()}
+
+    def close(self, timeout: float = 10.0):
+        """
+        Send the queued emails and stop the background thread.
+
+        Args:
+            timeout (float): Maximum seconds to wait for the queued emails.
+        """
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            thread.join(timeout)
+
+
+mail_outbox = MailOutbox()
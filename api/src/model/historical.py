@@ -1,21 +1,30 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 class HistoricalQueryParams(BaseModel):
     """
     Represents the parameters that describe a query to retrieve historical data.
 
     Attributes:
-        kpi (str): The key performance indicator.
+        kpi: optional (str): The key performance indicator.
+        kpis: optional (list(str)): Several key performance indicators, each returned as a column.
         timeframe (dict): {
             start_date (str): The start date of the timeframe.
             end_date (str): The end date of the timeframe.
         }.
         machines (list(str)): machines of which the data is collected.
         group_time: optional (str): The time interval for grouping.
+        max_points: optional (int): Maximum number of points per machine, the time interval is chosen to
+                                    approximate it and the series are downsampled to it.
+        aggregate: optional (str): How the values in a group are aggregated: sum (default), min, max or avg.
+        format: optional (str): json (default) for a JSON array, ndjson for one JSON object per line.
     """
 
-    kpi: str
+    kpi: Optional[str] = None
+    kpis: Optional[List[str]] = None
     timeframe: dict
     machines: list
     group_time: Optional[str] = None
-    
+    max_points: Optional[int] = None
+    aggregate: Optional[str] = None
+    format: Optional[str] = None
+
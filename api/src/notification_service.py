@@ -4,12 +4,23 @@ from email.message import EmailMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import logging
-from database.connection import query_db, get_db_connection
+from datetime import datetime, timedelta, timezone
+from psycopg2.extras import execute_values
+from database.connection import get_db_connection
 import json
-from model.alert import Alert
+from alert_hub import alert_hub
+from mail_outbox import mail_outbox
 
 logging.basicConfig(level=logging.INFO)
 
+# Alerts returned by default in a page of the alert feed, and at most
+ALERT_PAGE_SIZE = int(os.getenv("ALERT_PAGE_SIZE", "50"))
+ALERT_PAGE_MAX = 500
+# Seconds in which an alert repeating one of the same machine, type and title is discarded
+ALERT_DEDUP_WINDOW = int(os.getenv("ALERT_DEDUP_WINDOW", "300"))
+# Maximum number of alerts in a batch
+ALERT_BATCH_MAX = 1000
+
 email_subject = "{} - Alert: {}"
 
 email_body = """
@@ -23,9 +34,29 @@ Machine Name: {}
 Severity: {}
 """
 
+def build_alert_email(to_email, alert):
+    """
+    Builds the email notification of an alert.
+
+    Args:
+        to_email (str): The recipient's email address.
+        alert (Alert): An alert object containing details about the alert.
+
+    Returns:
+        MIMEMultipart: The email.
+    """
+    msg = MIMEMultipart()
+    msg['From'] = os.getenv('SMTP_EMAIL')
+    msg['To'] = to_email
+    msg['Subject'] = email_subject.format(alert.severity.value.upper(), alert.title)
+    body = email_body.format(alert.alertId, alert.description, alert.triggeredAt, alert.machineName, alert.severity.value)
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
 def send_email(to_email, alert):
     """
-    Sends an email notification with the given alert details.
+    Sends an email notification with the given alert details on a new SMTP connection.
+    Notifications are sent through the mail outbox instead, see send_notification.
 
     Args:
         to_email (str): The recipient's email address.
@@ -37,12 +68,7 @@ def send_email(to_email, alert):
     from_email = os.getenv('SMTP_EMAIL')
     from_password = os.getenv('SMTP_PASSWORD')
 
-    msg = MIMEMultipart()
-    msg['From'] = from_email
-    msg['To'] = to_email
-    msg['Subject'] = email_subject.format(alert.severity.value.upper(), alert.title)
-    body = email_body.format(alert.alertId, alert.description, alert.triggeredAt, alert.machineName, alert.severity.value)
-    msg.attach(MIMEText(body, 'plain'))
+    msg = build_alert_email(to_email, alert)
 
     try:
         smtp_server = os.getenv('SMTP_SERVER')
@@ -59,14 +85,14 @@ def send_email(to_email, alert):
     finally:
         server.quit()
 
-def send_report(to_email, report_name, tmp_path):
+def send_report(to_email, report_name, pdf_data):
     """
     Sends an email notification with the given report pdf file attached.
 
     Args:
         to_email (str): The recipient's email address.
         report_name (str): The name of the report.
-        tmp_path (str): the file path on the server.
+        pdf_data (bytes): The content of the pdf file.
 
     Raises:
         Exception: If there is an error sending the email.
@@ -81,9 +107,7 @@ def send_report(to_email, report_name, tmp_path):
     msg.set_content("Hello, please find attached your scheduled report")
 
     try:
-        with open(tmp_path, "rb") as f:
-            pdf_data = f.read()
-            msg.add_attachment(pdf_data, maintype="application", subtype="pdf", filename=report_name+".pdf")
+        msg.add_attachment(pdf_data, maintype="application", subtype="pdf", filename=report_name+".pdf")
 
         smtp_server = os.getenv('SMTP_SERVER')
         smtp_port = int(os.getenv('SMTP_PORT'))
@@ -99,6 +123,59 @@ def send_report(to_email, report_name, tmp_path):
     finally:
         server.quit()
 
+def resolve_recipients(cursor, roles):
+    """
+    Retrieve the users with any of the given roles, in a single query.
+
+    Args:
+        cursor: The cursor to execute the query with.
+        roles (list): The roles of the recipients.
+
+    Returns:
+        list: (UserID, Email) of every recipient.
+    """
+    cursor.execute("SELECT UserID, Email FROM Users WHERE Role = ANY(%s)", (list(roles),))
+    return cursor.fetchall()
+
+def insert_alert(cursor, alert, user_ids):
+    """
+    Insert an alert and its recipients.
+
+    The recipients are inserted with a single multi-row statement.
+
+    Args:
+        cursor: The cursor to execute the statements with.
+        alert (Alert): The alert to insert.
+        user_ids (list): The IDs of the recipients.
+
+    Returns:
+        int: The ID of the alert that was inserted.
+    """
+    insertAlertQuery = """
+    INSERT INTO Alerts (Title, Type, Description, TriggeredAt, MachineName, isPush, Severity)
+    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING AlertID
+    """
+
+    cursor.execute(insertAlertQuery, (
+        alert.title,
+        alert.type,
+        alert.description,
+        alert.triggeredAt,
+        alert.machineName,
+        True if alert.isPush else False,
+        alert.severity.value
+    ))
+
+    alertId = cursor.fetchone()[0]
+    logging.info("Alert inserted with ID: %s", alertId)
+
+    if user_ids:
+        logging.info("Inserting %d rows into association table", len(user_ids))
+        execute_values(cursor, "INSERT INTO AlertRecipients (AlertID, UserID) VALUES %s ON CONFLICT DO NOTHING",
+                       [(alertId, user_id) for user_id in user_ids])
+
+    return alertId
+
 def save_alert(alert):
     """
     Save an alert to the database.
@@ -121,49 +198,28 @@ def save_alert(alert):
         - isPush (bool): Whether the alert is a push notification.
         - severity (Severity): Severity level of the alert.
     """
+    logging.info("Inserting alert into database")
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
     try:
-        logging.info("Inserting alert into database")
-        connection, cursor = get_db_connection()
-
-        insertAlertQuery = """
-        INSERT INTO Alerts (Title, Type, Description, TriggeredAt, MachineName, isPush, Severity)
-        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING AlertID
-        """
-
-        cursor.execute(insertAlertQuery, (
-            alert.title,
-            alert.type,
-            alert.description,
-            alert.triggeredAt,
-            alert.machineName,
-            True if alert.isPush else False,
-            alert.severity.value
-        ))
-
-        alertId = cursor.fetchone()[0]
-        logging.info("Alert inserted with ID: %s", alertId)
 
         logging.info("Retrieving user IDs for recipients")
-        select_users_query = """
-        SELECT UserID FROM Users WHERE Role = ANY(%s)
-        """
-        cursor.execute(select_users_query, (alert.recipients,))
-        user_ids = cursor.fetchall()
-
-        logging.info("Inserting into association table")
-        insert_recipient_query = """
-        INSERT INTO AlertRecipients (AlertID, UserID) VALUES (%s, %s)
-        """
-        for user_id in user_ids:
-            cursor.execute(insert_recipient_query, (alertId, user_id[0]))
+        recipients = resolve_recipients(cursor, alert.recipients)
+        user_ids = [user_id for user_id, _ in recipients]
+        alertId = insert_alert(cursor, alert, user_ids)
+        alert_hub.notify_in_transaction(cursor, alertId)
 
         connection.commit()
         logging.info("Alert inserted successfully")
+        alert.alertId = alertId
+        alert_hub.publish(alert.to_dict(), user_ids)
 
         return alertId
     except Exception as e:
         logging.error("Error inserting alert into database: " + str(e))
-        raise e    
+        connection.rollback()
+        raise e
     finally:
         cursor.close()
         connection.close()
@@ -172,8 +228,10 @@ def send_notification(alert):
     """
     Sends a notification based on the alert type.
 
-    If the alert is a push notification, it logs the action and saves the alert.
-    If the alert is an email notification, it sends an email to each recipient listed in the alert.
+    The recipients of all the roles are retrieved with one query. If the alert is a push notification, the alert
+    and its recipients are saved in the same transaction. If the alert is an email notification, an email for
+    each recipient is queued in the mail outbox, which sends them in the background over a reused SMTP connection.
+    Push notifications are also sent to the recipients connected to the alert stream, see AlertHub.
 
     Args:
         alert (Alert): An alert object containing notification details. 
@@ -189,104 +247,289 @@ def send_notification(alert):
     Returns:
         None
     """
-    if alert.isPush:
-        logging.info("Sending push notification")
-        alertId = save_alert(alert)
-        alert.alertId = alertId
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
+    try:
+        recipients = resolve_recipients(cursor, alert.recipients)
+        if alert.isPush:
+            logging.info("Sending push notification")
+            user_ids = [user_id for user_id, _ in recipients]
+            alert.alertId = insert_alert(cursor, alert, user_ids)
+            alert_hub.notify_in_transaction(cursor, alert.alertId)
+            connection.commit()
+            alert_hub.publish(alert.to_dict(), user_ids)
+    except Exception as e:
+        logging.error("Error inserting alert into database: " + str(e))
+        connection.rollback()
+        raise e
+    finally:
+        cursor.close()
+        connection.close()
     if alert.isEmail:
-        for recipient in alert.recipients:
-            emails = retrieve_email(recipient)
-            logging.info("Sending email to %s", emails)
-            for email in emails:
-                send_email(email, alert)
+        emails = list(dict.fromkeys(email for _, email in recipients))
+        logging.info("Queueing email to %s", emails)
+        for email in emails:
+            mail_outbox.enqueue(build_alert_email(email, alert))
+
+def parse_triggered_at(value):
+    """Parse the ISO 8601 triggeredAt of an alert, as the TIMESTAMP stored in the database (UTC if it has an offset)."""
+    triggered_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if triggered_at.tzinfo is not None:
+        triggered_at = triggered_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return triggered_at
+
+def alert_key(alert):
+    """The fields identifying repetitions of the same alert."""
+    return alert.machineName, alert.type, alert.title
+
+def deduplicate_alerts(alerts, last_seen, window):
+    """
+    Discard the alerts repeating an earlier one within a time window.
 
-def retrieve_email(role):
+    Args:
+        alerts (list): The alerts, as Alert objects.
+        last_seen (dict): The time of the latest saved alert of each key, see alert_key.
+        window (int): The window in seconds.
+
+    Returns:
+        list: The alerts to keep, by time.
+
+    Raises:
+        ValueError: If triggeredAt is not an ISO 8601 date.
+    """
+    last_seen = dict(last_seen)
+    kept = []
+    for triggered_at, alert in sorted(((parse_triggered_at(alert.triggeredAt), alert) for alert in alerts),
+                                      key=lambda item: item[0]):
+        key = alert_key(alert)
+        previous = last_seen.get(key)
+        if previous is not None and triggered_at - previous < timedelta(seconds=window):
+            continue
+        last_seen[key] = triggered_at
+        kept.append(alert)
+    return kept
+
+def save_alerts(alerts, window=ALERT_DEDUP_WINDOW):
     """
-    Retrieve email addresses of users with a specific role from the database.
+    Save a batch of alerts and notify their recipients.
+
+    An alert is discarded if an alert of the same machine, type and title was saved or is in the batch less than
+    window seconds before it. The kept alerts are saved in a single transaction: one query resolves the recipients
+    of every role, one reads the latest alerts of the machines, one multi-row statement inserts the alerts and one
+    their recipients. Every alert is saved, so that later batches are deduplicated against it, but only push alerts
+    get recipients. The connected users are then notified with a single dispatch and the emails are queued in the
+    mail outbox.
 
     Args:
-        role (str): The role of the users whose email addresses are to be retrieved.
+        alerts (list): The alerts, as Alert objects.
+        window (int): Seconds in which a repeated alert is discarded.
 
     Returns:
-        list: A list of email addresses of users with the specified role.
+        dict: The number of alerts received and discarded, and the IDs of the saved alerts.
 
     Raises:
-        Exception: If there is an error retrieving email addresses from the database.
+        ValueError: If triggeredAt is not an ISO 8601 date.
+        Exception: If there is an error inserting the alerts into the database.
     """
-    query = "SELECT Email FROM Users WHERE Role = %s"
+    earliest = min(parse_triggered_at(alert.triggeredAt) for alert in alerts) - timedelta(seconds=window)
+    roles = sorted({role for alert in alerts for role in alert.recipients})
+    machines = sorted({alert.machineName for alert in alerts})
 
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
     try:
-        connection, cursor = get_db_connection()
-        cursor.execute(query, (role,))
-        response = cursor.fetchall()
-        emails = [row[0] for row in response]
-        return emails
+        # concurrent batches are deduplicated against each other
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('AlertIntake'))")
+        cursor.execute("SELECT UserID, Email, Role FROM Users WHERE Role = ANY(%s)", (roles,))
+        users_by_role = {}
+        for user_id, email, role in cursor.fetchall():
+            users_by_role.setdefault(role, []).append((user_id, email))
+
+        cursor.execute("""
+        SELECT MachineName, Type, Title, MAX(TriggeredAt) FROM Alerts
+        WHERE MachineName = ANY(%s) AND TriggeredAt >= %s
+        GROUP BY MachineName, Type, Title
+        """, (machines, earliest))
+        kept = deduplicate_alerts(alerts, {tuple(row[:3]): row[3] for row in cursor.fetchall()}, window)
+
+        if kept:
+            alert_ids = execute_values(cursor, """
+            INSERT INTO Alerts (Title, Type, Description, TriggeredAt, MachineName, isPush, Severity)
+            VALUES %s RETURNING AlertID
+            """, [(alert.title, alert.type, alert.description, alert.triggeredAt, alert.machineName,
+                   bool(alert.isPush), alert.severity.value) for alert in kept], fetch=True, page_size=len(kept))
+            for alert, (alert_id,) in zip(kept, alert_ids):
+                alert.alertId = alert_id
+
+        recipients = []
+        for alert in kept:
+            users = list(dict.fromkeys(user for role in alert.recipients for user in users_by_role.get(role, [])))
+            recipients.append(users)
+        rows = [(alert.alertId, user_id) for alert, users in zip(kept, recipients) if alert.isPush
+                for user_id, _ in users]
+        if rows:
+            execute_values(cursor, "INSERT INTO AlertRecipients (AlertID, UserID) VALUES %s ON CONFLICT DO NOTHING",
+                           rows, page_size=len(rows))
+        pushed = [(alert.to_dict(), [user_id for user_id, _ in users])
+                  for alert, users in zip(kept, recipients) if alert.isPush]
+        alert_hub.notify_in_transaction(cursor, *[alert["alertId"] for alert, _ in pushed])
+        connection.commit()
     except Exception as e:
-        logging.error("Error retrieving emails for role " + role + ": " + str(e))
+        logging.error("Error inserting alerts into database: " + str(e))
+        connection.rollback()
         raise e
     finally:
         cursor.close()
         connection.close()
 
-def retrieve_alerts(userId, all):
+    alert_hub.publish_batch(pushed)
+    for alert, users in zip(kept, recipients):
+        if alert.isEmail:
+            for email in dict.fromkeys(email for _, email in users):
+                mail_outbox.enqueue(build_alert_email(email, alert))
+    logging.info("Saved %d of %d alerts", len(kept), len(alerts))
+
+    return {
+        "received": len(alerts),
+        "duplicates": len(alerts) - len(kept),
+        "alertIds": [alert.alertId for alert in kept]
+    }
+
+def alert_row_to_dict(row):
+    """
+    Convert a row of the Alerts table to the dictionary of an alert.
+
+    The rows come from the database, so they are not validated again through the Alert model.
+
+    Args:
+        row (tuple): AlertID, Title, Type, Description, TriggeredAt, MachineName, isPush and Severity.
+
+    Returns:
+        dict: The alert, as returned by Alert.to_dict.
     """
-    Retrieve alerts for a specific user from the database.
-    
+    return {
+        "alertId": row[0],
+        "title": row[1],
+        "type": row[2],
+        "description": row[3],
+        "triggeredAt": str(row[4]),
+        "machineName": row[5],
+        "isPush": bool(row[6]),
+        "isEmail": False,
+        "recipients": [],
+        "severity": row[7]
+    }
+
+def retrieve_alerts(userId, all=True, since_id=None, limit=ALERT_PAGE_SIZE):
+    """
+    Retrieve a page of alerts for a specific user from the database, oldest first.
+
+    The page is read with the (UserID, Read, AlertID) index of AlertRecipients and only the alerts in it are
+    marked as read, in the same statement. The next page starts after the ID of the last returned alert.
+
     Args:
         userId (str): The ID of the user for whom to retrieve alerts.
         all (bool): Flag to determine whether to retrieve all alerts or only unread alerts.
-        
+        since_id (int, optional): Only the alerts with a greater ID are returned.
+        limit (int): The maximum number of alerts, at most ALERT_PAGE_MAX.
+
     Returns:
         list: A list of dictionaries, each representing an alert.
-        
+
     Raises:
         Exception: If there is an error retrieving alerts from the database.
     """
-    query = """
-    SELECT a.* FROM Alerts a
-    JOIN AlertRecipients ar ON a.AlertID = ar.AlertID
-    JOIN Users u ON ar.UserID = u.UserID
-    WHERE u.userID = %s
-    """
-    
+    conditions = ["ar.UserID = %s"]
+    params = [userId]
     if not all:
-        query += " AND ar.Read = FALSE"
+        conditions.append("ar.Read = FALSE")
+    if since_id is not None:
+        conditions.append("ar.AlertID > %s")
+        params.append(since_id)
+    params.append(min(max(int(limit), 1), ALERT_PAGE_MAX))
+
+    query = f"""
+    WITH page AS (
+        SELECT ar.AlertID FROM AlertRecipients ar
+        WHERE {" AND ".join(conditions)}
+        ORDER BY ar.AlertID
+        LIMIT %s
+    ), marked AS (
+        UPDATE AlertRecipients SET Read = TRUE
+        WHERE UserID = %s AND Read = FALSE AND AlertID IN (SELECT AlertID FROM page)
+    )
+    SELECT a.AlertID, a.Title, a.Type, a.Description, a.TriggeredAt, a.MachineName, a.isPush, a.Severity
+    FROM page JOIN Alerts a ON a.AlertID = page.AlertID
+    ORDER BY a.AlertID
+    """
+    params.append(userId)
 
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
     try:
-        connection, cursor = get_db_connection()
-        cursor.execute(query, (userId,))
+        cursor.execute(query, tuple(params))
         response = cursor.fetchall()
-        
-        alerts = []
-        for row in response:
-            logging.info("Row: %s", row)
-            alert = Alert(
-                alertId=row[0],
-                title=row[1],
-                type=row[2],
-                description=row[3],
-                triggeredAt=str(row[4]),
-                machineName=row[5],
-                isPush=bool(row[6]),
-                isEmail=False,
-                recipients=[],
-                severity=row[7]
-            )
-            alerts.append(alert.to_dict())
-
-        # Update all alerts to mark them as read
-        update_query = """
-        UPDATE AlertRecipients
-        SET Read = TRUE
-        WHERE UserID = %s
-        """
-        cursor.execute(update_query, (userId,))
         connection.commit()
 
-        return alerts
+        return [alert_row_to_dict(row) for row in response]
+    except Exception as e:
+        logging.error("Error retrieving alerts for " + str(userId) + ": " + str(e))
+        raise e
+    finally:
+        cursor.close()
+        connection.close()
+
+def count_unread_alerts(userId):
+    """
+    Count the unread alerts of a user, using only the (UserID, Read, AlertID) index.
+
+    Args:
+        userId (str): The ID of the user.
+
+    Returns:
+        int: The number of unread alerts.
+    """
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
+    try:
+        cursor.execute("SELECT COUNT(*) FROM AlertRecipients WHERE UserID = %s AND Read = FALSE", (userId,))
+        return cursor.fetchone()[0]
     except Exception as e:
-        logging.error("Error retrieving alerts for " + userId + ": " + str(e))
+        logging.error("Error counting alerts for " + str(userId) + ": " + str(e))
         raise e
     finally:
         cursor.close()
-        connection.close()
\ No newline at end of file
+        connection.close()
+
+def retrieve_pushed_alerts(alert_ids, user_ids):
+    """
+    Load alerts to push to the connected users, with a single query.
+
+    Args:
+        alert_ids (list): The IDs of the alerts.
+        user_ids (list): The IDs of the connected users.
+
+    Returns:
+        list: (alert dict, IDs of its recipients among the users) for every alert with such recipients.
+    """
+    query = """
+    SELECT a.AlertID, a.Title, a.Type, a.Description, a.TriggeredAt, a.MachineName, a.isPush, a.Severity,
+           array_agg(ar.UserID)
+    FROM Alerts a JOIN AlertRecipients ar ON a.AlertID = ar.AlertID
+    WHERE a.AlertID = ANY(%s) AND ar.UserID = ANY(%s)
+    GROUP BY a.AlertID
+    ORDER BY a.AlertID
+    """
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
+    try:
+        cursor.execute(query, (list(alert_ids), list(user_ids)))
+        return [(alert_row_to_dict(row), row[8]) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        connection.close()
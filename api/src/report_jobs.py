@@ -0,0 +1,246 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from fastapi.concurrency import run_in_threadpool
+from fpdf import FPDF
+
+from database.connection import transaction
+from database.minio_connection import get_minio_connection
+from instrumentation import timed_upstream
+
+# Worker processes rendering the PDFs, so that rendering never competes with the requests for the GIL
+REPORT_RENDER_PROCESSES = int(os.getenv("REPORT_RENDER_PROCESSES", "2"))
+# Seconds after which a job still queued or running is reported as failed (its process was stopped)
+REPORT_JOB_TIMEOUT = int(os.getenv("REPORT_JOB_TIMEOUT", "900"))
+# Maximum seconds a status request waits for the job to complete
+REPORT_JOB_MAX_WAIT = 30
+
+_executor = None
+
+
+def render_pdf(text: str, appendix: str) -> bytes:
+    """
+    This function renders the PDF of a report, it runs in a worker process.
+    Args:
+        text: the text of the PDF.
+        appendix: the appendix of the PDF, the JSON list of the sources of the text.
+    Returns:
+        The content of the PDF file.
+    """
+    pdf = FPDF()
+    try:
+        pdf.set_font('Arial', '', 12)
+        pdf.add_page()
+        lines = text.split("\n")
+        for line in lines:
+            if len(line) > 0:
+                pdf.multi_cell(190, 5, line)
+            else:
+                pdf.ln()
+        pdf.add_page()
+        pdf.set_font('Arial', 'B', 12)
+        pdf.cell(190, 5, "Explanation")
+        pdf.ln()
+        pdf.ln()
+        pdf.set_font('Arial', '', 12)
+        appendix = json.loads(appendix)
+        for obj in appendix:
+            if obj.get("context", None) is not None and obj.get("reference_number", None) is not None and obj.get(
+                    "source_name", None) is not None:
+                pdf.cell(190, 5, "[" + str(obj["reference_number"]) + "]")
+                pdf.ln()
+                pdf.cell(190, 5, "Context:")
+                lines = obj["context"].split("\n")
+                for line in lines:
+                    if len(line) > 0:
+                        pdf.multi_cell(190, 5, line)
+                    else:
+                        pdf.ln()
+                pdf.ln()
+                pdf.set_text_color(0, 0, 255)
+                pdf.cell(190, 5, "Source: " + str(obj["source_name"]))
+                pdf.set_text_color(0, 0, 0)
+                pdf.ln()
+                pdf.ln()
+    except Exception:
+        # the pages rendered so far are returned
+        logging.exception("Report PDF not rendered completely")
+    data = pdf.output(dest="S")
+    # fpdf returns the document as a latin-1 string
+    return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=REPORT_RENDER_PROCESSES)
+    return _executor
+
+
+def store_report(userId: str, obj_name: str, pdf: bytes, type: str = None) -> int:
+    """
+    This function uploads the PDF of a report to MinIO from memory and inserts it in the DB.
+    Args:
+        userId: the id of the user.
+        obj_name: the name of the report, without extension.
+        pdf: the content of the PDF.
+        type: the type of the report.
+    Returns:
+        The id of the report.
+    """
+    obj_path = "/reports/" + userId + "/" + obj_name + ".pdf"
+    minio = get_minio_connection()
+    with timed_upstream("minio"):
+        minio.put_object("reports", userId + "/" + obj_name + ".pdf", BytesIO(pdf), length=len(pdf),
+                         content_type="application/pdf")
+    with transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO Reports (Name, Type, OwnerId, GeneratedAt, FilePath, SiteName) "
+            "VALUES (%s, %s, %s, %s, %s, %s) RETURNING ReportID",
+            (obj_name + ".pdf", type or "Standard", int(userId), datetime.now(), obj_path, "Test")
+        )
+        return cursor.fetchone()[0]
+
+
+async def create_report(answer, userId: str, obj_name: str, type: str = None) -> tuple:
+    """
+    This function renders the PDF of an answer of the AI agent in a worker process and stores it.
+    Args:
+        answer: the Answer object from the AI agent, or its dict.
+        userId: the id of the user.
+        obj_name: the name of the report, without extension.
+        type: the type of the report.
+    Returns:
+        The id of the report and the content of the PDF.
+    """
+    # if answer is a dict, access the data via ['data']
+    if isinstance(answer, dict):
+        text, appendix = answer["data"], answer["textExplanation"]
+    else:
+        text, appendix = answer.data, answer.textExplanation
+    pdf = await asyncio.get_running_loop().run_in_executor(_get_executor(), render_pdf, text, appendix)
+    report_id = await run_in_threadpool(store_report, userId, obj_name, pdf, type)
+    return report_id, pdf
+
+
+def create_job(userId: int) -> int:
+    """Insert a queued job, returning its id."""
+    with transaction() as cursor:
+        cursor.execute("INSERT INTO ReportJobs (UserID) VALUES (%s) RETURNING JobID", (userId,))
+        return cursor.fetchone()[0]
+
+
+# The statuses a job can move to a status from: a job completed (done or failed) never changes again
+JOB_TRANSITIONS = {"running": ("queued",), "done": ("running",), "failed": ("queued", "running")}
+
+
+def update_job(job_id: int, status: str, report_id: int = None, error: str = None):
+    """Set the status of a job, with the report it generated or its error, if it is in a status preceding it."""
+    with transaction() as cursor:
+        cursor.execute(
+            "UPDATE ReportJobs SET Status = %s, ReportID = %s, Error = %s, UpdatedAt = LOCALTIMESTAMP "
+            "WHERE JobID = %s AND Status IN %s",
+            (status, report_id, error, job_id, JOB_TRANSITIONS[status])
+        )
+
+
+def get_job(job_id: int):
+    """
+    Read the status of a job.
+    Args:
+        job_id: the id of the job.
+    Returns:
+        A dict with jobId, userId, status (queued, running, done or failed), reportId and error, None if the job
+        does not exist.
+    """
+    with transaction() as cursor:
+        cursor.execute(
+            "SELECT JobID, UserID, Status, ReportID, Error, UpdatedAt < LOCALTIMESTAMP - make_interval(secs => %s) "
+            "FROM ReportJobs WHERE JobID = %s",
+            (REPORT_JOB_TIMEOUT, job_id)
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    job_id, user_id, status, report_id, error, expired = row
+    if status in ("queued", "running") and expired:
+        status, error = "failed", "The job was interrupted"
+    return {"jobId": job_id, "userId": user_id, "status": status, "reportId": report_id, "error": error}
+
+
+class ReportJobQueue:
+    """
+    Runs report generations in the background and keeps their status in the ReportJobs table.
+
+    A job runs in the process that accepted it: the AI agent is awaited on the event loop, the PDF is rendered by
+    a worker process and stored from memory. The status is in the database, so it can be read from any API
+    process; clients of the process running the job can wait for its completion instead of polling.
+    """
+
+    def __init__(self):
+        self._done = {}
+        self._tasks = set()
+
+    async def submit(self, userId: int, work) -> int:
+        """
+        Queue a job.
+        Args:
+            userId: the id of the user requesting the report.
+            work: the coroutine function generating the report, returning its id.
+        Returns:
+            The id of the job.
+        """
+        job_id = await run_in_threadpool(create_job, userId)
+        self._done[job_id] = asyncio.Event()
+        task = asyncio.create_task(self._run(job_id, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    async def _run(self, job_id: int, work):
+        try:
+            await run_in_threadpool(update_job, job_id, "running")
+            report_id = await work()
+            await run_in_threadpool(update_job, job_id, "done", report_id)
+        except Exception as e:
+            logging.error("Report job %s failed: %s", job_id, str(e))
+            try:
+                await run_in_threadpool(update_job, job_id, "failed", None, str(e))
+            except Exception as update_error:
+                logging.error("Report job %s not updated: %s", job_id, str(update_error))
+        finally:
+            self._done.pop(job_id).set()
+
+    async def status(self, job_id: int, wait: float = 0):
+        """
+        Read the status of a job.
+        Args:
+            job_id: the id of the job.
+            wait: seconds to wait for the job to complete if it runs in this process (at most REPORT_JOB_MAX_WAIT).
+        Returns:
+            The status of the job, see get_job.
+        """
+        done = self._done.get(job_id)
+        if done is not None and wait > 0:
+            try:
+                await asyncio.wait_for(done.wait(), timeout=min(wait, REPORT_JOB_MAX_WAIT))
+            except asyncio.TimeoutError:
+                pass
+        return await run_in_threadpool(get_job, job_id)
+
+    def shutdown(self):
+        """Cancel the running jobs and stop the rendering processes."""
+        global _executor
+        for task in list(self._tasks):
+            task.cancel()
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+report_jobs = ReportJobQueue()
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from fastapi.concurrency import run_in_threadpool
+from psycopg2.extras import Json
+
+from database.connection import transaction
+from model.report import ScheduledReport
+
+# Seconds between two checks for due schedules
+REPORT_SCHEDULER_POLL = float(os.getenv("REPORT_SCHEDULER_POLL", "5"))
+# Reports generated at the same time by one process
+REPORT_SCHEDULER_WORKERS = int(os.getenv("REPORT_SCHEDULER_WORKERS", "2"))
+# Seconds a claimed schedule is reserved to a process, after which a crashed run stops blocking the schedule
+REPORT_SCHEDULER_LEASE = int(os.getenv("REPORT_SCHEDULER_LEASE", "3600"))
+# Seconds a user's list of schedules is served from memory, changes made through another API process are seen after it
+SCHEDULE_CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "60"))
+
+START_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _to_params(schedule_id: int, params: dict) -> ScheduledReport:
+    return ScheduledReport(**{**params, "id": schedule_id})
+
+
+_schedule_cache = {}
+_schedule_cache_lock = threading.Lock()
+
+
+def list_schedules(user_id: int) -> list:
+    """
+    Return the schedules of a user.
+
+    The list is read with the (UserID, Name) index of ReportSchedules and kept in memory for SCHEDULE_CACHE_TTL
+    seconds; saving a schedule in this process drops the user's copy at once.
+
+    Args:
+        user_id (int): The id of the owner.
+
+    Returns:
+        list: The ScheduledReport dicts of the user, by name.
+    """
+    with _schedule_cache_lock:
+        cached = _schedule_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < SCHEDULE_CACHE_TTL:
+        return cached[1]
+
+    loaded_at = time.monotonic()
+    with transaction() as cursor:
+        cursor.execute("SELECT ScheduleID, Name, Params FROM ReportSchedules WHERE UserID = %s ORDER BY Name",
+                       (user_id,))
+        rows = cursor.fetchall()
+    schedules = [_to_params(schedule_id, {**params, "name": name}).model_dump(mode="json")
+                 for schedule_id, name, params in rows]
+    with _schedule_cache_lock:
+        _schedule_cache[user_id] = (loaded_at, schedules)
+    return schedules
+
+
+def invalidate_schedules(user_id: int = None):
+    """
+    Drop the cached schedules of a user, or of every user.
+
+    Args:
+        user_id (int, optional): The id of the owner, None for every user.
+    """
+    with _schedule_cache_lock:
+        if user_id is None:
+            _schedule_cache.clear()
+        else:
+            _schedule_cache.pop(user_id, None)
+
+
+def save_schedule(user_id: int, params: ScheduledReport) -> ScheduledReport:
+    """
+    Insert or update the schedule of a report.
+
+    An existing schedule (params.id) keeps its name; the next run restarts from params.startDate. A new schedule
+    with the name of an existing one of the same user replaces it.
+
+    Args:
+        user_id (int): The id of the owner.
+        params (ScheduledReport): The settings of the report to schedule.
+
+    Returns:
+        ScheduledReport: The saved settings, with the id of the schedule.
+    """
+    next_run = datetime.strptime(params.startDate, START_DATE_FORMAT)
+    with transaction() as cursor:
+        row = None
+        if params.id is not None:
+            cursor.execute(
+                "UPDATE ReportSchedules SET Params = %s, NextRun = %s, IntervalSeconds = %s "
+                "WHERE ScheduleID = %s AND UserID = %s RETURNING ScheduleID, Name",
+                (Json(params.model_dump(exclude={"id", "name"})), next_run, params.recurrence.seconds,
+                 params.id, user_id)
+            )
+            row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO ReportSchedules (UserID, Name, Params, NextRun, IntervalSeconds) "
+                "VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (UserID, Name) DO UPDATE SET Params = EXCLUDED.Params, NextRun = EXCLUDED.NextRun, "
+                "IntervalSeconds = EXCLUDED.IntervalSeconds RETURNING ScheduleID, Name",
+                (user_id, params.name, Json(params.model_dump(exclude={"id", "name"})), next_run,
+                 params.recurrence.seconds)
+            )
+            row = cursor.fetchone()
+    invalidate_schedules(user_id)
+    return params.model_copy(update={"id": row[0], "name": row[1]})
+
+
+def import_legacy_schedules(minio) -> int:
+    """
+    Copy the schedules stored as <userId>/<name>_scheduling.json objects in MinIO into ReportSchedules.
+
+    Schedules already in the table are left untouched, so the import can run at every startup.
+
+    Args:
+        minio (Minio): The MinIO client.
+
+    Returns:
+        int: The number of imported schedules.
+    """
+    imported = 0
+    for obj in minio.list_objects(bucket_name="settings", recursive=True):
+        if not obj.object_name.endswith("_scheduling.json"):
+            continue
+        try:
+            user_id = int(obj.object_name.split("/")[0])
+            response = minio.get_object("settings", obj.object_name)
+            params = ScheduledReport(**json.loads(response.read().decode("utf-8")))
+            with transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO ReportSchedules (UserID, Name, Params, NextRun, IntervalSeconds) "
+                    "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (UserID, Name) DO NOTHING RETURNING ScheduleID",
+                    (user_id, params.name, Json(params.model_dump(exclude={"id", "name"})),
+                     datetime.strptime(params.startDate, START_DATE_FORMAT), params.recurrence.seconds)
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                imported += 1
+        except Exception as e:
+            logging.error("Schedule %s not imported: %s", obj.object_name, str(e))
+    return imported
+
+
+def claim_due_schedules(limit: int) -> list:
+    """
+    Reserve the schedules whose next run is due.
+
+    The due rows are locked with SKIP LOCKED, so concurrent API processes never claim the same run. The next run
+    is moved past the current time in the same statement (missed runs are skipped, not replayed) and the row is
+    leased until the report is generated, so a slow report can not overlap with its next run.
+
+    Args:
+        limit (int): The maximum number of schedules to claim.
+
+    Returns:
+        list: (user id, ScheduledReport) of the claimed schedules.
+    """
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            UPDATE ReportSchedules SET
+                NextRun = NextRun + make_interval(secs => IntervalSeconds *
+                    (FLOOR(EXTRACT(EPOCH FROM (LOCALTIMESTAMP - NextRun)) / IntervalSeconds) + 1)),
+                LeasedUntil = LOCALTIMESTAMP + make_interval(secs => %s)
+            WHERE ScheduleID IN (
+                SELECT ScheduleID FROM ReportSchedules
+                WHERE NextRun <= LOCALTIMESTAMP AND (LeasedUntil IS NULL OR LeasedUntil < LOCALTIMESTAMP)
+                ORDER BY NextRun
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING ScheduleID, UserID, Name, Params
+            """,
+            (REPORT_SCHEDULER_LEASE, limit)
+        )
+        rows = cursor.fetchall()
+    return [(user_id, _to_params(schedule_id, {**params, "name": name})) for schedule_id, user_id, name, params in rows]
+
+
+def release_schedule(schedule_id: int, error: str = None):
+    """
+    End the lease of a schedule after its run.
+
+    Args:
+        schedule_id (int): The id of the schedule.
+        error (str, optional): The error of the run, None if it succeeded.
+    """
+    with transaction() as cursor:
+        cursor.execute(
+            "UPDATE ReportSchedules SET LeasedUntil = NULL, LastRun = LOCALTIMESTAMP, LastError = %s "
+            "WHERE ScheduleID = %s",
+            (error, schedule_id)
+        )
+
+
+class ReportScheduler:
+    """
+    Runs the scheduled reports stored in the ReportSchedules table.
+
+    Every API process runs one scheduler: it periodically claims the due schedules (see claim_due_schedules) and
+    generates them concurrently, up to workers at a time. The database calls run in the threadpool, so the event
+    loop is never blocked by the scheduler.
+
+    Attributes:
+        job: The coroutine function generating a report, called with the user id and the ScheduledReport.
+        poll_interval (float): Seconds between two checks for due schedules.
+        workers (int): Maximum number of reports generated at the same time.
+    """
+
+    def __init__(self, job, poll_interval: float = REPORT_SCHEDULER_POLL, workers: int = REPORT_SCHEDULER_WORKERS):
+        self.job = job
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self._running = set()
+
+    async def _execute(self, user_id: int, params: ScheduledReport):
+        error = None
+        try:
+            logging.info("Run scheduled report %s", params.name)
+            await self.job(str(user_id), params)
+        except Exception as e:
+            logging.error("Scheduled report %s failed: %s", params.name, str(e))
+            error = str(e)
+        finally:
+            try:
+                await run_in_threadpool(release_schedule, params.id, error)
+            except Exception as e:
+                logging.error("Schedule %s not released: %s", params.id, str(e))
+
+    async def run_pending(self):
+        """Claim the due schedules and start them, within the free workers."""
+        free = self.workers - len(self._running)
+        if free <= 0:
+            return
+        for user_id, params in await run_in_threadpool(claim_due_schedules, free):
+            task = asyncio.create_task(self._execute(user_id, params))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def run(self, get_minio=None):
+        """
+        Run the scheduler until cancelled.
+
+        Args:
+            get_minio (callable, optional): If given, the legacy schedules in the MinIO it connects to are
+                                            imported first.
+        """
+        if get_minio is not None:
+            try:
+                imported = await run_in_threadpool(import_legacy_schedules, get_minio())
+                logging.info("Imported %d schedules from MinIO", imported)
+            except Exception as e:
+                logging.error("Legacy schedules not imported: %s", str(e))
+        try:
+            while True:
+                try:
+                    await self.run_pending()
+                except Exception as e:
+                    logging.error("Report scheduler: %s", str(e))
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            for task in list(self._running):
+                task.cancel()
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import os
+
+import orjson
+
+# Merge identical concurrent requests to the upstreams, otherwise every request makes its own call
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def flight_key(*parts) -> str:
+    """
+    Return the key identifying a request, the hash of its parts (path, body, ...) normalized as JSON.
+
+    Dictionaries are compared regardless of the order of their keys, lists in their order.
+
+    Args:
+        *parts: The values identifying the request, serializable as JSON.
+
+    Returns:
+        str: The key.
+    """
+    return hashlib.sha1(orjson.dumps(parts, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
+
+class SingleFlight:
+    """
+    Merges identical requests in flight at the same time into a single upstream call.
+
+    The first request with a key (the leader) starts the call, the requests with the same key arriving before it
+    completes wait for it and share its result or its exception. The call runs in its own task, so the waiters
+    still get the result if the client of the leader disconnects. Nothing is kept once the call completes: to
+    also serve later requests, the result is stored in a cache checked before the flight.
+
+    Attributes:
+        name (str): The name of the flight, in the counters.
+        enabled (bool): Whether the requests are merged.
+    """
+
+    def __init__(self, name: str, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._calls = {}
+        self._counters = {"leaders": 0, "merged": 0, "errors": 0}
+
+    async def do(self, key: str, call):
+        """
+        Run a call, or wait for the identical one in flight.
+
+        Must be called on the event loop.
+
+        Args:
+            key (str): The key of the request, see flight_key.
+            call (callable): Called without arguments, returns the awaitable of the upstream call.
+
+        Returns:
+            The result of the call, shared by all the requests with the key: it must not be modified.
+
+        Raises:
+            Exception: The exception raised by the call.
+        """
+        if not self.enabled:
+            return await call()
+        task = self._calls.get(key)
+        if task is None:
+            self._counters["leaders"] += 1
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._complete(key, done))
+        else:
+            self._counters["merged"] += 1
+        return await asyncio.shield(task)
+
+    def _complete(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # retrieve the exception, so that it is not reported when all the waiters were cancelled
+        if not task.cancelled() and task.exception() is not None:
+            self._counters["errors"] += 1
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the flight.
+
+        Returns:
+            dict: Calls made (leaders), requests merged into a call in flight, failed calls and calls in flight.
+        """
+        return {**self._counters, "in_flight": len(self._calls)}
+
+
+flights = {name: SingleFlight(name) for name in ("catalog", "calculate", "historical")}
+
+
+def flight_stats() -> dict:
+    """Return the counters of every flight."""
+    return {name: flight.stats() for name, flight in flights.items()}
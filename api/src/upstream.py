@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+from instrumentation import UPSTREAM_ERRORS, observe_upstream, trace_headers
+
+# Upper bounds, in seconds, of the latency histogram buckets (the last bucket is +Inf)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Requests that can be repeated without side effects, retried also when the upstream may have received them
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without contacting an upstream whose circuit breaker is open."""
+
+    def __init__(self, name: str):
+        super().__init__(f"The {name} service is temporarily unavailable")
+        self.name = name
+
+
+class Upstream:
+    """
+    Asynchronous HTTP client for one of the services the API layer forwards requests to.
+
+    Connections are kept alive and reused through the pool of a shared httpx.AsyncClient. Every request
+    has a timeout and failed ones are retried with exponential backoff: connection errors always, timeouts
+    and 502/503/504 answers only for idempotent methods. After failure_threshold consecutive failures the
+    circuit opens and requests fail immediately with UpstreamUnavailable for reset_timeout seconds, then a
+    request is let through again to probe the service. Latencies and failures are also exported on /metrics,
+    and every request carries the trace ID of the request being served.
+
+    Attributes:
+        name (str): The name of the upstream service.
+        timeout (float): Seconds to wait for an answer.
+        connect_timeout (float): Seconds to wait for a connection.
+        retries (int): Maximum number of retries of a failed request.
+        failure_threshold (int): Consecutive failures after which the circuit opens.
+        reset_timeout (float): Seconds the circuit stays open.
+        max_connections (int): Maximum number of connections to the upstream.
+    """
+
+    def __init__(self, name: str, timeout: float = 30.0, connect_timeout: float = 3.0, retries: int = 2,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0, max_connections: int = 20,
+                 transport: httpx.AsyncBaseTransport = None):
+        self.name = name
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_connections = max_connections
+        self._transport = transport
+        self._client = None
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._counters = {"requests": 0, "errors": 0, "retries": 0, "rejected": 0}
+        self._buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The client of the upstream, created at the first request."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=self._transport
+            )
+        return self._client
+
+    @property
+    def circuit_state(self) -> str:
+        """closed, open or half-open."""
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def _observe(self, elapsed: float):
+        observe_upstream(self.name, elapsed)
+        self._latency_sum += elapsed
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self._buckets[i] += 1
+                return
+        self._buckets[-1] += 1
+
+    def _record_success(self):
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def _record_failure(self):
+        UPSTREAM_ERRORS.inc(self.name)
+        self._counters["errors"] += 1
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            if self._opened_at is None or self.circuit_state == "half-open":
+                logging.warning("Circuit of %s opened after %d failures", self.name, self._consecutive_failures)
+            self._opened_at = time.monotonic()
+
+    async def request(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request to the upstream.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The absolute URL of the request.
+            stream (bool): If True, the body of the response is not read: the caller iterates it and must close
+                           the response (await response.aclose()).
+            **kwargs: Any other argument of httpx.AsyncClient.request (headers, json, content, params...).
+
+        Returns:
+            httpx.Response: The response of the upstream, whatever its status code.
+
+        Raises:
+            UpstreamUnavailable: If the circuit of the upstream is open.
+            httpx.HTTPError: If the request still fails after the retries.
+        """
+        if self.circuit_state == "open":
+            self._counters["rejected"] += 1
+            raise UpstreamUnavailable(self.name)
+
+        if kwargs.get("headers"):
+            # as requests does, headers without a value are not sent
+            kwargs["headers"] = {key: value for key, value in kwargs["headers"].items() if value is not None}
+        # the trace ID of the request being served, so the call can be followed in the logs of the upstream
+        kwargs["headers"] = trace_headers(kwargs.get("headers"))
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            self._counters["requests"] += 1
+            start = time.perf_counter()
+            try:
+                response = await self.client.send(self.client.build_request(method, url, **kwargs), stream=stream)
+            except httpx.TransportError as error:
+                self._observe(time.perf_counter() - start)
+                self._record_failure()
+                # a request that could not connect never reached the upstream and can always be repeated
+                retriable = idempotent or isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retriable or attempt >= self.retries or self.circuit_state == "open":
+                    raise
+            else:
+                self._observe(time.perf_counter() - start)
+                if response.status_code < 500:
+                    self._record_success()
+                    return response
+                self._record_failure()
+                if not idempotent or response.status_code not in RETRY_STATUS_CODES \
+                        or attempt >= self.retries or self.circuit_state == "open":
+                    return response
+                await response.aclose()
+            attempt += 1
+            self._counters["retries"] += 1
+            await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Return the counters of the upstream.
+
+        Returns:
+            dict: Requests, errors, retries and rejected requests, the state of the circuit and the latency
+                  histogram (cumulative counts per upper bound in seconds, as in Prometheus).
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], self._buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            **self._counters,
+            "circuit": self.circuit_state,
+            "latency_seconds": {"buckets": buckets, "sum": self._latency_sum, "count": cumulative}
+        }
+
+    async def aclose(self):
+        """Close the connections of the upstream."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def _upstream(name: str) -> Upstream:
+    prefix = name.upper().replace("-", "_")
+    return Upstream(
+        name,
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", "120" if name in ("rag", "druid") else "30")),
+        retries=int(os.getenv(f"{prefix}_RETRIES", "2"))
+    )
+
+
+# One client per upstream, so that a slow service can not exhaust the connections of the others
+upstreams = {name: _upstream(name) for name in ("kb", "kpi-engine", "data-processing", "rag", "druid")}
+
+
+def upstream_stats() -> dict:
+    """
+    Return the counters of all the upstreams.
+
+    Returns:
+        dict: The stats of every upstream, by name.
+    """
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+
+async def close_upstreams():
+    """Close the connections of all the upstreams."""
+    for upstream in upstreams.values():
+        await upstream.aclose()
@@ -1,46 +1,213 @@
+import hashlib
 import json
 import logging
+import os
+import threading
+import time
+
+from fastapi.responses import Response
+from psycopg2.extras import Json
+
+from catalog_cache import etag_matches
 from database.connection import get_db_connection
 
-def persist_user_settings(userId, settings):
+# Seconds the settings of a user are served from memory, changes made through another API process are seen after it
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "60"))
+
+# The columns of Users storing the settings
+USER_SETTINGS = "UserSettings"
+DASHBOARD_SETTINGS = "UserDashboards"
+
+
+class SettingsEntry:
     """
-    Persist user settings to the database.
+    The settings of a user, serialized once.
+
+    Attributes:
+        value (dict): The settings.
+        body (bytes): The JSON of the settings.
+        etag (str): The strong entity tag of the body.
+        loaded_at (float): When the settings were read or written, from time.monotonic().
+    """
+
+    __slots__ = ("value", "body", "etag", "loaded_at")
+
+    def __init__(self, value):
+        self.value = value
+        self.body = json.dumps(value).encode("utf-8")
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+        self.loaded_at = time.monotonic()
+
+
+_settings_cache = {}
+_settings_cache_lock = threading.Lock()
+
+
+def _decode(value):
+    # the column is TEXT until the JSONB migration of create_db_tables.py runs
+    if value is None:
+        return {}
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
+
 
-    This function retrieves the past settings for a given user. If past settings exist,
-    it updates the settings in the database. If no past settings exist, it inserts new settings
-    into the database.
+def _cache_settings(userId, column, value):
+    entry = SettingsEntry(value)
+    with _settings_cache_lock:
+        _settings_cache[(column, str(userId))] = entry
+    return entry
+
+
+def invalidate_settings(userId=None):
+    """
+    Drop the cached settings of a user, or of every user.
 
     Args:
-        userId (int): The ID of the user whose settings are to be persisted.
-        settings (dict): A dictionary containing the user settings to be saved.
+        userId (str, optional): The ID of the user, None for every user.
+    """
+    with _settings_cache_lock:
+        if userId is None:
+            _settings_cache.clear()
+        else:
+            for column in (USER_SETTINGS, DASHBOARD_SETTINGS):
+                _settings_cache.pop((column, str(userId)), None)
+
+
+def get_settings_entry(userId, column):
+    """
+    Retrieve settings of a user, from memory if they were read or written in the last SETTINGS_CACHE_TTL seconds.
+
+    Args:
+        userId (str): The ID of the user.
+        column (str): USER_SETTINGS or DASHBOARD_SETTINGS.
+
+    Returns:
+        SettingsEntry: The settings, empty if the user has none.
 
     Raises:
-        Exception: If there is an error while saving the user settings to the database.
+        Exception: If there is an error retrieving the settings from the database.
     """
-    logging.info("Checking if user is present in the database")
-    if verify_user_presence(userId) == False:
-        logging.error("User is not present in the database")
-        return False
-    logging.info("User is present in the database")
-    
-    query = "UPDATE Users SET UserSettings = %s WHERE UserID = %s"
-    values = (json.dumps(settings), userId)
+    with _settings_cache_lock:
+        entry = _settings_cache.get((column, str(userId)))
+    if entry is not None and time.monotonic() - entry.loaded_at < SETTINGS_CACHE_TTL:
+        return entry
 
-    logging.info("Saving user settings to database")
+    logging.info("Retrieving %s from database", column)
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
+    try:
+        cursor.execute(f"SELECT {column} FROM Users WHERE UserID = %s", (userId,))
+        row = cursor.fetchone()
+    except Exception as e:
+        logging.error("Error retrieving %s from database: %s", column, str(e))
+        raise e
+    finally:
+        cursor.close()
+        connection.close()
+    return _cache_settings(userId, column, _decode(row[0]) if row else {})
+
+
+def _write_settings(userId, column, query, values, settings=None):
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
     try:
-        connection, cursor = get_db_connection()
         cursor.execute(query, values)
+        row = cursor.fetchone()
         connection.commit()
-        logging.info("User settings saved successfully")
-
-        return True
     except Exception as e:
-        logging.error("Error saving user settings to database: " + str(e))
+        logging.error("Error saving %s to database: %s", column, str(e))
         raise e
     finally:
         cursor.close()
         connection.close()
-    
+    if row is None:
+        logging.error("User is not present in the database")
+        return None
+    return _cache_settings(userId, column, settings if settings is not None else _decode(row[0]))
+
+
+def save_settings(userId, column, settings):
+    """
+    Replace settings of a user with a single statement, and keep them in memory.
+
+    Args:
+        userId (str): The ID of the user.
+        column (str): USER_SETTINGS or DASHBOARD_SETTINGS.
+        settings (dict): The settings.
+
+    Returns:
+        SettingsEntry or None: The saved settings, None if the user is not present in the database.
+
+    Raises:
+        Exception: If there is an error saving the settings to the database.
+    """
+    return _write_settings(userId, column, f"UPDATE Users SET {column} = %s WHERE UserID = %s RETURNING UserID",
+                           (Json(settings), userId), settings)
+
+
+def patch_settings(userId, column, changes):
+    """
+    Update some of the settings of a user with a single statement, and keep them in memory.
+
+    The top-level keys of changes replace those of the stored settings, and the keys set to None are removed
+    (a JSON merge patch on the first level).
+
+    Args:
+        userId (str): The ID of the user.
+        column (str): USER_SETTINGS or DASHBOARD_SETTINGS.
+        changes (dict): The keys to change.
+
+    Returns:
+        SettingsEntry or None: The updated settings, None if the user is not present in the database.
+
+    Raises:
+        Exception: If there is an error saving the settings to the database.
+    """
+    query = (f"UPDATE Users SET {column} = (COALESCE({column}::jsonb, '{{}}'::jsonb) || %s) - %s::text[] "
+             f"WHERE UserID = %s RETURNING {column}")
+    values = (Json({key: value for key, value in changes.items() if value is not None}),
+              [key for key, value in changes.items() if value is None], userId)
+    return _write_settings(userId, column, query, values)
+
+
+def settings_response(entry, if_none_match=None):
+    """
+    Build the response of a settings endpoint.
+
+    Args:
+        entry (SettingsEntry): The settings to send.
+        if_none_match (str, optional): The If-None-Match header of the request.
+
+    Returns:
+        Response: 304 without body if the client already has these settings, 200 with the settings otherwise.
+                  Clients are asked to revalidate every time (no-cache), so changes are seen immediately.
+    """
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def persist_user_settings(userId, settings):
+    """
+    Persist user settings to the database.
+
+    Args:
+        userId (int): The ID of the user whose settings are to be persisted.
+        settings (dict): A dictionary containing the user settings to be saved.
+
+    Returns:
+        bool: False if the user is not present in the database.
+
+    Raises:
+        Exception: If there is an error while saving the user settings to the database.
+    """
+    logging.info("Saving user settings to database")
+    return save_settings(userId, USER_SETTINGS, settings) is not None
+
 def retrieve_user_settings(userId):
     """
     Retrieve user settings from the database.
@@ -50,26 +217,8 @@ def retrieve_user_settings(userId):
     Returns:
         dict: A dictionary containing the user settings.
     """
-    query = "SELECT UserSettings FROM Users WHERE UserID = %s"
-    values = (userId,)
+    return get_settings_entry(userId, USER_SETTINGS).value
 
-    logging.info("Retrieving user settings from database")
-    try:
-        connection, cursor = get_db_connection()
-        cursor.execute(query, values)
-        settings = cursor.fetchone()
-
-        if settings and settings[0] is not None:
-            return json.loads(settings[0])
-        else:
-            return {}
-    except Exception as e:
-        logging.error("Error retrieving user settings from database: " + str(e))
-        raise e
-    finally:
-        cursor.close()
-        connection.close()
-    
 def verify_user_presence(userId):
     """
     Verifies if a user is present in the database.
@@ -86,8 +235,10 @@ def verify_user_presence(userId):
     query = "SELECT COUNT(*) FROM Users WHERE UserID = %s"
     values = (userId,)
 
+    connection, cursor = get_db_connection()
+    if connection is None:
+        raise Exception("Database connection failed")
     try:
-        connection, cursor = get_db_connection()
         cursor.execute(query, values)
         result = cursor.fetchone()[0]
         connection.commit()
@@ -109,62 +260,21 @@ def load_dashboard_settings(userId):
     Returns:
         dict: A dictionary containing the user dashboard settings.
     """
-    query = "SELECT UserDashboards FROM Users WHERE UserID = %s"
-    values = (userId,)
-
-    logging.info("Retrieving user dashboard settings from database")
-    try:
-        connection, cursor = get_db_connection()
-        cursor.execute(query, values)
-        settings = cursor.fetchone()
-
-        if settings and settings[0] is not None:
-            return json.loads(settings[0])
-        else:
-            return {}
-    except Exception as e:
-        logging.error("Error retrieving user dashboard settings from database: " + str(e))
-        raise e
-    finally:
-        cursor.close()
-        connection.close()
+    return get_settings_entry(userId, DASHBOARD_SETTINGS).value
 
 def persist_dashboard_settings(userId, settings):
     """
     Persist user dashboard settings to the database.
 
-    This function retrieves the past dashboard settings for a given user. If past settings exist,
-    it updates the settings in the database. If no past settings exist, it inserts new settings
-    into the database.
-
     Args:
         userId (int): The ID of the user whose dashboard settings are to be persisted.
         settings (dict): A dictionary containing the user dashboard settings to be saved.
 
+    Returns:
+        bool: False if the user is not present in the database.
+
     Raises:
         Exception: If there is an error while saving the user dashboard settings to the database.
     """
-    logging.info("Checking if user is present in the database")
-    if verify_user_presence(userId) == False:
-        logging.error("User is not present in the database")
-        return False
-
-    logging.info("User is present in the database")    
-    query = "UPDATE Users SET UserDashboards = %s WHERE UserID = %s"
-    values = (json.dumps(settings), userId)
     logging.info("Saving user dashboard settings to database")
-    
-    try:
-        connection, cursor = get_db_connection()
-        cursor.execute(query, values)
-        connection.commit()
-        logging.info("User dashboard settings saved successfully")
-        return True
-    
-    except Exception as e:
-        logging.error("Error saving user dashboard settings to database: " + str(e))
-        raise e
-    
-    finally:
-        cursor.close()
-        connection.close()
\ No newline at end of file
+    return save_settings(userId, DASHBOARD_SETTINGS, settings) is not None
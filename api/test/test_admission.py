@@ -0,0 +1,186 @@
+import unittest
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import httpx
+from fastapi import FastAPI
+
+from admission import BATCH, INTERACTIVE, AdmissionController, AdmissionMiddleware, Rejected, RouteClass, \
+    route_class_of
+
+
+def create_controller(**limits):
+    return AdmissionController([RouteClass("agent", **limits), RouteClass("default")], enabled=True)
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_route_class_of(self):
+        # Assertions
+        self.assertEqual(route_class_of("/smartfactory/agent/1"), "agent")
+        self.assertEqual(route_class_of("/smartfactory/historical"), "compute")
+        self.assertEqual(route_class_of("/smartfactory/reports/generate"), "report")
+        self.assertEqual(route_class_of("/smartfactory/alerts/1"), "default")
+
+    def test_rate_limited_per_principal(self):
+        controller = create_controller(rate=0.001, burst=2)
+
+        async def scenario():
+            for _ in range(2):
+                controller.release(await controller.acquire("gui", "agent"))
+            with self.assertRaises(Rejected) as rejected:
+                await controller.acquire("gui", "agent")
+            controller.release(await controller.acquire("data", "agent"))
+            return rejected.exception
+
+        rejected = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(rejected.status_code, 429)
+        self.assertGreater(rejected.retry_after, 1)
+        self.assertEqual(controller.stats()["requests"][("gui", "agent", "rate_limited")], 1)
+        self.assertEqual(controller.stats()["requests"][("data", "agent", "admitted")], 1)
+
+    def test_rate_limited_per_rate_key(self):
+        controller = create_controller(rate=0.001, burst=1)
+
+        async def scenario():
+            controller.release(await controller.acquire("gui", "agent", rate_key="gui:user:1"))
+            controller.release(await controller.acquire("gui", "agent", rate_key="gui:user:2"))
+            with self.assertRaises(Rejected):
+                await controller.acquire("gui", "agent", rate_key="gui:user:1")
+
+        asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(controller.stats()["requests"][("gui", "agent", "admitted")], 2)
+        self.assertEqual(controller.stats()["requests"][("gui", "agent", "rate_limited")], 1)
+
+    def test_full_buckets_dropped(self):
+        controller = AdmissionController([RouteClass("default", rate=1000, burst=1)], enabled=True, max_buckets=2)
+
+        async def scenario():
+            for user in range(3):
+                controller.release(await controller.acquire("gui", "default", rate_key=f"gui:user:{user}"))
+            await asyncio.sleep(0.01)
+            controller.release(await controller.acquire("gui", "default", rate_key="gui:user:3"))
+
+        asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(set(controller._buckets), {("gui:user:3", "default")})
+
+    def test_interactive_before_batch(self):
+        controller = create_controller(concurrency=1, queue_size=10)
+        order = []
+
+        async def request(name, priority):
+            async with controller.admit("gui", "agent", priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            first = asyncio.ensure_future(request("first", INTERACTIVE))
+            await asyncio.sleep(0)
+            batch = asyncio.ensure_future(request("batch", BATCH))
+            await asyncio.sleep(0)
+            interactive = asyncio.ensure_future(request("interactive", INTERACTIVE))
+            await asyncio.sleep(0)
+            depth = controller.stats()["queued"]["agent"]
+            await asyncio.gather(first, batch, interactive)
+            return depth
+
+        depth = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(depth, 2)
+        self.assertEqual(order, ["first", "interactive", "batch"])
+        self.assertEqual(controller.stats()["in_flight"]["agent"], 0)
+
+    def test_batch_shed_for_interactive(self):
+        controller = create_controller(concurrency=1, queue_size=1)
+
+        async def scenario():
+            slot = await controller.acquire("gui", "agent")
+            batch = asyncio.ensure_future(controller.acquire("scheduler", "agent", BATCH))
+            await asyncio.sleep(0)
+            interactive = asyncio.ensure_future(controller.acquire("gui", "agent", INTERACTIVE))
+            await asyncio.sleep(0)
+            with self.assertRaises(Rejected) as shed:
+                await controller.acquire("gui", "agent", INTERACTIVE)
+            controller.release(slot)
+            controller.release(await interactive)
+            with self.assertRaises(Rejected) as evicted:
+                await batch
+            return shed.exception, evicted.exception
+
+        shed, evicted = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual((shed.status_code, shed.reason), (503, "shed"))
+        self.assertEqual((evicted.status_code, evicted.reason), (503, "shed"))
+        self.assertEqual(controller.stats()["in_flight"]["agent"], 0)
+
+    def test_queue_timeout(self):
+        controller = create_controller(concurrency=1, queue_size=1, queue_timeout=0.01)
+
+        async def scenario():
+            slot = await controller.acquire("gui", "agent")
+            with self.assertRaises(Rejected) as timeout:
+                await controller.acquire("gui", "agent")
+            controller.release(slot)
+            return timeout.exception
+
+        timeout = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(timeout.reason, "timeout")
+        self.assertEqual(controller.stats()["queued"]["agent"], 0)
+        self.assertEqual(controller.stats()["in_flight"]["agent"], 0)
+
+    def test_middleware_rejection(self):
+        app = FastAPI()
+        controller = AdmissionController([RouteClass("default", rate=0.001, burst=1)], enabled=True)
+        app.add_middleware(AdmissionMiddleware, controller=controller, principal=lambda api_key: api_key or "none")
+
+        @app.get("/items")
+        async def items():
+            return {"items": []}
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return [await client.get("/items", headers={"X-API-Key": "gui"}) for _ in range(2)]
+
+        admitted, rejected = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(admitted.status_code, 200)
+        self.assertEqual(rejected.status_code, 429)
+        self.assertIn("retry-after", rejected.headers)
+        self.assertIn("detail", rejected.json())
+
+    def test_middleware_rate_key(self):
+        app = FastAPI()
+        controller = AdmissionController([RouteClass("default", rate=0.001, burst=1)], enabled=True)
+        app.add_middleware(AdmissionMiddleware, controller=controller, principal=lambda api_key: "gui",
+                           rate_key=lambda scope, api_key: scope["path"])
+
+        @app.get("/items/{item}")
+        async def items(item: int):
+            return {"item": item}
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return [await client.get(path) for path in ("/items/1", "/items/2", "/items/1")]
+
+        first, second, repeated = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual((first.status_code, second.status_code, repeated.status_code), (200, 200, 429))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import MagicMock
+import asyncio
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from alert_hub import AlertHub, ALERT_CHANNEL
+
+
+class TestAlertHub(unittest.TestCase):
+
+    def test_publish_to_recipients(self):
+        async def scenario():
+            hub = AlertHub(notify=False)
+            hub.start()
+            first, second, other = hub.subscribe(1), hub.subscribe(1), hub.subscribe(2)
+
+            # published from a worker thread, as after the commit of send_notification
+            thread = threading.Thread(target=hub.publish, args=({"alertId": 7}, [1, 3]))
+            thread.start()
+            thread.join()
+            alerts = await asyncio.wait_for(asyncio.gather(first.get(), second.get()), timeout=1)
+
+            hub.unsubscribe(1, first)
+            return hub, alerts, other
+
+        hub, alerts, other = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(alerts, [{"alertId": 7}, {"alertId": 7}])
+        self.assertTrue(other.empty())
+        self.assertEqual(hub.connected_users(), [1, 2])
+        self.assertEqual(hub.stats()["delivered"], 2)
+
+    def test_slow_client_drops(self):
+        async def scenario():
+            hub = AlertHub(notify=False, queue_size=1)
+            hub.start()
+            queue = hub.subscribe(1)
+            hub.publish({"alertId": 1}, [1])
+            hub.publish({"alertId": 2}, [1])
+            return hub, queue
+
+        hub, queue = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(queue.get_nowait(), {"alertId": 1})
+        self.assertEqual(hub.stats()["dropped"], 1)
+
+    def test_notify_in_transaction(self):
+        cursor = MagicMock()
+
+        AlertHub(notify=False).notify_in_transaction(cursor, 7)
+        AlertHub(notify=True).notify_in_transaction(cursor, 8)
+
+        # Assertions
+        cursor.execute.assert_called_once_with("SELECT pg_notify(%s, %s)", (ALERT_CHANNEL, "8"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from fastapi import HTTPException
+from api_auth import api_auth
+from api_auth.api_auth import ApiKeyCache, get_verify_api_key
+
+
+def mock_db(keys):
+    mock_connection = MagicMock()
+    mock_cursor = MagicMock()
+    mock_cursor.fetchall.return_value = list(keys.items())
+    return mock_connection, mock_cursor
+
+
+class TestApiKeyCache(unittest.TestCase):
+
+    @patch('api_auth.api_auth.connect_db')
+    def test_keys_loaded_once_within_ttl(self, mock_connect_db):
+        mock_connect_db.return_value = mock_db({'gui': 'gui-key', 'ai-agent': 'agent-key'})
+        cache = ApiKeyCache(ttl=300)
+
+        self.assertEqual(cache.get('gui'), 'gui-key')
+        self.assertEqual(cache.get('ai-agent'), 'agent-key')
+        self.assertIsNone(cache.get('unknown'))
+
+        # Assertions
+        mock_connect_db.assert_called_once()
+
+    @patch('api_auth.api_auth.connect_db')
+    def test_keys_reloaded_after_invalidate(self, mock_connect_db):
+        mock_connect_db.return_value = mock_db({'gui': 'old-key'})
+        cache = ApiKeyCache(ttl=300)
+        self.assertEqual(cache.get('gui'), 'old-key')
+
+        mock_connect_db.return_value = mock_db({'gui': 'new-key'})
+        cache.invalidate()
+
+        # Assertions
+        self.assertEqual(cache.get('gui'), 'new-key')
+        self.assertEqual(mock_connect_db.call_count, 2)
+
+    @patch('api_auth.api_auth.connect_db')
+    def test_keys_kept_when_reload_fails(self, mock_connect_db):
+        mock_connect_db.return_value = mock_db({'gui': 'gui-key'})
+        cache = ApiKeyCache(ttl=0)
+        self.assertEqual(cache.get('gui'), 'gui-key')
+
+        mock_connect_db.return_value = (None, None)
+
+        # Assertions
+        self.assertEqual(cache.get('gui'), 'gui-key')
+        self.assertTrue(cache.loaded)
+
+    @patch('api_auth.api_auth.connect_db', return_value=(None, None))
+    def test_database_unreachable(self, mock_connect_db):
+        cache = ApiKeyCache(ttl=300)
+
+        # Assertions
+        self.assertIsNone(cache.get('gui'))
+        self.assertFalse(cache.loaded)
+
+
+class TestVerifyApiKey(unittest.TestCase):
+
+    def setUp(self):
+        api_auth.api_key_cache = ApiKeyCache(ttl=300)
+
+    @patch('api_auth.api_auth.connect_db')
+    def test_valid_key(self, mock_connect_db):
+        mock_connect_db.return_value = mock_db({'gui': 'gui-key', 'ai-agent': 'agent-key'})
+        verify_api_key = get_verify_api_key(['gui', 'ai-agent'])
+
+        # Assertions
+        self.assertIsNone(asyncio.run(verify_api_key('agent-key')))
+        self.assertIsNone(asyncio.run(verify_api_key('gui-key')))
+        mock_connect_db.assert_called_once()
+
+    @patch('api_auth.api_auth.connect_db')
+    def test_invalid_key(self, mock_connect_db):
+        mock_connect_db.return_value = mock_db({'gui': 'gui-key', 'ai-agent': 'agent-key'})
+        verify_api_key = get_verify_api_key(['gui'])
+
+        # Assertions
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(verify_api_key('agent-key'))
+        self.assertEqual(context.exception.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from catalog_cache import CatalogCache, etag_matches
+
+
+class TestCatalogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CatalogCache(ttl=300)
+
+    def test_put_and_get(self):
+        entry = self.cache.put("retrieveKPIs", {"kpis": ["energy_consumed"]}, "1-0")
+
+        # Assertions
+        self.assertIs(self.cache.get("retrieveKPIs"), entry)
+        self.assertIsNone(self.cache.get("retrieveMachines"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_etag_depends_on_content(self):
+        first = self.cache.put("retrieveKPIs", {"kpis": ["energy_consumed"]})
+        same = self.cache.put("retrieveKPIs", {"kpis": ["energy_consumed"]})
+        changed = self.cache.put("retrieveKPIs", {"kpis": ["energy_consumed", "cycles"]})
+
+        # Assertions
+        self.assertEqual(first.etag, same.etag)
+        self.assertNotEqual(first.etag, changed.etag)
+
+    def test_expired_entry_revalidated_by_version(self):
+        self.cache.put("retrieveKPIs", {"kpis": []}, "1-0")
+
+        with patch('catalog_cache.time.monotonic', return_value=10 ** 9):
+            # Assertions
+            self.assertIsNone(self.cache.get("retrieveKPIs"))
+            self.assertIsNone(self.cache.revalidate("retrieveKPIs", "1-1"))
+            self.assertIsNone(self.cache.revalidate("retrieveKPIs", None))
+            self.assertIsNotNone(self.cache.revalidate("retrieveKPIs", "1-0"))
+            self.assertIsNotNone(self.cache.get("retrieveKPIs"))
+
+    def test_invalidate(self):
+        self.cache.put("retrieveKPIs", {"kpis": []})
+        self.cache.put("retrieveMachines", {"machines": []})
+        self.cache.invalidate("retrieveKPIs")
+
+        # Assertions
+        self.assertIsNone(self.cache.get("retrieveKPIs"))
+        self.assertIsNotNone(self.cache.get("retrieveMachines"))
+
+    def test_response_not_modified(self):
+        entry = self.cache.put("retrieveKPIs", {"kpis": []})
+
+        modified = self.cache.response(entry, '"outdated"')
+        not_modified = self.cache.response(entry, entry.etag)
+
+        # Assertions
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(modified.body, b'{"kpis":[]}')
+        self.assertEqual(modified.headers["etag"], entry.etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.body, b'')
+        self.assertEqual(self.cache.stats()["not_modified"], 1)
+
+    def test_etag_matches(self):
+        # Assertions
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('W/"a"', '"a"'))
+        self.assertTrue(etag_matches('"b", "a"', '"a"'))
+        self.assertTrue(etag_matches('*', '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+
+
+if __name__ == '__main__':
+    unittest.main()
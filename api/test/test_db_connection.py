@@ -1,3 +1,4 @@
+import gc
 import unittest
 from unittest.mock import patch, MagicMock
 import os
@@ -5,10 +6,14 @@ import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/database')))
 
-from connection import get_db_connection, query_db, query_db_with_params, close_connection
+from connection import get_db_connection, query_db, query_db_with_params, close_connection, transaction, pool_stats, reset_pool
 
 class TestDatabaseUtils(unittest.TestCase):
 
+    def setUp(self):
+        # every test starts without pooled connections
+        reset_pool()
+
     @patch('psycopg2.connect')
     def test_get_db_connection_success(self, mock_connect):
         # Mock connection and cursor objects
@@ -109,6 +114,85 @@ class TestDatabaseUtils(unittest.TestCase):
         mock_cursor.close.assert_called_once()
         mock_connection.close.assert_called_once()
 
+    @patch('psycopg2.connect')
+    def test_connection_reused_from_pool(self, mock_connect):
+        mock_connection = MagicMock()
+        mock_connection.closed = 0
+        mock_connect.return_value = mock_connection
+
+        # Open and give back the connection twice
+        for _ in range(2):
+            connection, cursor = get_db_connection()
+            close_connection(connection, cursor)
+
+        # Assertions
+        mock_connect.assert_called_once()
+        mock_connection.close.assert_not_called()
+        stats = pool_stats()
+        self.assertEqual(stats['acquired'], 2)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 1)
+
+    @patch('connection.POOL_TIMEOUT', 0.01)
+    @patch('psycopg2.connect')
+    def test_pool_exhausted(self, mock_connect):
+        mock_connect.side_effect = lambda *args, **kwargs: MagicMock(closed=0)
+
+        # Take every connection of the pool
+        connections = [get_db_connection() for _ in range(pool_stats()['max_connections'])]
+        connection, cursor = get_db_connection()
+
+        # Assertions
+        self.assertIsNone(connection)
+        self.assertIsNone(cursor)
+        self.assertEqual(pool_stats()['timeouts'], 1)
+        for connection, cursor in connections:
+            close_connection(connection, cursor)
+        self.assertEqual(pool_stats()['in_use'], 0)
+
+    @patch('psycopg2.connect')
+    def test_dropped_connection_released(self, mock_connect):
+        mock_connect.side_effect = lambda *args, **kwargs: MagicMock(closed=0)
+
+        # Requests returning without closing their connection
+        for _ in range(pool_stats()['max_connections'] + 1):
+            connection, cursor = get_db_connection()
+        del connection, cursor
+        gc.collect()
+
+        # Assertions
+        self.assertEqual(pool_stats()['timeouts'], 0)
+        self.assertEqual(pool_stats()['in_use'], 0)
+
+    @patch('psycopg2.connect')
+    def test_transaction_rollback(self, mock_connect):
+        mock_connection = MagicMock()
+        mock_connection.closed = 0
+        mock_connect.return_value = mock_connection
+
+        # An error inside the block rolls the transaction back
+        with self.assertRaises(ValueError):
+            with transaction() as cursor:
+                cursor.execute("INSERT INTO users VALUES (1);")
+                raise ValueError("failure")
+
+        # Assertions
+        mock_connection.rollback.assert_called()
+        mock_connection.commit.assert_not_called()
+        self.assertEqual(pool_stats()['in_use'], 0)
+
+    @patch('psycopg2.connect')
+    def test_transaction_commit(self, mock_connect):
+        mock_connection = MagicMock()
+        mock_connection.closed = 0
+        mock_connect.return_value = mock_connection
+
+        with transaction() as cursor:
+            cursor.execute("INSERT INTO users VALUES (1);")
+
+        # Assertions
+        mock_connection.commit.assert_called_once()
+
 # Run the tests
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import math
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from downsampling import lttb
+
+
+class TestLttb(unittest.TestCase):
+
+    def test_short_series_unchanged(self):
+        # Assertions
+        self.assertEqual(lttb([0, 1, 2], [5, 6, 7], 10), [0, 1, 2])
+
+    def test_threshold_respected(self):
+        xs = list(range(1000))
+        ys = [math.sin(x / 20) for x in xs]
+
+        selected = lttb(xs, ys, 100)
+
+        # Assertions
+        self.assertEqual(len(selected), 100)
+        self.assertEqual(selected[0], 0)
+        self.assertEqual(selected[-1], 999)
+        self.assertEqual(selected, sorted(set(selected)))
+
+    def test_peak_kept(self):
+        xs = list(range(500))
+        ys = [0.0] * 500
+        ys[321] = 100.0
+
+        # Assertions
+        self.assertIn(321, lttb(xs, ys, 20))
+
+    def test_tiny_threshold(self):
+        # Assertions
+        self.assertEqual(lttb(list(range(10)), [0] * 10, 2), [0, 9])
+        self.assertEqual(lttb(list(range(10)), [0] * 10, 1), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from historical_query import build_historical_query, downsample_rows, parse_kpi_id, resolve_group_time
+from model.historical import HistoricalQueryParams
+
+TIMEFRAME = {"start_date": "2024-03-01", "end_date": "2024-04-01"}
+
+
+class TestParseKpiId(unittest.TestCase):
+
+    def test_valid_kpi_id(self):
+        # Assertions
+        self.assertEqual(parse_kpi_id("energy_consumed_sum"), ("energy_consumed", "sum"))
+
+    def test_invalid_kpi_id(self):
+        # Assertions
+        for kpi_id in ("energy_consumed", "sum", "energy_consumed_median"):
+            with self.assertRaises(ValueError):
+                parse_kpi_id(kpi_id)
+
+
+class TestBuildHistoricalQuery(unittest.TestCase):
+
+    def test_values_are_parameters(self):
+        params = HistoricalQueryParams(kpi="energy_consumed_sum", timeframe=TIMEFRAME,
+                                       machines=["Large Capacity Cutting Machine 1"], group_time="P1D")
+
+        body = build_historical_query(params)
+
+        # Assertions
+        self.assertNotIn("energy_consumed'", body["query"])
+        self.assertNotIn("Cutting", body["query"])
+        self.assertNotIn("2024", body["query"])
+        self.assertIn("name IN (?)", body["query"])
+        self.assertIn("GROUP BY name, TIME_FLOOR(__time, 'P1D')", body["query"])
+        self.assertEqual([p["value"] for p in body["parameters"]],
+                         ["energy_consumed", "2024-03-01", "2024-04-01", "Large Capacity Cutting Machine 1"])
+
+    def test_multiple_kpis_and_aggregate(self):
+        params = HistoricalQueryParams(kpis=["energy_consumed_sum", "cycles_max", "energy_consumed_avg"],
+                                       timeframe=TIMEFRAME, machines=["m1", "m2"], aggregate="max")
+
+        body = build_historical_query(params)
+
+        # Assertions
+        self.assertIn('MAX(CASE WHEN kpi = ? THEN "sum" END) AS "energy_consumed_sum"', body["query"])
+        self.assertIn('MAX(CASE WHEN kpi = ? THEN "max" END) AS "cycles_max"', body["query"])
+        self.assertIn('MAX(CASE WHEN kpi = ? THEN "avg" END) AS "energy_consumed_avg"', body["query"])
+        self.assertIn("kpi IN (?, ?)", body["query"])
+        self.assertIn("name IN (?, ?)", body["query"])
+        self.assertEqual(body["query"].count("?"), len(body["parameters"]))
+
+    def test_invalid_parameters(self):
+        invalid = [
+            dict(kpi="energy_consumed_sum", timeframe=TIMEFRAME, machines=["m1"], group_time="P2D"),
+            dict(kpi="energy_consumed_sum", timeframe=TIMEFRAME, machines=["m1"], aggregate="median"),
+            dict(kpi="energy_consumed_sum", timeframe={"start_date": "2024-03-01"}, machines=["m1"]),
+            dict(timeframe=TIMEFRAME, machines=["m1"]),
+            dict(kpi="energy_consumed_sum", timeframe=TIMEFRAME, machines=[]),
+        ]
+
+        # Assertions
+        for fields in invalid:
+            with self.assertRaises(ValueError):
+                build_historical_query(HistoricalQueryParams(**fields))
+
+
+class TestDownsampling(unittest.TestCase):
+
+    def test_group_time_chosen_by_max_points(self):
+        def group_time(timeframe, max_points, group_time=None):
+            return resolve_group_time(HistoricalQueryParams(kpi="energy_consumed_sum", timeframe=timeframe,
+                                                            machines=["m1"], group_time=group_time,
+                                                            max_points=max_points))
+
+        one_day = {"start_date": "2024-03-01", "end_date": "2024-03-02"}
+        three_years = {"start_date": "2021-01-01", "end_date": "2024-01-01"}
+
+        # Assertions
+        self.assertEqual(group_time(one_day, 100), "PT1H")
+        self.assertEqual(group_time(TIMEFRAME, 100), "P1D")
+        self.assertEqual(group_time(three_years, 200), "P1W")
+        self.assertEqual(group_time(three_years, 50), "P1M")
+        self.assertEqual(group_time(three_years, 2), "P1Y")
+        self.assertEqual(group_time(TIMEFRAME, 100, "P1W"), "P1W")
+        self.assertEqual(group_time(TIMEFRAME, None, "P1H"), "PT1H")
+
+    def test_rows_capped_per_machine(self):
+        rows = [{"name": machine, "timestamp": f"2024-01-01T{hour:02d}:00:00", "energy_consumed_sum": hour % 5}
+                for machine in ("m1", "m2") for hour in range(24)]
+        rows.append({"name": "m3", "timestamp": "2024-01-01T00:00:00", "energy_consumed_sum": 1})
+
+        result = downsample_rows(rows, ["energy_consumed_sum"], 10)
+
+        # Assertions
+        for machine, expected in (("m1", 10), ("m2", 10), ("m3", 1)):
+            machine_rows = [row for row in result if row["name"] == machine]
+            self.assertEqual(len(machine_rows), expected)
+            self.assertEqual(machine_rows, sorted(machine_rows, key=lambda row: row["timestamp"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
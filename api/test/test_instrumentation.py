@@ -0,0 +1,83 @@
+import unittest
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import httpx
+from fastapi import FastAPI
+
+import instrumentation
+from instrumentation import Registry, CallbackMetric, instrument, timed_upstream, trace_headers
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_histogram_render(self):
+        registry = Registry()
+        histogram = registry.histogram("duration_seconds", "Duration.", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, "/a")
+        histogram.observe(0.5, "/a")
+        histogram.observe(5, "/a")
+
+        lines = registry.render().splitlines()
+
+        # Assertions
+        self.assertIn("# TYPE duration_seconds histogram", lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="1.0"} 2', lines)
+        self.assertIn('duration_seconds_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('duration_seconds_count{route="/a"} 3', lines)
+
+    def test_failing_callback_left_out(self):
+        registry = Registry()
+        registry.register(CallbackMetric("pool_connections", "Connections.", lambda: {"idle": 2}, ("state",)))
+        registry.register(CallbackMetric("broken", "Broken.", lambda: 1 / 0))
+
+        text = registry.render()
+
+        # Assertions
+        self.assertIn('pool_connections{state="idle"} 2', text)
+        self.assertNotIn("broken", text)
+
+    def test_timed_upstream_error(self):
+        before = instrumentation.UPSTREAM_ERRORS.value("minio")
+
+        with self.assertRaises(ValueError):
+            with timed_upstream("minio"):
+                raise ValueError("unreachable")
+
+        # Assertions
+        self.assertEqual(instrumentation.UPSTREAM_ERRORS.value("minio"), before + 1)
+        self.assertGreaterEqual(instrumentation.UPSTREAM_DURATION.count("minio"), 1)
+
+    def test_requests_by_route_and_trace(self):
+        app = FastAPI()
+
+        @app.get("/items/{item_id}")
+        async def get_item(item_id: int):
+            return trace_headers({"x-api-key": "key"})
+
+        instrument(app)
+
+        async def scenario():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                traced = await client.get("/items/1", headers={"X-Trace-Id": "trace-1"})
+                generated = await client.get("/items/2")
+                metrics = await client.get("/metrics")
+            return traced, generated, metrics
+
+        traced, generated, metrics = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(traced.json(), {"x-api-key": "key", "X-Trace-Id": "trace-1"})
+        self.assertEqual(traced.headers["x-trace-id"], "trace-1")
+        self.assertEqual(generated.headers["x-trace-id"], generated.json()["X-Trace-Id"])
+        self.assertTrue(metrics.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('http_requests_total{method="GET",route="/items/{item_id}",status="200"}', metrics.text)
+        self.assertEqual(trace_headers(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import smtplib
+import sys
+import os
+from email.message import EmailMessage
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from mail_outbox import MailOutbox
+
+
+def message(to_email):
+    msg = EmailMessage()
+    msg['To'] = to_email
+    return msg
+
+
+@patch.dict(os.environ, {'SMTP_SERVER': 'smtp.example.com', 'SMTP_PORT': '587',
+                         'SMTP_EMAIL': 'test@example.com', 'SMTP_PASSWORD': 'password'})
+class TestMailOutbox(unittest.TestCase):
+
+    @patch('mail_outbox.smtplib.SMTP')
+    def test_connection_reused(self, mock_smtp):
+        mock_server = MagicMock()
+        mock_smtp.return_value = mock_server
+        outbox = MailOutbox(idle_timeout=5)
+
+        outbox.enqueue(message('a@example.com'))
+        outbox.enqueue(message('b@example.com'))
+        outbox.close()
+
+        # Assertions
+        mock_smtp.assert_called_once_with('smtp.example.com', 587)
+        mock_server.login.assert_called_once_with('test@example.com', 'password')
+        self.assertEqual(mock_server.send_message.call_count, 2)
+        mock_server.quit.assert_called_once()
+        self.assertEqual(outbox.stats()['sent'], 2)
+
+    @patch('mail_outbox.smtplib.SMTP')
+    def test_reconnect_when_disconnected(self, mock_smtp):
+        stale, fresh = MagicMock(), MagicMock()
+        stale.send_message.side_effect = smtplib.SMTPServerDisconnected()
+        mock_smtp.side_effect = [stale, fresh]
+        outbox = MailOutbox(idle_timeout=5)
+
+        outbox.enqueue(message('a@example.com'))
+        outbox.close()
+
+        # Assertions
+        self.assertEqual(mock_smtp.call_count, 2)
+        fresh.send_message.assert_called_once()
+        self.assertEqual(outbox.stats()['sent'], 1)
+        self.assertEqual(outbox.stats()['connections'], 2)
+
+    @patch('mail_outbox.smtplib.SMTP')
+    def test_failed_email(self, mock_smtp):
+        mock_smtp.side_effect = smtplib.SMTPAuthenticationError(535, b'Invalid credentials')
+        outbox = MailOutbox(idle_timeout=5)
+
+        outbox.enqueue(message('a@example.com'))
+        outbox.close()
+
+        # Assertions
+        self.assertEqual(outbox.stats()['failed'], 1)
+        self.assertEqual(outbox.stats()['sent'], 0)
+
+
+class TestSendNotification(unittest.TestCase):
+
+    @patch('notification_service.mail_outbox')
+    @patch('notification_service.execute_values')
+    @patch('notification_service.get_db_connection')
+    def test_send_notification(self, mock_get_db_connection, mock_execute_values, mock_outbox):
+        from notification_service import send_notification
+
+        mock_connection = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchall.return_value = [(1, 'a@example.com'), (2, 'b@example.com'), (3, 'a@example.com')]
+        mock_cursor.fetchone.return_value = [10]
+
+        alert = MagicMock()
+        alert.title = 'Test Alert'
+        alert.isPush = True
+        alert.isEmail = True
+        alert.recipients = ['FACTORY_FLOOR_MANAGER', 'SPECIALTY_MANUFACTURING_OWNER']
+        alert.severity.value = 'High'
+
+        send_notification(alert)
+
+        # Assertions
+        mock_cursor.execute.assert_any_call("SELECT UserID, Email FROM Users WHERE Role = ANY(%s)",
+                                            (['FACTORY_FLOOR_MANAGER', 'SPECIALTY_MANUFACTURING_OWNER'],))
+        self.assertEqual(mock_execute_values.call_args[0][2], [(10, 1), (10, 2), (10, 3)])
+        mock_connection.commit.assert_called_once()
+        self.assertEqual([call[0][0]['To'] for call in mock_outbox.enqueue.call_args_list],
+                         ['a@example.com', 'b@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
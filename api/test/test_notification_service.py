@@ -6,7 +6,10 @@ import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from notification_service import send_email, save_alert, retrieve_alerts
+from notification_service import send_email, save_alert, retrieve_alerts, count_unread_alerts, ALERT_PAGE_MAX, \
+    deduplicate_alerts, parse_triggered_at, save_alerts
+from datetime import datetime
+from model.alert import Alert
 
 class TestSendEmail(unittest.TestCase):
 
@@ -86,63 +89,53 @@ class TestSendEmail(unittest.TestCase):
 
 class TestSaveAlert(unittest.TestCase):
 
+    @patch('notification_service.alert_hub')
+    @patch('notification_service.execute_values')
     @patch('notification_service.get_db_connection')
-    @patch('notification_service.query_db')
-    def test_save_alert_success(self, mock_query_db, mock_get_db_connection):
+    def test_save_alert_success(self, mock_get_db_connection, mock_execute_values, mock_hub):
         # Mock database connection and cursor
         mock_connection = MagicMock()
         mock_cursor = MagicMock()
         mock_get_db_connection.return_value = (mock_connection, mock_cursor)
-
-        # Create a mock alert
-        alert = MagicMock()
-        alert.alertId = '1'
-        alert.title = 'Test Alert'
-        alert.type = 'Error'
-        alert.description = 'This is a test alert'
-        alert.triggeredAt = '2023-10-10 10:00:00'
-        alert.machineName = 'Machine1'
-        alert.isPush = True
-        alert.recipients = ['user1@example.com']
-        alert.severity.value = 'High'
+        mock_cursor.fetchall.return_value = [(1, 'a@example.com'), (2, 'b@example.com')]
+        mock_cursor.fetchone.return_value = (7,)
+        alert = make_alert('missing value', '2024-10-10 10:00:00')
 
         # Call the function
-        save_alert(alert)
+        alert_id = save_alert(alert)
 
         # Assertions
-        mock_query_db.assert_called()
+        self.assertEqual(alert_id, 7)
+        self.assertIn("Role = ANY(%s)", mock_cursor.execute.call_args_list[0][0][0])
+        self.assertEqual(mock_execute_values.call_args[0][2], [(7, 1), (7, 2)])
+        mock_hub.notify_in_transaction.assert_called_once_with(mock_cursor, 7)
+        mock_connection.commit.assert_called_once()
+        self.assertEqual(mock_hub.publish.call_args[0][1], [1, 2])
         mock_cursor.close.assert_called()
         mock_connection.close.assert_called()
 
+    @patch('notification_service.alert_hub')
+    @patch('notification_service.execute_values')
     @patch('notification_service.get_db_connection')
-    @patch('notification_service.query_db')
-    def test_save_alert_failure(self, mock_query_db, mock_get_db_connection):
+    def test_save_alert_failure(self, mock_get_db_connection, mock_execute_values, mock_hub):
         # Mock database connection and cursor
         mock_connection = MagicMock()
         mock_cursor = MagicMock()
         mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchall.return_value = [(1, 'a@example.com')]
+        mock_cursor.fetchone.return_value = (7,)
 
-        # Mock query_db to raise an exception
-        mock_query_db.side_effect = Exception("Database error")
-
-        # Create a mock alert
-        alert = MagicMock()
-        alert.alertId = '1'
-        alert.title = 'Test Alert'
-        alert.type = 'Error'
-        alert.description = 'This is a test alert'
-        alert.triggeredAt = '2023-10-10 10:00:00'
-        alert.machineName = 'Machine1'
-        alert.isPush = True
-        alert.recipients = ['user1@example.com']
-        alert.severity.value = 'High'
+        # Mock the insertion of the recipients to raise an exception
+        mock_execute_values.side_effect = Exception("Database error")
 
         # Call the function and assert exception is raised
         with self.assertRaises(Exception):
-            save_alert(alert)
+            save_alert(make_alert('missing value', '2024-10-10 10:00:00'))
 
         # Assertions
-        mock_query_db.assert_called()
+        mock_connection.rollback.assert_called_once()
+        mock_connection.commit.assert_not_called()
+        mock_hub.publish.assert_not_called()
         mock_cursor.close.assert_called()
         mock_connection.close.assert_called()
 
@@ -189,6 +182,109 @@ class TestRetrieveAlerts(unittest.TestCase):
         # Assertions
         mock_cursor.close.assert_called()
         mock_connection.close.assert_called()
+    @patch('notification_service.get_db_connection')
+    def test_retrieve_alerts_no_connection(self, mock_get_db_connection):
+        mock_get_db_connection.return_value = (None, None)
+
+        # Call the function and assert the connection error is raised
+        with self.assertRaises(Exception) as error:
+            retrieve_alerts('user1@example.com')
+
+        # Assertions
+        self.assertEqual(str(error.exception), "Database connection failed")
+
+    @patch('notification_service.get_db_connection')
+    def test_retrieve_alerts_page(self, mock_get_db_connection):
+        mock_connection = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchall.return_value = [
+            (12, 'Test Alert', 'Error', 'This is a test alert', '2023-10-10 10:00:00', 'Machine1', True, 'High')
+        ]
+
+        alerts = retrieve_alerts('1', False, since_id=11, limit=10000)
+
+        # Assertions
+        query, params = mock_cursor.execute.call_args[0]
+        self.assertIn("ar.Read = FALSE", query)
+        self.assertIn("ar.AlertID > %s", query)
+        self.assertEqual(params, ('1', 11, ALERT_PAGE_MAX, '1'))
+        self.assertEqual(alerts[0]['alertId'], 12)
+        self.assertEqual(alerts[0]['severity'], 'High')
+        mock_connection.commit.assert_called()
+
+class TestCountUnreadAlerts(unittest.TestCase):
+
+    @patch('notification_service.get_db_connection')
+    def test_count_unread_alerts(self, mock_get_db_connection):
+        mock_connection = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = (3,)
+
+        # Assertions
+        self.assertEqual(count_unread_alerts('1'), 3)
+        mock_cursor.close.assert_called()
+        mock_connection.close.assert_called()
+def make_alert(title, triggeredAt, machineName='Machine1', isPush=True, isEmail=False):
+    return Alert(title=title, type='machine_unreachable', description='This is a test alert',
+                 triggeredAt=triggeredAt, machineName=machineName, isPush=isPush, isEmail=isEmail,
+                 recipients=['FactoryFloorManager'], severity='High')
+
+class TestSaveAlerts(unittest.TestCase):
+
+    def test_deduplicate_alerts(self):
+        alerts = [
+            make_alert('missing value', '2024-10-10 10:04:00'),
+            make_alert('missing value', '2024-10-10 10:00:00'),
+            make_alert('missing value', '2024-10-10 10:06:00'),
+            make_alert('missing value', '2024-10-10 10:01:00', machineName='Machine2'),
+            make_alert('Zero streak', '2024-10-10 10:01:00'),
+        ]
+        last_seen = {('Machine2', 'machine_unreachable', 'missing value'): datetime(2024, 10, 10, 9, 58)}
+
+        kept = deduplicate_alerts(alerts, last_seen, 300)
+
+        # Assertions
+        self.assertEqual([(alert.title, alert.machineName, alert.triggeredAt) for alert in kept], [
+            ('missing value', 'Machine1', '2024-10-10 10:00:00'),
+            ('Zero streak', 'Machine1', '2024-10-10 10:01:00'),
+            ('missing value', 'Machine1', '2024-10-10 10:06:00'),
+        ])
+
+    def test_parse_triggered_at(self):
+        # Assertions
+        self.assertEqual(parse_triggered_at('2024-10-10T12:00:00+02:00'), datetime(2024, 10, 10, 10, 0))
+        self.assertEqual(parse_triggered_at('2024-10-10T10:00:00Z'), datetime(2024, 10, 10, 10, 0))
+        self.assertEqual(parse_triggered_at('2024-10-10 10:00:00'), datetime(2024, 10, 10, 10, 0))
+
+    @patch('notification_service.mail_outbox')
+    @patch('notification_service.execute_values')
+    @patch('notification_service.get_db_connection')
+    def test_save_alerts(self, mock_get_db_connection, mock_execute_values, mock_outbox):
+        mock_connection = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchall.side_effect = [
+            [(1, 'a@example.com', 'FactoryFloorManager'), (2, 'b@example.com', 'FactoryFloorManager')],
+            [],
+        ]
+        mock_execute_values.side_effect = [[(10,), (11,)], None]
+        alerts = [
+            make_alert('missing value', '2024-10-10 10:00:00'),
+            make_alert('missing value', '2024-10-10 10:01:00'),
+            make_alert('Zero streak', '2024-10-10 10:01:00', isPush=False, isEmail=True),
+        ]
+
+        result = save_alerts(alerts)
+
+        # Assertions
+        self.assertEqual(result, {"received": 3, "duplicates": 1, "alertIds": [10, 11]})
+        self.assertEqual(mock_execute_values.call_count, 2)
+        self.assertEqual(mock_execute_values.call_args_list[1][0][2], [(10, 1), (10, 2)])
+        mock_connection.commit.assert_called_once()
+        self.assertEqual([call[0][0]['To'] for call in mock_outbox.enqueue.call_args_list],
+                         ['a@example.com', 'b@example.com'])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import asyncio
+import json
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from report_jobs import ReportJobQueue, get_job, render_pdf, update_job
+
+
+class TestRenderPdf(unittest.TestCase):
+
+    def test_render_in_memory(self):
+        appendix = json.dumps([{"reference_number": 1, "context": "Energy\n\nconsumption", "source_name": "KB"}])
+
+        pdf = render_pdf("Report\n\nfor the week", appendix)
+
+        # Assertions
+        self.assertIsInstance(pdf, bytes)
+        self.assertTrue(pdf.startswith(b"%PDF"))
+
+    def test_render_error_logged(self):
+        with self.assertLogs(level="ERROR") as logs:
+            pdf = render_pdf("Report", "not a JSON appendix")
+
+        # Assertions
+        self.assertTrue(pdf.startswith(b"%PDF"))
+        self.assertIn("Report PDF not rendered completely", logs.output[0])
+
+
+class TestReportJobQueue(unittest.TestCase):
+
+    @patch('report_jobs.get_job')
+    @patch('report_jobs.update_job')
+    @patch('report_jobs.create_job', return_value=3)
+    def test_job_completed(self, mock_create_job, mock_update_job, mock_get_job):
+        mock_get_job.return_value = {"jobId": 3, "status": "done", "reportId": 12}
+        queue = ReportJobQueue()
+
+        async def work():
+            await asyncio.sleep(0)
+            return 12
+
+        async def scenario():
+            job_id = await queue.submit(1, work)
+            return job_id, await queue.status(job_id, wait=5)
+
+        job_id, job = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(job_id, 3)
+        self.assertEqual(job["reportId"], 12)
+        mock_create_job.assert_called_once_with(1)
+        self.assertEqual([c.args for c in mock_update_job.call_args_list], [(3, "running"), (3, "done", 12)])
+
+    @patch('report_jobs.update_job')
+    @patch('report_jobs.create_job', return_value=4)
+    def test_job_failed(self, mock_create_job, mock_update_job):
+        queue = ReportJobQueue()
+
+        async def work():
+            raise Exception("agent unavailable")
+
+        async def scenario():
+            await queue.submit(1, work)
+            await asyncio.gather(*queue._tasks)
+
+        asyncio.run(scenario())
+
+        # Assertions
+        mock_update_job.assert_called_with(4, "failed", None, "agent unavailable")
+
+    @patch('report_jobs.transaction')
+    def test_interrupted_job_reported_failed(self, mock_transaction):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (5, 1, "running", None, None, True)
+        mock_transaction.return_value.__enter__.return_value = cursor
+
+        # Assertions
+        self.assertEqual(get_job(5)["status"], "failed")
+
+    @patch('report_jobs.transaction')
+    def test_completed_only_if_running(self, mock_transaction):
+        cursor = MagicMock()
+        mock_transaction.return_value.__enter__.return_value = cursor
+
+        update_job(6, "done", 12)
+
+        # Assertions
+        self.assertIn("AND Status IN %s", cursor.execute.call_args[0][0])
+        self.assertEqual(cursor.execute.call_args[0][1], ("done", 12, None, 6, ("running",)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from report_scheduler import ReportScheduler, claim_due_schedules, invalidate_schedules, list_schedules, save_schedule
+from model.report import ScheduledReport
+
+PARAMS = {"name": "weekly", "recurrence": "Weekly", "status": True, "email": "user@example.com",
+          "startDate": "2024-12-02 08:00:00", "kpis": ["energy_consumed_sum"], "machines": ["m1"]}
+
+
+def mock_transaction(cursor):
+    context = MagicMock()
+    context.__enter__.return_value = cursor
+    return MagicMock(return_value=context)
+
+
+class TestSchedules(unittest.TestCase):
+
+    def setUp(self):
+        invalidate_schedules()
+
+    def test_save_new_schedule(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (7, "weekly")
+
+        with patch('report_scheduler.transaction', mock_transaction(cursor)):
+            saved = save_schedule(1, ScheduledReport(id=None, **PARAMS))
+
+        # Assertions
+        self.assertEqual(saved.id, 7)
+        cursor.execute.assert_called_once()
+        self.assertIn("INSERT INTO ReportSchedules", cursor.execute.call_args[0][0])
+
+    def test_update_keeps_name(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (7, "weekly")
+
+        with patch('report_scheduler.transaction', mock_transaction(cursor)):
+            saved = save_schedule(1, ScheduledReport(id=7, **{**PARAMS, "name": "renamed"}))
+
+        # Assertions
+        self.assertEqual(saved.name, "weekly")
+        cursor.execute.assert_called_once()
+        self.assertIn("UPDATE ReportSchedules", cursor.execute.call_args[0][0])
+
+    def test_claim_due_schedules(self):
+        cursor = MagicMock()
+        stored = {key: value for key, value in PARAMS.items() if key != "name"}
+        cursor.fetchall.return_value = [(7, 1, "weekly", stored)]
+
+        with patch('report_scheduler.transaction', mock_transaction(cursor)):
+            claimed = claim_due_schedules(2)
+
+        # Assertions
+        self.assertIn("FOR UPDATE SKIP LOCKED", cursor.execute.call_args[0][0])
+        self.assertEqual(cursor.execute.call_args[0][1][1], 2)
+        self.assertEqual(claimed[0][0], 1)
+        self.assertEqual(claimed[0][1].id, 7)
+        self.assertEqual(claimed[0][1].name, "weekly")
+
+    def test_list_schedules_cached_until_saved(self):
+        cursor = MagicMock()
+        stored = {key: value for key, value in PARAMS.items() if key != "name"}
+        cursor.fetchall.return_value = [(7, "weekly", stored)]
+        cursor.fetchone.return_value = (7, "weekly")
+
+        with patch('report_scheduler.transaction', mock_transaction(cursor)):
+            first = list_schedules(1)
+            second = list_schedules(1)
+            self.assertEqual(cursor.execute.call_count, 1)
+            save_schedule(1, ScheduledReport(id=7, **PARAMS))
+            list_schedules(1)
+
+        # Assertions
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]["id"], 7)
+        self.assertEqual(first[0]["recurrence"], "Weekly")
+        self.assertEqual(cursor.execute.call_count, 3)
+
+
+class TestReportScheduler(unittest.TestCase):
+
+    @patch('report_scheduler.release_schedule')
+    @patch('report_scheduler.claim_due_schedules')
+    def test_run_pending(self, mock_claim, mock_release):
+        params = ScheduledReport(id=7, **PARAMS)
+        mock_claim.return_value = [(1, params)]
+        job = AsyncMock(side_effect=Exception("agent unavailable"))
+        scheduler = ReportScheduler(job, workers=2)
+
+        async def scenario():
+            await scheduler.run_pending()
+            await asyncio.gather(*scheduler._running)
+
+        asyncio.run(scenario())
+
+        # Assertions
+        mock_claim.assert_called_once_with(2)
+        job.assert_awaited_once_with("1", params)
+        mock_release.assert_called_once_with(7, "agent unavailable")
+
+    @patch('report_scheduler.claim_due_schedules')
+    def test_no_claim_without_free_workers(self, mock_claim):
+        scheduler = ReportScheduler(AsyncMock(), workers=1)
+        scheduler._running.add(MagicMock())
+
+        asyncio.run(scheduler.run_pending())
+
+        # Assertions
+        mock_claim.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
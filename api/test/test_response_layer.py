@@ -0,0 +1,85 @@
+import unittest
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import httpx
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from response_layer import CompressionMiddleware, FastJSONResponse, dumps
+
+
+def create_app():
+    app = FastAPI(default_response_class=FastJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    async def large():
+        return {"values": list(range(200))}
+
+    @app.get("/small")
+    async def small():
+        return {"values": [1]}
+
+    @app.get("/ndjson")
+    async def ndjson():
+        return StreamingResponse((dumps({"row": i}) + b"\n" for i in range(100)), media_type="application/x-ndjson")
+
+    @app.get("/events")
+    async def events():
+        return StreamingResponse(iter([b"data: alert\n\n" * 50]), media_type="text/event-stream")
+
+    return app
+
+
+def get_all(paths, encoding="gzip"):
+    async def scenario():
+        transport = httpx.ASGITransport(app=create_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.get(path, headers={"Accept-Encoding": encoding}) for path in paths]
+
+    return asyncio.run(scenario())
+
+
+class TestResponseLayer(unittest.TestCase):
+
+    def test_dumps_numpy(self):
+        content = {"values": np.array([1.5, 2.0]), "scalar": np.float64(0.25), "missing": float("nan")}
+
+        # Assertions
+        self.assertEqual(dumps(content), b'{"values":[1.5,2.0],"scalar":0.25,"missing":null}')
+
+    def test_compression_threshold(self):
+        large, small = get_all(["/large", "/small"])
+
+        # Assertions
+        self.assertEqual(large.headers["content-encoding"], "gzip")
+        self.assertEqual(large.headers["vary"], "Accept-Encoding")
+        self.assertEqual(large.json(), {"values": list(range(200))})
+        self.assertNotIn("content-encoding", small.headers)
+        self.assertEqual(small.json(), {"values": [1]})
+
+    def test_stream_compressed(self):
+        ndjson, events = get_all(["/ndjson", "/events"])
+
+        # Assertions
+        self.assertEqual(ndjson.headers["content-encoding"], "gzip")
+        self.assertEqual(ndjson.text.splitlines()[-1], '{"row":99}')
+        self.assertNotIn("content-encoding", events.headers)
+        self.assertTrue(events.text.startswith("data: alert"))
+
+    def test_encoding_not_accepted(self):
+        identity, refused = get_all(["/large"], "identity")[0], get_all(["/large"], "gzip;q=0")[0]
+
+        # Assertions
+        self.assertNotIn("content-encoding", identity.headers)
+        self.assertNotIn("content-encoding", refused.headers)
+        self.assertEqual(refused.json(), {"values": list(range(200))})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import patch, MagicMock
+from contextlib import contextmanager
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from fastapi import HTTPException
+from AES_lib import encrypt_data
+import api_auth.session as session
+
+AES_KEY = '00112233445566778899aabbccddeeff'
+
+
+def mock_transaction(cursor):
+    @contextmanager
+    def transaction():
+        yield cursor
+    return transaction
+
+
+def user_row(password=None):
+    key = bytes.fromhex(AES_KEY)
+    row = (1, encrypt_data('mario', key), encrypt_data('mario@example.com', key), 'FactoryFloorManager',
+           encrypt_data('Site', key))
+    return row + (password,) if password is not None else row
+
+
+@patch.dict(os.environ, {'AES_KEY': AES_KEY})
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        session.aes_key.cache_clear()
+        session.principal_cache.invalidate()
+        session.token_cache.invalidate()
+        session.revoked_tokens.invalidate()
+
+    def test_login_caches_principal(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = user_row('secret')
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            principal = session.authenticate('mario', False, 'secret')
+            cached = session.get_principal(1)
+
+        # Assertions
+        self.assertEqual(principal, {"userId": 1, "username": 'mario', "email": 'mario@example.com',
+                                     "role": 'FactoryFloorManager', "site": 'Site'})
+        self.assertEqual(cached, principal)
+        self.assertEqual(cursor.execute.call_count, 1)
+        self.assertIn("Username = %s", cursor.execute.call_args[0][0])
+
+    def test_login_wrong_password(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = user_row('secret')
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            principal = session.authenticate('mario@example.com', True, 'wrong')
+
+        # Assertions
+        self.assertIsNone(principal)
+        self.assertEqual(session.principal_cache.stats()["size"], 0)
+
+    def test_current_user_memoized(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = user_row()
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            principal = session.get_principal(1)
+            token = session.create_access_token(principal)
+            session.invalidate_principal(1)
+            with patch('api_auth.session.jwt.decode', wraps=session.jwt.decode) as mock_decode:
+                users = [asyncio.run(session.get_current_user(token)) for _ in range(3)]
+
+        # Assertions
+        self.assertEqual(users, [principal] * 3)
+        mock_decode.assert_called_once()
+        self.assertEqual(cursor.execute.call_count, 2)
+
+    def test_logout_revokes_token(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = user_row()
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            principal = session.get_principal(1)
+            token = session.create_access_token(principal)
+            asyncio.run(session.get_current_user(token))
+            session.revoke_tokens(1)
+            with self.assertRaises(HTTPException) as revoked:
+                asyncio.run(session.get_current_user(token))
+            renewed = asyncio.run(session.get_current_user(session.create_access_token(principal)))
+
+        # Assertions
+        self.assertEqual(revoked.exception.status_code, 401)
+        self.assertEqual(renewed, principal)
+
+    def test_token_of_another_user(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = user_row()
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            token = session.create_access_token(session.get_principal(1))
+            principal = asyncio.run(session.verify_user_token('1', token))
+            with self.assertRaises(HTTPException) as forbidden:
+                asyncio.run(session.verify_user_token('2', token))
+
+        # Assertions
+        self.assertEqual(principal["userId"], 1)
+        self.assertEqual(forbidden.exception.status_code, 403)
+        self.assertIsNone(asyncio.run(session.verify_user_token('1', None)))
+
+    def test_invalid_token(self):
+        # Assertions
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(session.get_current_user('not-a-token'))
+        self.assertEqual(context.exception.status_code, 401)
+
+    def test_register_existing_user(self):
+        cursor = MagicMock()
+        cursor.fetchone.return_value = None
+
+        with patch('api_auth.session.transaction', mock_transaction(cursor)):
+            user_id = session.register_user('mario', 'mario@example.com', 'FactoryFloorManager', 'secret', 'Site')
+
+        # Assertions
+        self.assertIsNone(user_id)
+        self.assertIn("WHERE NOT EXISTS", cursor.execute.call_args[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
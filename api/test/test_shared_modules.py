@@ -0,0 +1,27 @@
+import unittest
+import os
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+
+# Every service imports its own copy of the shared modules, from its source directory
+SERVICE_DIRS = ['api/src', 'kb/src', 'kpi-engine/src', 'rag/api', 'data-processing']
+SHARED_MODULES = ['instrumentation.py', 'response_layer.py']
+
+
+class TestSharedModules(unittest.TestCase):
+
+    def test_copies_identical(self):
+        for module in SHARED_MODULES:
+            with self.subTest(module=module):
+                copies = {}
+                for service_dir in SERVICE_DIRS:
+                    with open(os.path.join(ROOT, service_dir, module), 'rb') as file:
+                        copies[service_dir] = file.read()
+
+                # Assertions
+                different = [service_dir for service_dir, copy in copies.items() if copy != copies['api/src']]
+                self.assertEqual(different, [], f"{module} differs from api/src/{module}, update every copy")
+
+
+if __name__ == '__main__':
+    unittest.main()
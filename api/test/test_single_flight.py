@@ -0,0 +1,90 @@
+import unittest
+import asyncio
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from single_flight import SingleFlight, flight_key
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    async def slow_call(self, result="result"):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return result
+
+    def test_flight_key_normalized(self):
+        # Assertions
+        self.assertEqual(flight_key("/kpi", {"a": 1, "b": [1, 2]}), flight_key("/kpi", {"b": [1, 2], "a": 1}))
+        self.assertNotEqual(flight_key("/kpi", {"b": [1, 2]}), flight_key("/kpi", {"b": [2, 1]}))
+        self.assertNotEqual(flight_key("/kpi", {"a": 1}), flight_key("/historical", {"a": 1}))
+
+    def test_identical_requests_merged(self):
+        flight = SingleFlight("test")
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do("key", self.slow_call) for _ in range(5)),
+                                        flight.do("other", self.slow_call))
+
+        results = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(results, ["result"] * 6)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(flight.stats(), {"leaders": 2, "merged": 4, "errors": 0, "in_flight": 0})
+
+    def test_error_shared(self):
+        flight = SingleFlight("test")
+
+        async def failing_call():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do("key", failing_call) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(flight.stats()["errors"], 1)
+
+    def test_leader_cancelled(self):
+        flight = SingleFlight("test")
+
+        async def scenario():
+            leader = asyncio.ensure_future(flight.do("key", self.slow_call))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flight.do("key", self.slow_call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await waiter
+
+        result = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(result, "result")
+        self.assertEqual(self.calls, 1)
+
+    def test_disabled(self):
+        flight = SingleFlight("test", enabled=False)
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do("key", self.slow_call) for _ in range(3)))
+
+        asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(flight.stats()["merged"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest.mock import patch, AsyncMock
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from upstream import Upstream, UpstreamUnavailable
+
+
+def make_upstream(handler, **kwargs):
+    return Upstream("test", transport=httpx.MockTransport(handler), **kwargs)
+
+
+@patch('upstream.asyncio.sleep', new=AsyncMock())
+class TestUpstream(unittest.TestCase):
+
+    def test_request_success(self):
+        upstream = make_upstream(lambda request: httpx.Response(200, json={"Status": 0}))
+
+        response = asyncio.run(upstream.get("http://kb:8000/kb/retrieveKPIs"))
+
+        # Assertions
+        self.assertEqual(response.json(), {"Status": 0})
+        stats = upstream.stats()
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["errors"], 0)
+        self.assertEqual(stats["latency_seconds"]["count"], 1)
+        self.assertEqual(stats["circuit"], "closed")
+
+    def test_get_retried_on_unavailable(self):
+        answers = iter([httpx.Response(503), httpx.Response(200, json={})])
+        upstream = make_upstream(lambda request: next(answers), retries=2)
+
+        response = asyncio.run(upstream.get("http://kb:8000/kb/retrieveKPIs"))
+
+        # Assertions
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(upstream.stats()["retries"], 1)
+
+    def test_post_not_retried_after_timeout(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ReadTimeout("timeout", request=request)
+
+        upstream = make_upstream(handler, retries=2)
+
+        # Assertions
+        with self.assertRaises(httpx.ReadTimeout):
+            asyncio.run(upstream.post("http://rag:8000/agent/chat", json={}))
+        self.assertEqual(len(calls), 1)
+
+    def test_post_retried_on_connect_error(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200, json={})
+
+        upstream = make_upstream(handler, retries=2)
+        response = asyncio.run(upstream.post("http://rag:8000/agent/chat", json={}))
+
+        # Assertions
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+
+    def test_circuit_opens_after_failures(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(500)
+
+        upstream = make_upstream(handler, retries=0, failure_threshold=2, reset_timeout=60)
+
+        async def scenario():
+            for _ in range(2):
+                await upstream.post("http://kpi-engine:8000/kpi/calculate")
+            await upstream.post("http://kpi-engine:8000/kpi/calculate")
+
+        # Assertions
+        with self.assertRaises(UpstreamUnavailable):
+            asyncio.run(scenario())
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(upstream.stats()["circuit"], "open")
+        self.assertEqual(upstream.stats()["rejected"], 1)
+
+    def test_circuit_closes_after_successful_probe(self):
+        answers = iter([httpx.Response(500), httpx.Response(200, json={})])
+        upstream = make_upstream(lambda request: next(answers), retries=0, failure_threshold=1, reset_timeout=0)
+
+        async def scenario():
+            await upstream.post("http://kb:8000/kb/insert")
+            return await upstream.post("http://kb:8000/kb/insert")
+
+        response = asyncio.run(scenario())
+
+        # Assertions
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(upstream.stats()["circuit"], "closed")
+
+
+if __name__ == '__main__':
+    unittest.main()
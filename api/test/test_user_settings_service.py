@@ -5,10 +5,14 @@ from unittest.mock import patch, MagicMock
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
 
-from user_settings_service import persist_user_settings, retrieve_user_settings, verify_user_presence
+from user_settings_service import persist_user_settings, retrieve_user_settings, verify_user_presence, \
+    invalidate_settings, patch_settings, settings_response, get_settings_entry, USER_SETTINGS
 
 class TestUserSettingsService(unittest.TestCase):
 
+    def setUp(self):
+        invalidate_settings()
+
     @patch('user_settings_service.get_db_connection')
     @patch('user_settings_service.verify_user_presence')
     def test_persist_user_settings_success(self, mock_verify_user_presence, mock_get_db_connection):
@@ -25,11 +29,16 @@ class TestUserSettingsService(unittest.TestCase):
     @patch('user_settings_service.get_db_connection')
     @patch('user_settings_service.verify_user_presence')
     def test_persist_user_settings_user_not_present(self, mock_verify_user_presence, mock_get_db_connection):
-        mock_verify_user_presence.return_value = False
+        mock_cursor = MagicMock()
+        mock_connection = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = None
 
         result = persist_user_settings(1, {"theme": "dark"})
         self.assertFalse(result)
-        mock_get_db_connection.assert_not_called()
+        # the presence of the user is checked by the update itself
+        mock_verify_user_presence.assert_not_called()
+        mock_cursor.execute.assert_called_once()
 
     @patch('user_settings_service.get_db_connection')
     def test_retrieve_user_settings_success(self, mock_get_db_connection):
@@ -42,6 +51,14 @@ class TestUserSettingsService(unittest.TestCase):
         self.assertEqual(result, {"theme": "dark"})
         mock_cursor.execute.assert_called_once()
 
+    @patch('user_settings_service.get_db_connection')
+    def test_retrieve_user_settings_no_connection(self, mock_get_db_connection):
+        mock_get_db_connection.return_value = (None, None)
+
+        with self.assertRaises(Exception) as error:
+            retrieve_user_settings(1)
+        self.assertEqual(str(error.exception), "Database connection failed")
+
     @patch('user_settings_service.get_db_connection')
     def test_retrieve_user_settings_no_settings(self, mock_get_db_connection):
         mock_cursor = MagicMock()
@@ -74,6 +91,56 @@ class TestUserSettingsService(unittest.TestCase):
         result = verify_user_presence(1)
         self.assertFalse(result)
         mock_cursor.execute.assert_called_once()
+    @patch('user_settings_service.get_db_connection')
+    def test_retrieve_user_settings_cached(self, mock_get_db_connection):
+        mock_cursor = MagicMock()
+        mock_connection = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = ({"theme": "dark"},)
+
+        first = retrieve_user_settings(1)
+        second = retrieve_user_settings('1')
+        self.assertEqual(first, {"theme": "dark"})
+        self.assertEqual(second, {"theme": "dark"})
+        mock_cursor.execute.assert_called_once()
+
+    @patch('user_settings_service.get_db_connection')
+    def test_persist_user_settings_writes_through(self, mock_get_db_connection):
+        mock_cursor = MagicMock()
+        mock_connection = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = (1,)
+
+        persist_user_settings(1, {"theme": "light"})
+        result = retrieve_user_settings(1)
+        self.assertEqual(result, {"theme": "light"})
+        mock_cursor.execute.assert_called_once()
+
+    @patch('user_settings_service.get_db_connection')
+    def test_patch_settings(self, mock_get_db_connection):
+        mock_cursor = MagicMock()
+        mock_connection = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = ({"theme": "dark", "language": "it"},)
+
+        entry = patch_settings(1, USER_SETTINGS, {"theme": "dark", "unit": None})
+        query, values = mock_cursor.execute.call_args[0]
+        self.assertIn("|| %s) - %s::text[]", query)
+        self.assertEqual(values[0].adapted, {"theme": "dark"})
+        self.assertEqual(values[1], ["unit"])
+        self.assertEqual(entry.value, {"theme": "dark", "language": "it"})
+
+    @patch('user_settings_service.get_db_connection')
+    def test_settings_response_not_modified(self, mock_get_db_connection):
+        mock_cursor = MagicMock()
+        mock_connection = MagicMock()
+        mock_get_db_connection.return_value = (mock_connection, mock_cursor)
+        mock_cursor.fetchone.return_value = ({"theme": "dark"},)
+
+        entry = get_settings_entry(1, USER_SETTINGS)
+        self.assertEqual(settings_response(entry).status_code, 200)
+        self.assertEqual(settings_response(entry, entry.etag).status_code, 304)
+        self.assertEqual(settings_response(entry, '"other"').status_code, 200)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,38 @@
-import torch
-import torch.nn as nn
+from __future__ import annotations
+
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
-from aix360.algorithms.lime import LimeTabularExplainer
-from typing import Union, Any, List, Tuple
+from typing import TYPE_CHECKING, Union, Any, List, Tuple
 import random
+from statistics import NormalDist
 from datetime import datetime, timedelta
 import xgboost as xgb
 import time
 
+if TYPE_CHECKING:
+    import torch
+
+
+def _torch():
+    """
+    Return the torch module if it has already been imported, None otherwise.
+
+    A PyTorch model or tensor can only be passed to the explainer by a caller that imported
+    torch, so torch is never loaded just to find out that the model is an XGBoost one.
+    """
+    return sys.modules.get('torch')
+
+
+def _is_torch_model(model: Any) -> bool:
+    torch = _torch()
+    return torch is not None and isinstance(model, torch.nn.Module)
+
+
+def _is_tensor(data: Any) -> bool:
+    torch = _torch()
+    return torch is not None and isinstance(data, torch.Tensor)
+
+
 class ForecastExplainer:
     def __init__(
         self,
@@ -16,7 +40,9 @@ class ForecastExplainer:
         training_data: Union[np.ndarray, torch.Tensor],
         training_outputs: Union[np.ndarray, torch.Tensor] = None,  # Made optional with default None
         use_residuals: bool = False,
-        device: torch.device = None
+        device: torch.device = None,
+        residual_quantiles: dict = None,
+        rng: np.random.Generator = None
     ):
         """
         Initialize the ForecastExplainer.
@@ -29,6 +55,13 @@ class ForecastExplainer:
                 Required only when use_residuals is True. Defaults to None.
             use_residuals (bool): Whether to calculate bounds using residuals. Default is False.
             device (torch.device, optional): Device to run the model on (CPU or GPU). If None, it is auto-selected.
+            residual_quantiles (dict, optional): Residual quantiles calibrated at training time, mapping the
+                confidence level (as a string, e.g. "0.95") to the [lower, upper] offsets of the one-step-ahead
+                residuals. If given, the bounds are read from this table and no extra model call is made.
+                Defaults to None.
+            rng (np.random.Generator, optional): Generator of the bootstrap noise and of the LIME samples, so
+                that explainers running in parallel threads do not share the global random state. If None, a
+                new unseeded generator is used.
 
         Raises:
             ValueError: If use_residuals is True but training_outputs is None.
@@ -38,13 +71,18 @@ class ForecastExplainer:
             raise ValueError("training_outputs must be provided when use_residuals is True")
 
         self.model = model
-        self.device = device or (torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu'))
+        self.device = device
+        if self.device is None and _is_torch_model(model):
+            torch = _torch()
+            self.device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
         self.use_residuals = use_residuals
+        self.residual_quantiles = residual_quantiles
+        self.rng = rng if rng is not None else np.random.default_rng()
 
         # Convert training_data and training_outputs to numpy arrays if they're tensors
-        if isinstance(training_data, torch.Tensor):
+        if _is_tensor(training_data):
             training_data = training_data.detach().cpu().numpy()
-        if isinstance(training_outputs, torch.Tensor) and training_outputs is not None:
+        if _is_tensor(training_outputs):
             training_outputs = training_outputs.detach().cpu().numpy()
 
         self.training_data = training_data
@@ -54,7 +92,8 @@ class ForecastExplainer:
         # Calculate and store training data statistics based on the selected mode
         if self.use_residuals:
             self.residuals = self.calculate_residuals()
-        else:
+            self.residual_std = np.std(self.residuals)
+        elif self.residual_quantiles is None:
             # Pre-calculate training data std for bootstrap mode
             self.training_std = np.std(self.training_data)
 
@@ -65,7 +104,8 @@ class ForecastExplainer:
         Returns:
             np.ndarray: Residuals of shape (num_samples,).
         """
-        if isinstance(self.model, nn.Module):
+        if _is_torch_model(self.model):
+            torch = _torch()
             # For PyTorch models, predict in batches
             inputs_tensor = torch.from_numpy(self.training_data.reshape(self.num_samples, self.seq_length, 1)).float().to(self.device)
             self.model.eval()
@@ -105,10 +145,11 @@ class ForecastExplainer:
             np.ndarray: A 1D numpy array (shape (1,)) representing the model's prediction.
         """
         # Ensure input_data is a numpy array
-        if isinstance(input_data, torch.Tensor):
+        if _is_tensor(input_data):
             input_data = input_data.detach().cpu().numpy()
 
-        if isinstance(self.model, nn.Module):
+        if _is_torch_model(self.model):
+            torch = _torch()
             # PyTorch model prediction
             input_data_reshaped = input_data.reshape(1, self.seq_length, 1)
             input_tensor = torch.from_numpy(input_data_reshaped).float().to(self.device)
@@ -127,12 +168,18 @@ class ForecastExplainer:
         input_data: np.ndarray,
         n_samples: int = 100,
         confidence: float = 0.95,
-        step: int = 0
+        step: int = 0,
+        raw_pred: float = None
     ) -> Tuple[float, float, float, float]:
         """
         Make a prediction with uncertainty estimation.
 
-        Two modes of operation:
+        Three modes of operation:
+        0. Calibrated mode (residual_quantiles given):
+           - Looks up the residual quantiles of the requested confidence level
+           - Scales them with square root of horizon
+           - Falls back to residuals mode for confidence levels that were not calibrated
+
         1. Residuals mode (use_residuals=True):
            - Uses historical residuals to compute standard deviation
            - Applies z-scores based on confidence level
@@ -150,40 +197,46 @@ class ForecastExplainer:
             n_samples (int, optional): Number of bootstrap samples/perturbed inputs. Default is 100.
             confidence (float, optional): Confidence level for the interval (e.g. 0.95 for 95%). Default is 0.95.
             step (int, optional): The step number in the autoregressive sequence, used for uncertainty scaling. Default is 0.
+            raw_pred (float, optional): The model prediction for input_data, if already computed. Default is None.
 
         Returns:
             Tuple[float, float, float, float]: A tuple containing:
-                mean_pred (float): Mean prediction (raw prediction in residuals mode, bootstrap mean in bootstrap mode).
+                mean_pred (float): Mean prediction (raw prediction in calibrated and residuals mode, bootstrap mean in bootstrap mode).
                 lower_bound (float): Lower bound of the confidence interval.
                 upper_bound (float): Upper bound of the confidence interval.
                 confidence (float): Confidence level used for the interval.
         """
-        mean_pred = self.predict(input_data)[0]
+        mean_pred = raw_pred if raw_pred is not None else self.predict(input_data)[0]
 
         # Scale uncertainty with prediction horizon ("Square Root of Time" rule in volatility scaling)
         uncertainty_scale = np.sqrt(1 + step)  # Square root growth of uncertainty
 
-        if self.use_residuals:
-            # Calculate statistics of residuals
-            residual_std = np.std(self.residuals)
-            
-            # Calculate z-score for the desired confidence interval
-            # For example, for 95% confidence, z_score ≈ 1.96
-            z_score = np.abs(np.percentile(np.random.standard_normal(10000), 
-                                         [((1-confidence)/2)*100, (1-(1-confidence)/2)*100]))
-            
+        quantiles = self.residual_quantiles.get(str(confidence)) if self.residual_quantiles is not None else None
+        if quantiles is not None:
+            # Offsets calibrated on out-of-fold residuals, possibly asymmetric
+            lower_bound = mean_pred + quantiles[0] * uncertainty_scale
+            upper_bound = mean_pred + quantiles[1] * uncertainty_scale
+
+        elif self.use_residuals or self.residual_quantiles is not None:
+            # Uncalibrated confidence level: use the spread of the calibrated offsets as std
+            residual_std = self.residual_std if self.use_residuals else self._quantiles_std()
+
+            # z-score for the desired confidence interval, e.g. for 95% confidence z_score ≈ 1.96
+            z_score = NormalDist().inv_cdf((1 + confidence) / 2)
+
             # Calculate bounds
-            lower_bound = mean_pred - z_score[0] * residual_std * uncertainty_scale
-            upper_bound = mean_pred + z_score[1] * residual_std * uncertainty_scale
+            lower_bound = mean_pred - z_score * residual_std * uncertainty_scale
+            upper_bound = mean_pred + z_score * residual_std * uncertainty_scale
 
         else:
             # Use pre-calculated training data std and scale it with step
             bootstrap_noise_std = self.training_std * uncertainty_scale
 
             perturbed_inputs = np.repeat(input_data.reshape(1, -1), n_samples, axis=0) 
-            perturbed_inputs += np.random.normal(0, bootstrap_noise_std, size=perturbed_inputs.shape)
+            perturbed_inputs += self.rng.normal(0, bootstrap_noise_std, size=perturbed_inputs.shape)
 
-            if isinstance(self.model, nn.Module):
+            if _is_torch_model(self.model):
+                torch = _torch()
                 # PyTorch model: run batch through model
                 inputs_tensor = torch.from_numpy(perturbed_inputs.reshape(n_samples, self.seq_length, 1)).float().to(self.device)
                 self.model.eval()
@@ -200,6 +253,17 @@ class ForecastExplainer:
 
         return mean_pred, lower_bound, upper_bound, confidence
 
+    def _quantiles_std(self) -> float:
+        """
+        Estimate the residual standard deviation from the widest calibrated interval.
+
+        Returns:
+            float: The estimated standard deviation of the residuals.
+        """
+        level = max(self.residual_quantiles, key=float)
+        lower, upper = self.residual_quantiles[level]
+        return (upper - lower) / (2 * NormalDist().inv_cdf((1 + float(level)) / 2))
+
 
     def explain_prediction(
         self,
@@ -227,11 +291,14 @@ class ForecastExplainer:
         Returns:
             List[Tuple[str, float]]: A list of (feature_label, importance) pairs.
         """
+        from aix360.algorithms.lime import LimeTabularExplainer
+
         input_data_flat = input_data.flatten()
 
         def predict_fn(data):
             batch_size = data.shape[0]
-            if isinstance(self.model, nn.Module):
+            if _is_torch_model(self.model):
+                torch = _torch()
                 # For PyTorch models, reshape to (batch, seq_length, 1)
                 inputs = data.reshape(batch_size, self.seq_length, 1)
                 inputs_tensor = torch.from_numpy(inputs).float().to(self.device)
@@ -247,7 +314,8 @@ class ForecastExplainer:
             training_data=self.training_data,
             feature_names=input_labels,  # Use the current labels directly
             mode='regression',
-            verbose=False
+            verbose=False,
+            random_state=int(self.rng.integers(2 ** 31))
         )
 
         exp = explainer.explain_instance(
@@ -273,7 +341,8 @@ class ForecastExplainer:
         """
         Perform autoregressive prediction and explanation for n_predictions steps.
 
-        Uncertainty bounds are calculated differently based on use_residuals:
+        Uncertainty bounds are calculated differently based on residual_quantiles and use_residuals:
+        - Calibrated: Uses the residual quantiles computed at training time with square root time scaling
         - If True: Uses residuals and z-scores with square root time scaling
         - If False: Uses bootstrap sampling of perturbed inputs
 
@@ -307,7 +376,7 @@ class ForecastExplainer:
                 'Lime_explaination' (List[List[Tuple[str,float]]]): LIME explanations per step.
                 'Date_prediction' (List[str]): Predicted date labels for each step.
         """
-        if isinstance(input_data, torch.Tensor):
+        if _is_tensor(input_data):
             input_data = input_data.detach().cpu().numpy()
 
         predicted_values = []
@@ -321,12 +390,12 @@ class ForecastExplainer:
         current_labels = input_labels.copy()
 
         for i in range(n_predictions):
+            # Compute raw prediction
+            raw_pred = self.predict(current_input)[0]
             # Compute uncertainties
             mean_pred, lower_bound, upper_bound, confidence_level = self.predict_with_uncertainty(
-                current_input, n_samples=n_samples, confidence=confidence, step=i
+                current_input, n_samples=n_samples, confidence=confidence, step=i, raw_pred=raw_pred
             )
-            # Compute raw prediction
-            raw_pred = self.predict(current_input)[0]
 
             # Decide which prediction to use
             final_pred = mean_pred if use_mean_pred else raw_pred
@@ -376,9 +445,10 @@ def main():
     Returns:
         None
     """
+    import matplotlib.pyplot as plt
+
     # Seed
     np.random.seed(42)
-    torch.manual_seed(42)
     random.seed(42)
 
     # Generate a sine wave
@@ -411,7 +481,8 @@ def main():
 
     # Bootstrap mode
     start_time_bootstrap = time.time()
-    explainer_bootstrap = ForecastExplainer(model, X_train, y_train, use_residuals=False)
+    explainer_bootstrap = ForecastExplainer(model, X_train, y_train, use_residuals=False,
+                                            rng=np.random.default_rng(42))
     results_bootstrap = explainer_bootstrap.predict_and_explain(
         input_data=input_data,
         n_predictions=n_predictions,
@@ -425,7 +496,8 @@ def main():
 
     # Residuals mode
     start_time_residuals = time.time()
-    explainer_residuals = ForecastExplainer(model, X_train, y_train, use_residuals=True)
+    explainer_residuals = ForecastExplainer(model, X_train, y_train, use_residuals=True,
+                                            rng=np.random.default_rng(42))
     results_residuals = explainer_residuals.predict_and_explain(
         input_data=input_data,
         n_predictions=n_predictions,
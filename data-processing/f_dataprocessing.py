@@ -2,17 +2,10 @@
 import pandas as pd
 import numpy as np
 
-from statsmodels.tsa.stattools import adfuller
+# statsmodels and sklearn are only needed to train the models or by the ARIMA
+# pipeline, they are imported by the functions using them to keep the startup fast
 import itertools
-from tqdm import notebook
-from statsmodels.tsa.statespace.sarimax import SARIMAX
 import xgboost as xgb
-from xgboost import XGBRegressor
-from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import GridSearchCV
-from sklearn.model_selection import ParameterGrid
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error, mean_absolute_error
 from model import Severity, Alert
 from math import isnan
 
@@ -20,15 +13,14 @@ import json
 import os
 import base64
 
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mticker
-import matplotlib.dates as mdates
-
 import requests
 from datetime import datetime, timedelta
 
 from XAI_forecasting import ForecastExplainer
 from storage.storage_operations import insert_model_to_storage, retrieve_model_from_storage
+from forecast_cache import forecast_cache, model_version
+from kb_cache import kb_cache
+from instrumentation import timed_upstream, trace_headers
 
 
 ####################################
@@ -57,8 +49,9 @@ def execute_druid_query(body):
     }
     url = "http://router:8888/druid/v2/sql"
     try:
-        response = requests.post(url, headers=headers, json=body)
-        response.raise_for_status()  # Raise an error for bad status codes
+        with timed_upstream("druid"):
+            response = requests.post(url, headers=headers, json=body)
+            response.raise_for_status()  # Raise an error for bad status codes
         return response.json()  # Return the JSON response
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
@@ -118,6 +111,8 @@ def perform_adfuller(series):
     :param series: any time series
     :return: the test statistic and p-value
     """
+    from statsmodels.tsa.stattools import adfuller
+
     try:
       result = adfuller(series, regression='ct')
       return 0,result[0], result[1]  # Returns test statistic and p-value
@@ -151,6 +146,8 @@ def data_normalize_params(data):
   :param data: the time series to be normalized
   :return: the normalized time series
   """
+  from sklearn.preprocessing import StandardScaler
+
   scaler = StandardScaler()
   array_value = data.values.reshape(-1,1)
   array_scaled = scaler.fit_transform(array_value)
@@ -270,8 +267,11 @@ def optimize_ARIMA(endog, order_list, d):
   :param d: Degree of differencing for ARIMA
   :return: DataFrame containing the best parameter combinations and AIC scores
   """
+  from statsmodels.tsa.statespace.sarimax import SARIMAX
+  from tqdm import tqdm
+
   results = []
-  for order in tqdm_notebook(order_list):
+  for order in tqdm(order_list):
       try:
           model = SARIMAX(endog, order=(order[0], d, order[1]), simple_differencing=False).fit(disp=False)
           aic = model.aic
@@ -289,10 +289,12 @@ def xgboost_parameter_select(X_train,y_train):
 
   :param X_train: Training features
   :param y_train: Training labels
-  :return: The best XGBoost model
+  :return: The best XGBoost model, its parameters and its number of boosting rounds
   """
+  from sklearn.model_selection import ParameterGrid
+
   # Define the XGBoost regressor
-  xgb_model = XGBRegressor(objective="reg:squarederror", random_state=42)
+  xgb_model = xgb.XGBRegressor(objective="reg:squarederror", random_state=42)
 
   # Define a small parameter grid
   param_grid = {
@@ -318,6 +320,7 @@ def xgboost_parameter_select(X_train,y_train):
   best_params = None
   best_score = float("inf")
   best_model = None
+  best_rounds = 0
 
   for params in param_combinations:
       # Create XGBoost parameters
@@ -345,7 +348,8 @@ def xgboost_parameter_select(X_train,y_train):
       # Update best parameters if score improves
       if mean_rmse < best_score:
           best_score = mean_rmse
-          best_params = params
+          best_params = xgb_params
+          best_rounds = best_iteration + 1
           best_model = xgb.train(
             params=xgb_params,
             dtrain=dtrain,
@@ -358,7 +362,48 @@ def xgboost_parameter_select(X_train,y_train):
 
 
 
-  return best_model
+  return best_model, best_params, best_rounds
+
+
+def residual_quantiles(X_train, y_train, xgb_params, num_boost_round, n_splits = 3, confidences = (0.8, 0.9, 0.95)):
+  """
+  Calibrates the prediction intervals of an XGBoost configuration on out-of-fold residuals.
+
+  The series is split in n_splits + 1 consecutive blocks; every block after the first is predicted by
+  a model trained on the blocks preceding it (forward chaining, so no future data leaks in the fit).
+  The empirical quantiles of the one-step-ahead residuals give, for each confidence level, the offsets
+  to add to a prediction to obtain its bounds.
+
+  :param X_train: Training features, in time order
+  :param y_train: Training labels, in time order
+  :param xgb_params: The XGBoost parameters of the selected model
+  :param num_boost_round: The number of boosting rounds of the selected model
+  :param n_splits: Number of out-of-fold blocks
+  :param confidences: Confidence levels to calibrate
+  :return: {'quantiles': {confidence: [lower offset, upper offset]}, 'std': residual std, 'n_residuals': int},
+           None if there are not enough samples
+  """
+  block = len(X_train) // (n_splits + 1)
+  if block < 2:
+    return None
+
+  residuals = []
+  for k in range(1, n_splits + 1):
+    start, end = k * block, (k + 1) * block if k < n_splits else len(X_train)
+    booster = xgb.train(params=xgb_params, dtrain=xgb.DMatrix(X_train[:start], label=y_train[:start]),
+                        num_boost_round=num_boost_round)
+    residuals.append(y_train[start:end] - booster.predict(xgb.DMatrix(X_train[start:end])))
+  residuals = np.concatenate(residuals)
+
+  quantiles = {}
+  for confidence in confidences:
+    lower, upper = np.percentile(residuals, [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100])
+    quantiles[str(confidence)] = [float(lower), float(upper)]
+  return {
+      'quantiles': quantiles,
+      'std': float(np.std(residuals)),
+      'n_residuals': int(len(residuals))
+  }
 
 
 def custom_tts(data, labels, window_size = 20):
@@ -497,20 +542,24 @@ def characterize_KPI(machine, kpi):
       # model.fit(X_train, y_train)
 
       # booster = model.get_booster()
-      booster = xgboost_parameter_select(X_train,y_train)
+      booster, xgb_params, num_boost_round = xgboost_parameter_select(X_train,y_train)
       model_bytes = booster.save_raw()
       encoded_model = base64.b64encode(model_bytes).decode('utf-8')
       a_dict['model'] = {
         'name': 'xgboost',
         'xgb_bytes': encoded_model,
         'metadata': {
-            'trained_on': str(datetime.today().date())},
+            'trained_on': str(datetime.today().date()),
+            'version': datetime.now().isoformat()},
             # 'hyperparameters': model.get_params()},
+        # prediction bounds calibrated once here, so that forecasting needs no extra model calls
+        'uncertainty': residual_quantiles(X_train, y_train, xgb_params, num_boost_round)
       }
     ############################
     ### 4. Meta-Data storage ###
     ############################
     save_model_data(machine, kpi, a_dict)
+    forecast_cache.invalidate(machine, kpi) # forecasts of the previous model are no longer valid
     return 0
   else:
     return call_status
@@ -540,6 +589,8 @@ def rolling_forecast(data, train_len: int, horizon: int, window: int, p: int , q
     :param d: ARIMA order parameter d (degree of differencing).
     :return: List of predicted values for the specified horizon.
     """
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
     total_len = train_len + horizon
     pred_ARIMA = []
 
@@ -558,7 +609,7 @@ def rolling_forecast(data, train_len: int, horizon: int, window: int, p: int , q
 
     return pred_ARIMA[:horizon]
 
-def XAI_PRED(data,Last_date, model, total_points, seq_length = 10, n_predictions = 30):
+def XAI_PRED(data,Last_date, model, total_points, seq_length = 10, n_predictions = 30, uncertainty = None):
   """
   Explains predictions using XGBoost and interpretable machine learning techniques.
 
@@ -568,9 +619,12 @@ def XAI_PRED(data,Last_date, model, total_points, seq_length = 10, n_predictions
   :param total_points: Total number of data points in the series.
   :param seq_length: Length of the input sequence for prediction.
   :param n_predictions: Number of future points to predict.
+  :param uncertainty: The residual quantiles calibrated at training time (see residual_quantiles),
+                      if None the bounds are estimated by bootstrap.
   :return: None. Displays explanations and prediction results.
   """
-  np.random.seed(42)
+  # seeded per call: the pairs of a request are explained in parallel threads
+  rng = np.random.default_rng(42)
 
   # Prepare training data for XGBoost: predict next value from last seq_length values
   X_train = []
@@ -592,7 +646,8 @@ def XAI_PRED(data,Last_date, model, total_points, seq_length = 10, n_predictions
   input_labels = [(start_date + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(seq_length)]
 
   # Initialize the explainer
-  explainer = ForecastExplainer(model, X_train)
+  residual_table = uncertainty['quantiles'] if uncertainty else None
+  explainer = ForecastExplainer(model, X_train, residual_quantiles=residual_table, rng=rng)
 
   # Perform autoregressive predictions
   results = explainer.predict_and_explain(
@@ -614,6 +669,9 @@ def make_prediction(machine, kpi, length):
   :param kpi: str, KPI to be predicted.
   :param length: int, number of steps to forecast.
 
+  XGBoost forecasts are served from the forecast cache when neither the model nor
+  the last data point of the series changed since they were computed.
+
   :return: None (prints evaluation metrics and forecasts).
   """
   a_dict = load_model(machine, kpi)
@@ -628,6 +686,7 @@ def make_prediction(machine, kpi, length):
 
   avg_values1 = data['Value'].values
   if a_dict['model']['name'] == 'ARIMA':
+    from sklearn.metrics import mean_squared_error, mean_absolute_error
 
     # Split into train and test sets
     train_len = int(len(avg_values1) * 0.85)
@@ -667,6 +726,12 @@ def make_prediction(machine, kpi, length):
         print(f"No test data available for evaluation for {machine} - {kpi}")
 
   elif a_dict['model']['name'] == 'xgboost':
+    # the forecast only depends on the model and on the data it starts from
+    version = model_version(a_dict)
+    cached = forecast_cache.get(machine, kpi, length, version, Last_date)
+    if cached is not None:
+      return cached
+
     # Decode the Base64 string back to raw bytes
     encoded_model = a_dict['model']['xgb_bytes']
     raw_model_bytes = bytearray(base64.b64decode(encoded_model))
@@ -684,23 +749,20 @@ def make_prediction(machine, kpi, length):
     # explainer = ForecastExplainer(loaded_model, X_train)
     # formatted_dates = [datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d") for date in kpi_data_Time[-11:-1]]
 
-    results = XAI_PRED(avg_values1,Last_date, loaded_model,len(avg_values1),seq_length = observation_window,n_predictions = length)
-    
-    #convert numpy(float) to float
-    x = [r.item() for r in results['Predicted_value']]
-    y = [r.item() for r in results['Lower_bound']]
-    z = [r.item() for r in results['Upper_bound']]
-    # k = [r.item() for r in results['Confidence_score']] this is no longer numpy float
-    results['Predicted_value'] = x
-    results['Lower_bound'] = y
-    results['Upper_bound'] = z
-    # results['Confidence_score'] = k
+    results = XAI_PRED(avg_values1,Last_date, loaded_model,len(avg_values1),seq_length = observation_window,n_predictions = length,
+                       uncertainty = a_dict['model'].get('uncertainty'))
     
+    # convert the numpy floats to floats in one pass, the Confidence_score is no longer numpy float
+    for key in ('Predicted_value', 'Lower_bound', 'Upper_bound'):
+      results[key] = np.asarray(results[key], dtype=float).tolist()
+
+    forecast_cache.put(machine, kpi, length, version, Last_date, results)
     return results
 
 def kpi_exists(machine, KPI, api_key):
   """
-  Checks if a specific KPI exists for a machine by querying a knowledge base API.
+  Checks if a specific KPI exists for a machine. The answer comes from the local copy of the
+  knowledge base (kb_cache), the KB API is queried only for pairs missing from it.
 
   :param machine: The machine ID.
   :param KPI: The KPI name.
@@ -708,19 +770,24 @@ def kpi_exists(machine, KPI, api_key):
   :return: Response from the knowledge base API.
   """
   machine = machine.replace(" ", "_")
-  print(f"looking for {machine}, {KPI}")
-  headers = {
+  Kpi_info = kb_cache.lookup(machine, KPI, api_key)
+  if Kpi_info is not None:
+    return Kpi_info
+
+  headers = trace_headers({
       "x-api-key": api_key
-  }
+  })
   
   # Send GET request with headers
   host_port = 8000
   url_KB = f"http://kb:{host_port}/kb/{machine}/{KPI}/check"
-  # Kpi_info  = requests.post(url_KB)
-  Kpi_info = requests.get(url_KB, headers=headers)
-  print(f"KB out: {Kpi_info.json()}")
+  with timed_upstream("kb"):
+    Kpi_info = requests.get(url_KB, headers=headers).json()
+  if Kpi_info.get('Status') == 0:
+    # the pair was added to the KB after the last refresh of the cache
+    kb_cache.refresh(api_key)
 
-  return Kpi_info.json()
+  return Kpi_info
 
 ###########################################
 #####=================================#####
@@ -871,9 +938,9 @@ def send_Alert(url, data, api_key):
   :param api_key: security key
   :return: None
   """
-  headers = {
+  headers = trace_headers({
       "x-api-key": api_key
-  }
+  })
 
   try:
       new_al = {
@@ -887,7 +954,8 @@ def send_Alert(url, data, api_key):
         "recipients": data["recipients"],
         "severity": data["severity"].value
       }  
-      response = requests.post(url, json=new_al, headers=headers)
+      with timed_upstream("api"):
+          response = requests.post(url, json=new_al, headers=headers)
       print(f"Response status code: {response.status_code}")
       print(f"Response body: {response.json()}")
   except requests.RequestException as e:
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def model_version(model_dict):
+    """
+    Return an identifier of the trained model stored in the metadata dictionary.
+
+    Models trained after the introduction of the cache carry an explicit version in
+    model.metadata.version, older ones are identified by the hash of their serialized booster.
+
+    Args:
+        model_dict (dict): the model metadata as returned by load_model.
+
+    Returns:
+        str: the model version.
+    """
+    model = model_dict.get('model', {})
+    version = model.get('metadata', {}).get('version')
+    if version:
+        return version
+    serialized = model.get('xgb_bytes', '') or f"{model.get('name')}{model.get('p')}{model.get('q')}"
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def _copy_result(result):
+    """Copy a prediction result, so that the cached lists are never modified by the callers."""
+    return {key: list(value) if isinstance(value, list) else value for key, value in result.items()}
+
+
+class _Entry:
+    __slots__ = ('version', 'watermark', 'result')
+
+    def __init__(self, version, watermark, result):
+        self.version = version
+        self.watermark = watermark
+        self.result = result
+
+
+class ForecastCache:
+    """
+    Bounded LRU cache of forecast results.
+
+    A result is valid for a (machine, KPI, horizon) as long as neither the model (version) nor
+    the underlying time series (watermark, the timestamp of its last data point) change.
+    Every horizon is cached on its own: the input window of the forecast ends horizon points
+    before the last data point, so a shorter forecast is not a prefix of a longer one.
+
+    Attributes:
+        max_entries (int): maximum number of (machine, KPI, horizon) forecasts kept in memory.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, machine, kpi, horizon, version, watermark):
+        """
+        Look up a forecast.
+
+        Args:
+            machine (str): the machine name.
+            kpi (str): the KPI name.
+            horizon (int): the number of steps requested.
+            version (str): the version of the model that would produce the forecast.
+            watermark (str): the timestamp of the last data point of the series.
+
+        Returns:
+            dict or None: a copy of the cached result, None on a miss.
+        """
+        key = (machine, kpi, horizon)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.version != version or entry.watermark != watermark):
+                # retrained model or new data point: the stored forecast is stale
+                del self._entries[key]
+                self._invalidations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return _copy_result(entry.result)
+
+    def put(self, machine, kpi, horizon, version, watermark, result):
+        """
+        Store a forecast.
+
+        Args:
+            machine (str): the machine name.
+            kpi (str): the KPI name.
+            horizon (int): the number of steps in result.
+            version (str): the version of the model that produced the forecast.
+            watermark (str): the timestamp of the last data point of the series.
+            result (dict): the prediction result, as returned by make_prediction.
+        """
+        key = (machine, kpi, horizon)
+        with self._lock:
+            self._entries[key] = _Entry(version, watermark, _copy_result(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, machine, kpi):
+        """
+        Drop the forecasts cached for a (machine, KPI) pair, e.g. after the model is retrained.
+
+        Args:
+            machine (str): the machine name.
+            kpi (str): the KPI name.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == (machine, kpi)]:
+                del self._entries[key]
+                self._invalidations += 1
+
+    def clear(self):
+        """Drop every cached forecast."""
+        with self._lock:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: size, capacity, hits, misses, evictions, invalidations and hit rate.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'hit_rate': self._hits / lookups if lookups else 0.0
+            }
+
+
+forecast_cache = ForecastCache(int(os.getenv('FORECAST_CACHE_SIZE', '256')))
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import requests
+
+from instrumentation import timed_upstream, trace_headers
+
+KB_URL = "http://kb:8000/kb"
+
+
+def _machine_key(machine):
+    """Normalize a machine name the same way the KB matches it against the ontology IRIs."""
+    return machine.lower().replace(" ", "_")
+
+
+class KBCache:
+    """
+    In-memory copy of the machine/KPI compatibility map of the knowledge base.
+
+    The whole map is downloaded with a single request and used to answer the pair checks
+    without reaching the KB. Every ttl seconds the cache asks the KB for the version of the
+    ontology (a tiny request) and downloads the map again only if it changed; refresh() forces
+    the reload, e.g. when the KB signals that a KPI was added.
+
+    Attributes:
+        ttl (float): seconds after which the version of the ontology is checked again.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._machines = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+
+    def _get(self, path, api_key):
+        with timed_upstream("kb"):
+            response = requests.get(f"{KB_URL}/{path}", headers=trace_headers({"x-api-key": api_key}), timeout=10)
+            response.raise_for_status()
+        return response.json()
+
+    def _reload(self, api_key):
+        data = self._get("machineKPIs", api_key)
+        self._machines = data["machines"]
+        self._version = data["version"]
+        self._reloads += 1
+
+    def _ensure_fresh(self, api_key, force=False):
+        """Reload the map if it was never loaded, if forced or if the ontology version changed."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._machines is not None and now - self._checked_at < self.ttl:
+                return
+            try:
+                if force or self._machines is None:
+                    self._reload(api_key)
+                elif self._get("version", api_key)["version"] != self._version:
+                    self._reload(api_key)
+                self._checked_at = now
+            except Exception as e:
+                # keep answering with the old map, the KB is checked again at the next lookup
+                print(f"could not refresh the KB cache: {e}")
+
+    def lookup(self, machine, KPI, api_key):
+        """
+        Answer a machine/KPI check from memory.
+
+        Args:
+            machine (str): the machine name.
+            KPI (str): the KPI name.
+            api_key (str): the authentication key for the KB.
+
+        Returns:
+            dict or None: the same answer of the KB check endpoint if the pair exists, None if it is
+            not in the cached map (or the map could not be loaded) and the KB has to be asked.
+        """
+        self._ensure_fresh(api_key)
+        machines = self._machines
+        kpi_info = machines.get(_machine_key(machine), {}).get(KPI) if machines is not None else None
+        with self._lock:
+            if kpi_info is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return {
+            'Status': 0,
+            'machine_id': machine,
+            'kpi_id': KPI,
+            'unit_measure': kpi_info['unit_measure'],
+            'forecastable': kpi_info['forecastable']
+        }
+
+    def refresh(self, api_key):
+        """
+        Download the map again, regardless of the ttl.
+
+        Args:
+            api_key (str): the authentication key for the KB.
+
+        Returns:
+            str or None: the version of the ontology now cached.
+        """
+        self._ensure_fresh(api_key, force=True)
+        return self._version
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: cached version, number of machines, hits, misses and reloads of the map.
+        """
+        with self._lock:
+            return {
+                'version': self._version,
+                'machines': len(self._machines) if self._machines is not None else 0,
+                'hits': self._hits,
+                'misses': self._misses,
+                'reloads': self._reloads
+            }
+
+
+kb_cache = KBCache(float(os.getenv('KB_CACHE_TTL', '60')))
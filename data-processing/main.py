@@ -2,13 +2,20 @@ import f_dataprocessing
 import uvicorn
 
 from storage.storage_operations import retrieve_all_models_from_storage
+from forecast_cache import forecast_cache
+from kb_cache import kb_cache
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, Depends
 import os
 import datetime
 import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from api_auth.api_auth import get_verify_api_key
+from instrumentation import instrument, register_callback
+from response_layer import CompressionMiddleware, FastJSONResponse
 
 from model import Json_out, Json_in, Json_out_el, LimeExplainationItem, Severity
 from dotenv import load_dotenv
@@ -64,13 +71,15 @@ async def task_scheduler():
 async def lifespan(app: FastAPI):
     """Lifespan context manager to start and stop the scheduler"""
     scheduler_task = asyncio.create_task(task_scheduler())
+    # prefetch the machine/KPI map of the KB, if it is not reachable yet it is loaded at the first prediction
+    asyncio.get_running_loop().run_in_executor(None, kb_cache.refresh, os.getenv('my_key'))
     try:
         yield
     finally:
         scheduler_task.cancel()
         await scheduler_task
 
-app = FastAPI(lifespan = lifespan)
+app = FastAPI(lifespan = lifespan, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -79,10 +88,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+instrument(app)
 
 env_path = Path(__file__).resolve().parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
+# independent machine/KPI pairs of a request are predicted in parallel by these workers: the threads are started
+# on demand, so a request of n pairs runs them all at once up to the PREDICTION_WORKERS cap (shared by the requests)
+prediction_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PREDICTION_WORKERS', '32')))
+# models requested by a prediction but not trained yet are created in background
+training_executor = ThreadPoolExecutor(max_workers=int(os.getenv('TRAINING_WORKERS', '1')))
+pending_trainings = set()
+pending_trainings_lock = threading.Lock()
+# status returned by characterize_KPI for the pairs whose background training failed,
+# TRAINING_ERROR if it raised an exception
+failed_trainings = {}
+TRAINING_ERROR = -2
+# a training that raised is retried after TRAINING_BACKOFF seconds, doubled at every new failure up to
+# TRAINING_BACKOFF_MAX; consecutive failures and monotonic time of the next attempt of every pair
+TRAINING_BACKOFF = float(os.getenv('TRAINING_BACKOFF', '60'))
+TRAINING_BACKOFF_MAX = float(os.getenv('TRAINING_BACKOFF_MAX', '3600'))
+training_retries = {}
+
+register_callback("cache_entries", "Entries kept in memory, by cache.",
+                  lambda: {"forecast": forecast_cache.stats()['size'], "kb": kb_cache.stats()['machines']},
+                  ("cache",))
+register_callback("cache_lookups_total", "Lookups of the caches, by cache and result.",
+                  lambda: {(name, result): stats[result]
+                           for name, stats in (("forecast", forecast_cache.stats()), ("kb", kb_cache.stats()))
+                           for result in ("hits", "misses")}, ("cache", "result"), kind="counter")
+register_callback("pending_trainings", "Models being trained in background.", lambda: len(pending_trainings))
+
 # TEST CONNECTIONS
 @app.get("/data-processing/_public")
 def hello_world():
@@ -116,20 +154,180 @@ def train_selected_models(JSONS: Json_in,api_key: str = Depends(get_verify_api_k
     print(f"Starting training for the {n_models} requested models. this may take a while...")
     curr_model = 1
     for json_in in JSONS.value:
-        f_dataprocessing.characterize_KPI(json_in.Machine_Name,json_in.KPI_Name )
+        status = f_dataprocessing.characterize_KPI(json_in.Machine_Name,json_in.KPI_Name )
+        if status == 0:
+            failed_trainings.pop((json_in.Machine_Name, json_in.KPI_Name), None)
+            training_retries.pop((json_in.Machine_Name, json_in.KPI_Name), None)
         print(f"{curr_model} model created of {n_models}")
         curr_model+=1
     print("all models created succesfully")
 
+@app.get("/data-processing/forecast_cache")
+def forecast_cache_stats(api_key: str = Depends(get_verify_api_key(["ai-agent","api-layer"]))):
+    """
+    return the hit-rate metrics of the forecast cache
+    """
+    return forecast_cache.stats()
+
+@app.get("/data-processing/kb_cache")
+def kb_cache_stats(api_key: str = Depends(get_verify_api_key(["ai-agent","api-layer"]))):
+    """
+    return the version and the hit-rate metrics of the local copy of the KB
+    """
+    return kb_cache.stats()
+
+@app.post("/data-processing/refresh_kb_cache")
+def refresh_kb_cache(api_key: str = Depends(get_verify_api_key(["api-layer","knowledge-base"]))):
+    """
+    reload the machine/KPI map from the KB, to be called when the ontology changes
+    """
+    return {"version": kb_cache.refresh(os.getenv('my_key'))}
+
 # ACTUAL PREDICTIONS
+def empty_json_out_el(machine, KPI_Name):
+    """
+    build an output element with no prediction, to be filled by the caller
+    """
+    return Json_out_el(
+        Machine_Name=machine,
+        KPI_Name=KPI_Name,
+        Predicted_value=[],
+        Lower_bound=[],
+        Upper_bound=[],
+        Confidence_score=[],
+        Lime_explaination=[],
+        Measure_unit="",
+        Date_prediction=[],
+        Error_message="",
+        Forecast=True
+    )
+
+def schedule_training(machine, KPI_Name):
+    """
+    queue the training of the model of a machine/KPI pair in the background,
+    unless the same training is already queued or running
+
+    Returns:
+    bool: True if a new training job was queued
+    """
+    key = (machine, KPI_Name)
+    with pending_trainings_lock:
+        if key in pending_trainings:
+            return False
+        pending_trainings.add(key)
+
+    def training_job():
+        try:
+            print(f"Creating model for {machine},{KPI_Name}")
+            status = f_dataprocessing.characterize_KPI(machine, KPI_Name)
+            if status != 0:
+                failed_trainings[key] = status
+            else:
+                failed_trainings.pop(key, None)
+            training_retries.pop(key, None)
+        except Exception as e:
+            print(f"Training of the model for {machine},{KPI_Name} failed: {e}")
+            failures = training_retries.get(key, (0, 0))[0] + 1
+            backoff = min(TRAINING_BACKOFF * 2 ** (failures - 1), TRAINING_BACKOFF_MAX)
+            training_retries[key] = (failures, time.monotonic() + backoff)
+            failed_trainings[key] = TRAINING_ERROR
+        finally:
+            with pending_trainings_lock:
+                pending_trainings.discard(key)
+
+    training_executor.submit(training_job)
+    return True
+
+def predict_pair(json_in, KPI_data):
+    """
+    compute the forecast of a single machine/KPI pair, given the answer of the KB about it.
+    Runs in the prediction workers
+
+    Args:
+    json_in: the requested machine/KPI pair and horizon
+    KPI_data: the KB check of the pair
+
+    Returns:
+    Json_out_el: the prediction or the reason why it could not be computed
+    """
+    machine = json_in.Machine_Name
+    KPI_Name = json_in.KPI_Name
+    json_out_el = empty_json_out_el(machine, KPI_Name)
+    if KPI_data is None:
+        json_out_el.Error_message = 'Error: could not reach the knowledge base'
+        return json_out_el
+    if KPI_data['Status'] != 0:
+        json_out_el.Error_message = f'Error:, the KPI {KPI_Name} does not exist for {machine}'
+        return json_out_el
+    print('the KPI exists')
+    if KPI_data['forecastable'] != True:
+        json_out_el.Error_message = f'Error:, the KPI {KPI_Name} of {machine} is not forecastable'
+        return json_out_el
+    print('the KPI is forecastable')
+    horizon = json_in.Date_prediction
+    if horizon <= 0:
+        json_out_el.Error_message = 'Error: invalid selected date for forecast'
+        return json_out_el
+
+    status = failed_trainings.get((machine, KPI_Name), 0)
+    if status == TRAINING_ERROR and time.monotonic() >= training_retries.get((machine, KPI_Name), (0, 0))[1]:
+        # the backoff is over: the model is trained again
+        status = 0
+    if status == 0 and not f_dataprocessing.check_model_exists(machine, KPI_Name):
+        # training takes minutes: it is not done inside the request
+        schedule_training(machine, KPI_Name)
+        json_out_el.Error_message = 'Error: the model is being trained, retry later'
+        return json_out_el
+    if status != 0:
+        if status == -1:
+            json_out_el.Error_message = 'Error: the time-series is constant, forecast is meaningless'
+        elif status == TRAINING_ERROR:
+            json_out_el.Error_message = 'Error: the training of the model failed, retry later'
+        else:
+            json_out_el.Error_message = 'Error: could not preprocess the data'
+        return json_out_el
+
+    result = f_dataprocessing.make_prediction(machine, KPI_Name, horizon)
+    print(f"the output data is: {result['Predicted_value']}")
+
+    json_out_el.Predicted_value = result['Predicted_value']
+    json_out_el.Lower_bound = result['Lower_bound']
+    json_out_el.Upper_bound = result['Upper_bound']
+    json_out_el.Measure_unit = KPI_data["unit_measure"]
+    json_out_el.Confidence_score = result['Confidence_score']
+
+    Lime_exp = []
+    for exp in result['Lime_explaination']:
+        Lime_exp.append([LimeExplainationItem(date_info=item[0], value=item[1]) for item in exp])
+    json_out_el.Lime_explaination = Lime_exp
+    json_out_el.Date_prediction = result['Date_prediction']
+    return json_out_el
+
+async def check_kpis(pairs, API_key):
+    """
+    query the KB about all the machine/KPI pairs concurrently
+
+    Returns:
+    list: the KB answer for every pair, None where the KB could not be reached
+    """
+    loop = asyncio.get_running_loop()
+    checks = await asyncio.gather(
+        *[loop.run_in_executor(None, f_dataprocessing.kpi_exists, json_in.Machine_Name, json_in.KPI_Name, API_key)
+          for json_in in pairs],
+        return_exceptions=True
+    )
+    return [None if isinstance(check, Exception) else check for check in checks]
+
 @app.post("/data-processing/predict", response_model = Json_out)
-def predict(JSONS: Json_in, api_key: str = Depends(get_verify_api_key(["ai-agent","api-layer"]))): # to add or modify the services allowed to access the API, add or remove them from the list in the get_verify_api_key function e.g. get_verify_api_key(["gui", "service1", "service2"])
+async def predict(JSONS: Json_in, api_key: str = Depends(get_verify_api_key(["ai-agent","api-layer"]))): # to add or modify the services allowed to access the API, add or remove them from the list in the get_verify_api_key function e.g. get_verify_api_key(["gui", "service1", "service2"])
     """
         given a series of couple MACHINE-KPI and an integer value N, this function predicts
         the next N data points given a certain trained model. If the model does not exist yet
-        it is created, trained, and stored in json format for future use.
+        its training is started in background and the pair reports an error until it is stored.
         This function also returns explainability results to help the user understand how certain
         we are about the given prediction.
+        The KB checks of all the pairs are done in one concurrent batch and the pairs are
+        predicted in parallel by the prediction workers.
 
         Args:
         JSONS: the list of tuples to be used for prediction
@@ -151,95 +349,37 @@ def predict(JSONS: Json_in, api_key: str = Depends(get_verify_api_key(["ai-agent
     out_dicts = []
     if len(JSONS.value) != 0:
         print(f"received a list of {len(JSONS.value)} KPIs to predict")
+        dated = [json_in for json_in in JSONS.value if json_in.Date_prediction is not None]
+
+        API_key = os.getenv('my_key')
+        KPI_data = await check_kpis(dated, API_key)
+
+        loop = asyncio.get_running_loop()
+        predictions = iter(await asyncio.gather(
+            *[loop.run_in_executor(prediction_executor, predict_pair, json_in, kpi_data)
+              for json_in, kpi_data in zip(dated, KPI_data)]
+        ))
         for json_in in JSONS.value:
-            
-            machine = json_in.Machine_Name#['Machine_Name'] #direttamente valore DB
-            KPI_Name = json_in.KPI_Name#['KPI_Name']
-            json_out_el = Json_out_el(
-                Machine_Name= machine,
-                KPI_Name= KPI_Name,
-                Predicted_value=[],
-                Lower_bound=[],
-                Upper_bound=[],
-                Confidence_score=[],
-                Lime_explaination=[],
-                Measure_unit="",
-                Date_prediction=[],
-                Error_message="",
-                Forecast=True
-            )
             if json_in.Date_prediction is not None:
-
-                API_key = os.getenv('my_key')
-                KPI_data = f_dataprocessing.kpi_exists(machine,KPI_Name, API_key)
-                if KPI_data['Status'] == 0:
-                    print('the KPI exists')
-                    if KPI_data['forecastable'] == True:
-                        print('the KPI is forecastable')
-                        horizon = json_in.Date_prediction#['Date_prediction']
-                        # today = datetime.datetime.now().date()
-                        # delta = req_date - today
-                        # horizon = delta.days() 
-                        if horizon > 0:
-                            
-                            status = 0
-                            if not f_dataprocessing.check_model_exists(machine,KPI_Name):
-                                print(f"Creating model for {machine},{KPI_Name}")
-                                status = f_dataprocessing.characterize_KPI(machine,KPI_Name)
-                            if status == 0:
-                                result = f_dataprocessing.make_prediction(machine, KPI_Name, horizon)
-                                print(f"the output data is: {result['Predicted_value']}")
-
-                                json_out_el.Predicted_value = result['Predicted_value']
-                                json_out_el.Lower_bound = result['Lower_bound']
-                                json_out_el.Upper_bound = result['Upper_bound']
-                                json_out_el.Measure_unit = KPI_data["unit_measure"]
-                                json_out_el.Confidence_score = result['Confidence_score']
-
-                                Lime_exp = []
-                                for exp in result['Lime_explaination']:
-                                    Lime_exp.append([LimeExplainationItem(date_info=item[0], value=item[1]) for item in exp])
-                                json_out_el.Lime_explaination = Lime_exp
-                                json_out_el.Date_prediction = result['Date_prediction']  
-                            else:
-                                if status == -1:
-                                    json_out_el.Error_message = 'Error: the time-series is constant, forecast is meaningless'
-                                else:
-                                    json_out_el.Error_message = 'Error: could not preprocess the data'
-
-                        else:
-                            json_out_el.Error_message = 'Error: invalid selected date for forecast'
-                    else:
-                        json_out_el.Error_message = f'Error:, the KPI {KPI_Name} of {machine} is not forecastable' 
-                else:
-                    json_out_el.Error_message = f'Error:, the KPI {KPI_Name} does not exist for {machine}'
-                out_dicts.append(json_out_el)
+                out_dicts.append(next(predictions))
             else:
+                json_out_el = empty_json_out_el(json_in.Machine_Name, json_in.KPI_Name)
                 json_out_el.Error_message = f'Error:, no date received for the prediction'
+                out_dicts.append(json_out_el)
         json_out = Json_out(
         value=out_dicts
         )
-        return json_out.dict()
+        return FastJSONResponse(content=json_out.model_dump())
     else:
-        json_out_el = Json_out_el(
-        Machine_Name = "",
-        KPI_Name= "",
-        Predicted_value=[],
-        Lower_bound=[],
-        Upper_bound=[],
-        Confidence_score=[],
-        Lime_explaination=[],
-        Measure_unit="",
-        Date_prediction=[],
-        Error_message="Received input is not valid",
-        Forecast=True)
+        json_out_el = empty_json_out_el("", "")
+        json_out_el.Error_message = "Received input is not valid"
 
         out_dicts.append(json_out_el)
         
         json_out = Json_out(
         value=out_dicts
         )
-        return json_out.dict()
+        return FastJSONResponse(content=json_out.model_dump())
         
 def new_data_polling():
     """
@@ -0,0 +1,93 @@
+"""
+Measure the cold start of the data-processing service.
+
+The module given on the command line (main by default) is imported in fresh interpreters
+with -X importtime, then the script reports the wall time of the import, the peak RSS of
+the process and the modules that took the longest to load, e.g.
+
+    python startup_benchmark.py --runs 3 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_import(module):
+    """
+    Import a module in a new interpreter.
+
+    Args:
+        module (str): the module to import.
+
+    Returns:
+        tuple: the wall time in seconds, the peak RSS in MB and the -X importtime report.
+    """
+    code = (
+        "import resource, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "print(elapsed, rss)\n"
+    )
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=SERVICE_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    elapsed, rss = result.stdout.strip().splitlines()[-1].split()
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    rss_mb = int(rss) / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return float(elapsed), rss_mb, result.stderr
+
+
+def parse_importtime(report):
+    """
+    Parse the -X importtime report.
+
+    Args:
+        report (str): the stderr of an interpreter started with -X importtime.
+
+    Returns:
+        dict: module name -> (self time, cumulative time), in microseconds.
+    """
+    times = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=3, help="number of cold imports to time")
+    parser.add_argument("--top", type=int, default=20, help="number of slowest modules to list")
+    args = parser.parse_args()
+
+    walls, rsss = [], []
+    for _ in range(args.runs):
+        elapsed, rss_mb, report = run_import(args.module)
+        walls.append(elapsed)
+        rsss.append(rss_mb)
+
+    times = parse_importtime(report)
+    top_level = {name: t for name, t in times.items() if "." not in name}
+
+    print(f"import {args.module}: {statistics.median(walls):.2f} s wall (median of {args.runs}), "
+          f"{max(rsss):.0f} MB peak RSS, {len(times)} modules loaded")
+    print(f"\n{'cumulative [ms]':>16} {'self [ms]':>10}  package")
+    for name, (self_us, cumulative_us) in sorted(top_level.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:16.1f} {self_us / 1000:10.1f}  {name}")
+
+    heavy = [name for name in ("torch", "aix360", "lime", "statsmodels", "sklearn", "matplotlib") if name in times]
+    print(f"\nheavy libraries loaded at startup: {', '.join(heavy) if heavy else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ from .postgres_client import get_postgres_connection
 import io
 import json
 
+from instrumentation import timed_upstream
+
 # Insert a JSON model into the bucket
 def insert_model_to_storage(bucket_name, file_name, json_data, kpi, machine_name):
     client = get_minio_client()
@@ -12,13 +14,14 @@ def insert_model_to_storage(bucket_name, file_name, json_data, kpi, machine_name
         json_bytes = json.dumps(json_data).encode('utf-8')
         
         # Upload JSON data
-        client.put_object(
-            bucket_name,
-            file_name,
-            data=io.BytesIO(json_bytes),
-            length=len(json_bytes),
-            content_type="application/json"
-        )
+        with timed_upstream("minio"):
+            client.put_object(
+                bucket_name,
+                file_name,
+                data=io.BytesIO(json_bytes),
+                length=len(json_bytes),
+                content_type="application/json"
+            )
         print(f"File '{file_name}' uploaded to bucket '{bucket_name}'.")
 
         # Insert record into PostgreSQL
@@ -66,8 +69,9 @@ def retrieve_model_from_storage(kpi, machine_name):
 
         # Retrieve JSON object from MinIO
         client = get_minio_client()
-        response = client.get_object(bucket_name, file_name)
-        json_data = json.load(response)
+        with timed_upstream("minio"):
+            response = client.get_object(bucket_name, file_name)
+            json_data = json.load(response)
         response.close()
         response.release_conn()
         print(f"JSON data retrieved for KPI: {kpi} and MachineName: {machine_name}")
@@ -101,8 +105,9 @@ def retrieve_all_models_from_storage():
 
             try:
                 # Retrieve JSON object from MinIO
-                response = client.get_object(bucket_name, file_name)
-                json_data = json.load(response)
+                with timed_upstream("minio"):
+                    response = client.get_object(bucket_name, file_name)
+                    json_data = json.load(response)
                 response.close()
                 response.release_conn()
 
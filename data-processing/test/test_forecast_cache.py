@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import xgboost as xgb
+import f_dataprocessing
+from forecast_cache import ForecastCache, model_version
+
+
+def make_result(horizon):
+    return {
+        'Predicted_value': [float(i) for i in range(horizon)],
+        'Lower_bound': [i - 1.0 for i in range(horizon)],
+        'Upper_bound': [i + 1.0 for i in range(horizon)],
+        'Confidence_score': [0.95] * horizon,
+        'Lime_explaination': [[('2024-10-10', 0.1)]] * horizon,
+        'Date_prediction': [f'2024-10-{i + 11}' for i in range(horizon)]
+    }
+
+
+class TestForecastCache(unittest.TestCase):
+
+    def test_hit_same_horizon(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+
+        # Assertions
+        self.assertEqual(cache.get('Machine1', 'power', 10, 'v1', '2024-10-10'), make_result(10))
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_other_horizon_missed(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+
+        # Assertions
+        self.assertIsNone(cache.get('Machine1', 'power', 3, 'v1', '2024-10-10'))
+        self.assertIsNone(cache.get('Machine1', 'power', 12, 'v1', '2024-10-10'))
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    @patch('XAI_forecasting.ForecastExplainer.explain_prediction', return_value=[])
+    def test_shorter_forecast_not_a_prefix(self, mock_explain):
+        window = f_dataprocessing.observation_window
+        data = np.sin(np.arange(120) / 4) + np.arange(120) / 50
+        X = np.array([data[i:i + window] for i in range(100)])
+        model = xgb.XGBRegressor(n_estimators=20, max_depth=3).fit(X, data[window:window + 100])
+        last_date = '2024-10-10T00:00:00.000Z'
+
+        forecast_3 = f_dataprocessing.XAI_PRED(data, last_date, model, len(data), window, 3)
+        forecast_10 = f_dataprocessing.XAI_PRED(data, last_date, model, len(data), window, 10)
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', last_date, forecast_10)
+
+        # Assertions
+        # the input window of the forecast depends on the horizon, slicing the longer one would be wrong
+        self.assertNotEqual(forecast_10['Predicted_value'][:3], forecast_3['Predicted_value'])
+        self.assertIsNone(cache.get('Machine1', 'power', 3, 'v1', last_date))
+
+    def test_cached_result_is_a_copy(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+
+        cache.get('Machine1', 'power', 10, 'v1', '2024-10-10')['Predicted_value'].append(99.0)
+
+        # Assertions
+        self.assertEqual(cache.get('Machine1', 'power', 10, 'v1', '2024-10-10'), make_result(10))
+
+    def test_new_version_invalidates(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+
+        # Assertions
+        self.assertIsNone(cache.get('Machine1', 'power', 10, 'v2', '2024-10-10'))
+        self.assertIsNone(cache.get('Machine1', 'power', 10, 'v1', '2024-10-10'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_new_watermark_invalidates(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+
+        # Assertions
+        self.assertIsNone(cache.get('Machine1', 'power', 10, 'v1', '2024-10-11'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_invalidate_every_horizon(self):
+        cache = ForecastCache()
+        cache.put('Machine1', 'power', 3, 'v1', '2024-10-10', make_result(3))
+        cache.put('Machine1', 'power', 10, 'v1', '2024-10-10', make_result(10))
+        cache.put('Machine2', 'power', 3, 'v1', '2024-10-10', make_result(3))
+
+        cache.invalidate('Machine1', 'power')
+
+        # Assertions
+        self.assertEqual(cache.stats()['size'], 1)
+        self.assertEqual(cache.stats()['invalidations'], 2)
+
+    def test_least_recently_used_evicted(self):
+        cache = ForecastCache(max_entries=2)
+        cache.put('Machine1', 'power', 5, 'v1', '2024-10-10', make_result(5))
+        cache.put('Machine2', 'power', 5, 'v1', '2024-10-10', make_result(5))
+        cache.get('Machine1', 'power', 5, 'v1', '2024-10-10')
+        cache.put('Machine3', 'power', 5, 'v1', '2024-10-10', make_result(5))
+
+        # Assertions
+        self.assertIsNotNone(cache.get('Machine1', 'power', 5, 'v1', '2024-10-10'))
+        self.assertIsNone(cache.get('Machine2', 'power', 5, 'v1', '2024-10-10'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_model_version(self):
+        # Assertions
+        self.assertEqual(model_version({'model': {'metadata': {'version': 'v7'}}}), 'v7')
+        self.assertEqual(model_version({'model': {'xgb_bytes': 'abc'}}), model_version({'model': {'xgb_bytes': 'abc'}}))
+        self.assertNotEqual(model_version({'model': {'xgb_bytes': 'abc'}}), model_version({'model': {'xgb_bytes': 'abd'}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
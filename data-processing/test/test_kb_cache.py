@@ -0,0 +1,98 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import f_dataprocessing
+from kb_cache import KBCache
+
+MACHINE_KPIS = {
+    'machines': {'large_capacity_cutting_machine_1': {'power': {'unit_measure': 'kW', 'forecastable': True}}},
+    'version': 'v1'
+}
+
+
+class TestKBCache(unittest.TestCase):
+
+    def test_lookup_from_map(self):
+        cache = KBCache(ttl=60)
+
+        with patch.object(cache, '_get', return_value=MACHINE_KPIS) as mock_get:
+            found = cache.lookup('Large Capacity Cutting Machine 1', 'power', 'key')
+            missing = cache.lookup('Large Capacity Cutting Machine 1', 'cost', 'key')
+
+        # Assertions
+        self.assertEqual(found, {'Status': 0, 'machine_id': 'Large Capacity Cutting Machine 1', 'kpi_id': 'power',
+                                 'unit_measure': 'kW', 'forecastable': True})
+        self.assertIsNone(missing)
+        mock_get.assert_called_once_with('machineKPIs', 'key')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_reload_on_new_version(self):
+        cache = KBCache(ttl=0)
+
+        with patch.object(cache, '_get', side_effect=[MACHINE_KPIS, {'version': 'v1'}, {'version': 'v2'},
+                                                       {**MACHINE_KPIS, 'version': 'v2'}]) as mock_get:
+            for _ in range(3):
+                cache.lookup('large_capacity_cutting_machine_1', 'power', 'key')
+
+        # Assertions
+        self.assertEqual([call.args[0] for call in mock_get.call_args_list],
+                         ['machineKPIs', 'version', 'version', 'machineKPIs'])
+        self.assertEqual(cache.stats()['version'], 'v2')
+        self.assertEqual(cache.stats()['reloads'], 2)
+
+    def test_old_map_kept_on_failure(self):
+        cache = KBCache(ttl=60)
+
+        with patch.object(cache, '_get', side_effect=[MACHINE_KPIS, ConnectionError('kb unreachable')]):
+            cache.lookup('large_capacity_cutting_machine_1', 'power', 'key')
+            version = cache.refresh('key')
+            found = cache.lookup('large_capacity_cutting_machine_1', 'power', 'key')
+
+        # Assertions
+        self.assertEqual(version, 'v1')
+        self.assertIsNotNone(found)
+
+
+@patch('f_dataprocessing.kb_cache')
+@patch('f_dataprocessing.requests.get')
+class TestKpiExists(unittest.TestCase):
+
+    def test_cached_pair_not_requested(self, mock_get, mock_cache):
+        mock_cache.lookup.return_value = {'Status': 0}
+
+        result = f_dataprocessing.kpi_exists('Machine 1', 'power', 'key')
+
+        # Assertions
+        self.assertEqual(result, {'Status': 0})
+        mock_get.assert_not_called()
+        mock_cache.refresh.assert_not_called()
+
+    def test_new_pair_refreshes_cache(self, mock_get, mock_cache):
+        mock_cache.lookup.return_value = None
+        mock_get.return_value = MagicMock(json=MagicMock(return_value={'Status': 0, 'forecastable': True}))
+
+        result = f_dataprocessing.kpi_exists('Machine 1', 'power', 'key')
+
+        # Assertions
+        self.assertEqual(result['Status'], 0)
+        self.assertIn('/kb/Machine_1/power/check', mock_get.call_args[0][0])
+        mock_cache.refresh.assert_called_once_with('key')
+
+    def test_missing_pair_does_not_refresh(self, mock_get, mock_cache):
+        mock_cache.lookup.return_value = None
+        mock_get.return_value = MagicMock(json=MagicMock(return_value={'Status': -1}))
+
+        result = f_dataprocessing.kpi_exists('Machine 1', 'cost', 'key')
+
+        # Assertions
+        self.assertEqual(result['Status'], -1)
+        mock_cache.refresh.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import f_dataprocessing
+from f_dataprocessing import residual_quantiles
+
+XGB_PARAMS = {'objective': 'reg:squarederror', 'max_depth': 2, 'eta': 0.3}
+
+
+def make_series(n_samples, seq_length=5):
+    rng = np.random.default_rng(0)
+    data = np.sin(np.arange(n_samples + seq_length) / 5) + rng.normal(0, 0.1, n_samples + seq_length)
+    X = np.array([data[i:i + seq_length] for i in range(n_samples)])
+    return X, data[seq_length:]
+
+
+class TestResidualQuantiles(unittest.TestCase):
+
+    def test_out_of_fold(self):
+        X, y = make_series(41)
+        trained_on = []
+        train = f_dataprocessing.xgb.train
+
+        def recording_train(params, dtrain, num_boost_round):
+            trained_on.append(dtrain.num_row())
+            return train(params=params, dtrain=dtrain, num_boost_round=num_boost_round)
+
+        with patch('f_dataprocessing.xgb.train', side_effect=recording_train):
+            calibration = residual_quantiles(X, y, XGB_PARAMS, 5, n_splits=3)
+
+        # Assertions
+        # every block is predicted by a model fitted on the blocks before it only, the last one takes the rest
+        self.assertEqual(trained_on, [10, 20, 30])
+        self.assertEqual(calibration['n_residuals'], 31)
+
+    def test_quantiles_per_confidence(self):
+        X, y = make_series(80)
+
+        calibration = residual_quantiles(X, y, XGB_PARAMS, 10, confidences=(0.8, 0.95))
+
+        # Assertions
+        self.assertEqual(set(calibration['quantiles']), {'0.8', '0.95'})
+        lower_80, upper_80 = calibration['quantiles']['0.8']
+        lower_95, upper_95 = calibration['quantiles']['0.95']
+        self.assertLessEqual(lower_95, lower_80)
+        self.assertLess(lower_80, upper_80)
+        self.assertLessEqual(upper_80, upper_95)
+        self.assertGreater(calibration['std'], 0)
+
+    def test_not_enough_samples(self):
+        X, y = make_series(7)
+
+        # Assertions
+        self.assertIsNone(residual_quantiles(X, y, XGB_PARAMS, 5, n_splits=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
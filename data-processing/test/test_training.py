@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import main
+from model import Json_in_el
+
+KEY = ('Machine1', 'power')
+KPI_DATA = {'Status': 0, 'machine_id': 'Machine1', 'kpi_id': 'power', 'unit_measure': 'kW', 'forecastable': True}
+
+
+def run_now(job):
+    # the background training is run synchronously
+    job()
+
+
+@patch('main.training_executor', MagicMock(submit=run_now))
+class TestScheduleTraining(unittest.TestCase):
+
+    def setUp(self):
+        main.failed_trainings.clear()
+        main.training_retries.clear()
+        main.pending_trainings.clear()
+
+    @patch('main.f_dataprocessing.characterize_KPI', side_effect=RuntimeError('storage unreachable'))
+    def test_failure_recorded_with_backoff(self, mock_characterize):
+        with patch('main.time.monotonic', return_value=1000.0):
+            main.schedule_training(*KEY)
+            first = main.training_retries[KEY]
+            main.schedule_training(*KEY)
+            second = main.training_retries[KEY]
+
+        # Assertions
+        self.assertEqual(main.failed_trainings[KEY], main.TRAINING_ERROR)
+        self.assertEqual(first, (1, 1000.0 + main.TRAINING_BACKOFF))
+        self.assertEqual(second, (2, 1000.0 + 2 * main.TRAINING_BACKOFF))
+        self.assertEqual(main.pending_trainings, set())
+
+    @patch('main.f_dataprocessing.characterize_KPI', side_effect=RuntimeError('storage unreachable'))
+    def test_backoff_capped(self, mock_characterize):
+        main.training_retries[KEY] = (20, 0.0)
+
+        with patch('main.time.monotonic', return_value=1000.0):
+            main.schedule_training(*KEY)
+
+        # Assertions
+        self.assertEqual(main.training_retries[KEY], (21, 1000.0 + main.TRAINING_BACKOFF_MAX))
+
+    @patch('main.f_dataprocessing.characterize_KPI', return_value=0)
+    def test_success_clears_failure(self, mock_characterize):
+        main.failed_trainings[KEY] = main.TRAINING_ERROR
+        main.training_retries[KEY] = (3, 0.0)
+
+        main.schedule_training(*KEY)
+
+        # Assertions
+        self.assertNotIn(KEY, main.failed_trainings)
+        self.assertNotIn(KEY, main.training_retries)
+
+    @patch('main.f_dataprocessing.characterize_KPI', return_value=-1)
+    def test_constant_series_recorded(self, mock_characterize):
+        main.schedule_training(*KEY)
+
+        # Assertions
+        self.assertEqual(main.failed_trainings[KEY], -1)
+        self.assertNotIn(KEY, main.training_retries)
+
+    @patch('main.f_dataprocessing.check_model_exists', return_value=False)
+    @patch('main.schedule_training')
+    def test_prediction_waits_for_backoff(self, mock_schedule, mock_exists):
+        json_in = Json_in_el(Machine_Name='Machine1', KPI_Name='power', Date_prediction=5)
+        main.failed_trainings[KEY] = main.TRAINING_ERROR
+        main.training_retries[KEY] = (1, 1060.0)
+
+        with patch('main.time.monotonic', return_value=1000.0):
+            waiting = main.predict_pair(json_in, KPI_DATA)
+        with patch('main.time.monotonic', return_value=1060.0):
+            retried = main.predict_pair(json_in, KPI_DATA)
+
+        # Assertions
+        self.assertEqual(waiting.Error_message, 'Error: the training of the model failed, retry later')
+        self.assertEqual(retried.Error_message, 'Error: the model is being trained, retry later')
+        mock_schedule.assert_called_once_with(*KEY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -71,12 +71,29 @@ if __name__ == "__main__":
             Role VARCHAR(255) NOT NULL,
             Password VARCHAR(255) NOT NULL,
             SiteName VARCHAR(255) NOT NULL,
-            UserSettings TEXT,
-            UserDashboards TEXT,
+            UserSettings JSONB,
+            UserDashboards JSONB,
             UserSchedules TEXT
             )
             """,
             """
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_name = 'users' AND column_name = 'usersettings' AND data_type = 'text') THEN
+                    ALTER TABLE Users
+                    ALTER COLUMN UserSettings TYPE JSONB USING UserSettings::jsonb,
+                    ALTER COLUMN UserDashboards TYPE JSONB USING UserDashboards::jsonb;
+                END IF;
+            END $$
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS Users_Username ON Users (Username)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS Users_Email ON Users (Email)
+            """,
+            """
             CREATE TABLE IF NOT EXISTS Reports (
             ReportID SERIAL PRIMARY KEY,
             Name VARCHAR(100) NOT NULL,
@@ -113,6 +130,9 @@ if __name__ == "__main__":
             )
             """,
             """
+            CREATE INDEX IF NOT EXISTS AlertRecipients_UserID_Read ON AlertRecipients (UserID, Read, AlertID)
+            """,
+            """
             CREATE TABLE IF NOT EXISTS Models (
             ID SERIAL PRIMARY KEY,
             KPI VARCHAR(50) NOT NULL,
@@ -125,6 +145,38 @@ if __name__ == "__main__":
             ServiceID VARCHAR(20) PRIMARY KEY,
             Key VARCHAR(50) NOT NULL
             )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ReportSchedules (
+            ScheduleID SERIAL PRIMARY KEY,
+            UserID INT NOT NULL,
+            Name VARCHAR(255) NOT NULL,
+            Params JSONB NOT NULL,
+            NextRun TIMESTAMP NOT NULL,
+            IntervalSeconds INT NOT NULL CHECK (IntervalSeconds > 0),
+            LeasedUntil TIMESTAMP,
+            LastRun TIMESTAMP,
+            LastError TEXT,
+            UNIQUE(UserID, Name),
+            FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ReportSchedules_NextRun ON ReportSchedules (NextRun)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ReportJobs (
+            JobID SERIAL PRIMARY KEY,
+            UserID INT NOT NULL,
+            Status VARCHAR(10) NOT NULL DEFAULT 'queued'
+            CHECK (Status IN ('queued', 'running', 'done', 'failed')),
+            ReportID INT,
+            Error TEXT,
+            CreatedAt TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            UpdatedAt TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE CASCADE,
+            FOREIGN KEY (ReportID) REFERENCES Reports(ReportID) ON DELETE SET NULL
+            )
             """
         ]
 
@@ -135,6 +187,32 @@ if __name__ == "__main__":
 
         print("Tables created successfully")
 
+        # Notify the services caching the API keys (api_auth.ApiKeyCache) whenever the Microservices table changes
+        notify_queries = [
+            """
+            CREATE OR REPLACE FUNCTION notify_microservices_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('microservices_changed', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            DROP TRIGGER IF EXISTS microservices_changed ON Microservices
+            """,
+            """
+            CREATE TRIGGER microservices_changed
+            AFTER INSERT OR UPDATE OR DELETE ON Microservices
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_microservices_changed()
+            """
+        ]
+
+        for query in notify_queries:
+            cur.execute(query)
+            conn.commit()
+
+        print("Microservices change notification created successfully")
+
         # Insert dummy data into the Microservices table
 
         demo_api_keys_query = """
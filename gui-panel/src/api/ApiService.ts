@@ -433,13 +433,19 @@ export const getUserSettings = async (userId: string): Promise<UserSettings> =>
 /**
  * API GET used to get alerts
  * @param userId string - The user ID
- * @returns Promise will return the alerts [key: string]: string | number | boolean
+ * @param sinceId number - Only the alerts after this one are returned, the nextSinceId of the previous page
+ * @returns Promise will return a page of alerts, the cursor of the next page and whether more alerts follow
  */
-export const getAlerts = async (userId: string): Promise<Alert[]> => {
+export const getAlerts = async (userId: string, sinceId?: number): Promise<{
+    alerts: Alert[];
+    nextSinceId: number | null;
+    hasMore: boolean;
+}> => {
     try {
-        const response = await axios.get<{ alerts: Alert[] }>(
+        const response = await axios.get<{ alerts: Alert[], nextSinceId: number | null, hasMore: boolean }>(
             `${BASE_URL}/smartfactory/alerts/${userId}`,
             {
+                params: sinceId !== undefined ? {since_id: sinceId} : {},
                 headers: {
                     "Content-Type": "application/json",
                     "x-api-key": API_KEY,
@@ -447,13 +453,70 @@ export const getAlerts = async (userId: string): Promise<Alert[]> => {
             }
         );
         console.log('Get Alerts API response:', response.data);
-        return response.data.alerts;
+        return response.data;
     } catch (error: any) {
         console.error('Get Alerts API error:', error);
         throw new Error(error.response?.data?.message || 'Failed to retrieve alerts');
     }
 };
 
+/**
+ * API GET used to count the unread alerts
+ * @param userId string - The user ID
+ * @returns Promise will return the number of unread alerts
+ */
+export const getUnreadAlertsCount = async (userId: string): Promise<number> => {
+    try {
+        const response = await axios.get<{ unread: number }>(
+            `${BASE_URL}/smartfactory/alerts/${userId}/unread`,
+            {
+                headers: {
+                    "Content-Type": "application/json",
+                    "x-api-key": API_KEY,
+                },
+            }
+        );
+        return response.data.unread;
+    } catch (error: any) {
+        console.error('Get Unread Alerts API error:', error);
+        throw new Error(error.response?.data?.message || 'Failed to count alerts');
+    }
+};
+
+/**
+ * API GET used to receive the alerts of a user as soon as they are saved (Server-Sent Events)
+ * @param userId string - The user ID
+ * @param onAlert (alert: Alert) => void - Called for every new alert
+ * @param signal AbortSignal - Aborting it closes the stream
+ * @returns Promise resolved when the stream ends
+ */
+export const streamAlerts = async (userId: string, onAlert: (alert: Alert) => void, signal: AbortSignal): Promise<void> => {
+    // EventSource can not send the API key header, so the stream is read with fetch
+    const response = await fetch(`${BASE_URL}/smartfactory/alerts/${userId}/stream`, {
+        headers: {"x-api-key": API_KEY},
+        signal,
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Alert stream failed: ${response.status}`);
+    }
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) return;
+        buffer += value;
+        let end;
+        while ((end = buffer.indexOf("\n\n")) >= 0) {
+            const event = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const data = event.split("\n").find((line) => line.startsWith("data: "));
+            if (event.startsWith("event: alert") && data) {
+                onAlert(JSON.parse(data.slice(6)));
+            }
+        }
+    }
+};
+
 /**
  * API POST used to take the response of the AI
  * @param userId string - The user ID
@@ -631,10 +694,10 @@ export const retrieveDashboardSettings = async (userId: string): Promise<Dashboa
 
 export const instantReport = async (userId: string, params: ReportParams): Promise<string> => {
     try {
-        const response = await axios.post(
+        const response = await axios.post<{ jobId: number }>(
             `${BASE_URL}/smartfactory/reports/generate`,
             {
-                user_id: userId,
+                userId: userId,
                 params: params
             },
             {
@@ -644,7 +707,25 @@ export const instantReport = async (userId: string, params: ReportParams): Promi
                 },
             }
         );
-        return response.data;
+        // the report is generated in the background, wait for the job to complete
+        while (true) {
+            const job = await axios.get<{ status: string, reportId: number, error: string }>(
+                `${BASE_URL}/smartfactory/reports/jobs/${response.data.jobId}?wait=25`,
+                {
+                    headers: {
+                        "x-api-key": API_KEY,
+                    },
+                }
+            );
+            if (job.data.status === "done") {
+                return String(job.data.reportId);
+            }
+            if (job.data.status === "failed") {
+                throw new Error(job.data.error || 'Failed to create instant report');
+            }
+            // the wait is honoured only by the API process running the job, do not poll in a tight loop
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
     } catch (error: any) {
         console.error('Instant Report API error:', error);
         throw new Error(error.response?.data?.message || 'Failed to create instant report');
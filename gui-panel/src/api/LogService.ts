@@ -1,5 +1,5 @@
 import {mockLogData} from './mockData/mockDataLog';
-import {getAlerts} from "./ApiService";
+import {Alert, getAlerts} from "./ApiService";
 import DataManager from "./DataManager";
 
 export interface LogItem {
@@ -17,16 +17,32 @@ export const fetchLogs = (): LogItem[] => {
     return logs;
 };
 
+// ID of the last alert fetched for lastAlertUser, the next fetch only returns newer alerts
+let lastAlertId: number | undefined = undefined;
+let lastAlertUser: string | undefined = undefined;
+
 export const fetchAlerts = async (userId: string) => {
     await DataManager.getInstance().waitUntilInitialized();
     console.log("Fetching alerts...");
-    return getAlerts(userId).then((response) => {
-        console.log("Alerts fetched: ", response);
-        return response;
-    }).catch((error) => {
+    if (userId !== lastAlertUser) {
+        lastAlertId = undefined;
+        lastAlertUser = userId;
+    }
+    try {
+        const alerts: Alert[] = [];
+        let hasMore = true;
+        while (hasMore) {
+            const page = await getAlerts(userId, lastAlertId);
+            alerts.push(...page.alerts);
+            lastAlertId = page.nextSinceId ?? lastAlertId;
+            hasMore = page.hasMore;
+        }
+        console.log("Alerts fetched: ", alerts);
+        return alerts;
+    } catch (error) {
         console.log("Error fetching alerts: ", error);
         return [];
-    });
+    }
 };
 
 // Mark a log as read
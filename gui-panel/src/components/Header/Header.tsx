@@ -1,6 +1,6 @@
 import React, {useEffect, useState} from 'react';
 import {Link} from "react-router-dom";
-import {Alert, logout} from '../../api/ApiService';
+import {Alert, logout, streamAlerts} from '../../api/ApiService';
 import dataManager from "../../api/DataManager";
 import {fetchAlerts} from "../../api/LogService";
 
@@ -30,11 +30,26 @@ const Header: React.FC<HeaderProps> = ({path, userAvatar, userName, userId, role
         // Fetch alerts on mount
         if (userId) fetchAlerts(userId);
 
-        // Fetch alerts every x minutes (e.g., 5 minutes)
+        // New alerts are pushed by the API, the stream is reopened if it drops
+        const controller = new AbortController();
+        const listen = () => {
+            if (!userId || controller.signal.aborted) return;
+            streamAlerts(userId, () => fetchAlerts(userId), controller.signal)
+                .catch((error) => console.log("Alert stream error: ", error))
+                .finally(() => {
+                    if (!controller.signal.aborted) setTimeout(listen, 5000);
+                });
+        };
+        listen();
+
+        // Fetch alerts every x minutes (e.g., 5 minutes), in case some were missed while disconnected
         const interval = setInterval(() => {
             fetchAlerts(userId);
         }, 5 * 60 * 1000); // 5 minutes
-        return () => clearInterval(interval); // Cleanup interval on unmount
+        return () => {
+            clearInterval(interval); // Cleanup interval on unmount
+            controller.abort(); // Close the alert stream
+        };
     }, [userId]);
 
     // Function to determine color based on severity
@@ -1,6 +1,10 @@
+import hmac
 import json
 import logging
 import re
+import select
+import threading
+import time
 from dotenv import load_dotenv
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from fastapi import Depends, status, HTTPException
@@ -22,6 +26,12 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/smartfactory/login")
 # Use it for API key authentication
 api_key_header = APIKeyHeader(name="X-API-Key")
 
+# The Microservices table is kept in memory: it is read again every API_KEYS_TTL seconds and,
+# if API_KEYS_LISTEN is true, as soon as Postgres notifies a change on API_KEYS_CHANNEL
+API_KEYS_TTL = float(os.getenv('API_KEYS_TTL', '300'))
+API_KEYS_LISTEN = os.getenv('API_KEYS_LISTEN', 'false').lower() == 'true'
+API_KEYS_CHANNEL = 'microservices_changed'
+
 def connect_db():
     """
     Establishes a connection to the PostgreSQL database using credentials from environment variables.
@@ -47,14 +57,121 @@ def connect_db():
         print(f"Error connecting to PostgreSQL database: {error}")
         return None, None
 
+class ApiKeyCache:
+    """
+    In-memory copy of the Microservices table, used to verify the API keys without querying the database.
+
+    Attributes:
+        ttl (float): Seconds after which the table is read again from the database.
+        listen (bool): Whether to start a thread that invalidates the cache on Postgres notifications.
+    """
+
+    def __init__(self, ttl: float, listen: bool = False):
+        self.ttl = ttl
+        self.listen = listen
+        self._keys = None
+        self._loaded_at = None
+        self._listener = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the table has been read from the database at least once."""
+        return self._keys is not None
+
+    def _load(self):
+        connection, cursor = connect_db()
+        if connection is None or cursor is None:
+            logging.error("Database connection failed")
+            return None
+        try:
+            cursor.execute("SELECT ServiceID, KEY FROM Microservices")
+            return {service_id: key for service_id, key in cursor.fetchall()}
+        except Exception as e:
+            logging.error("Database query failed: %s", str(e))
+            return None
+        finally:
+            cursor.close()
+            connection.close()
+
+    def get(self, microservice_id: str):
+        """
+        Return the API key of a microservice, reading the table again if it is older than the ttl.
+
+        If the table cannot be read, the keys loaded previously are kept.
+
+        Args:
+            microservice_id (str): The unique identifier of the microservice.
+
+        Returns:
+            str or None: The API key if found, otherwise None.
+        """
+        with self._lock:
+            if self.listen and self._listener is None:
+                self._listener = start_api_keys_listener(self)
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                keys = self._load()
+                if keys is not None:
+                    self._keys = keys
+                    self._loaded_at = time.monotonic()
+            return self._keys.get(microservice_id) if self._keys is not None else None
+
+    def invalidate(self):
+        """Read the table again at the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+
+
+def start_api_keys_listener(cache: ApiKeyCache):
+    """
+    Start a daemon thread that invalidates the cache whenever the Microservices table changes.
+
+    The thread LISTENs on API_KEYS_CHANNEL, notified by the trigger created in create_db_tables.py,
+    and reconnects if the connection is lost.
+
+    Args:
+        cache (ApiKeyCache): The cache to invalidate.
+
+    Returns:
+        threading.Thread: The listener thread.
+    """
+    def listen():
+        while True:
+            connection, cursor = connect_db()
+            if connection is not None and cursor is not None:
+                try:
+                    connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                    cursor.execute(f"LISTEN {API_KEYS_CHANNEL}")
+                    cache.invalidate() # changes may have been missed while disconnected
+                    while True:
+                        if select.select([connection], [], [], 60) == ([], [], []):
+                            continue
+                        connection.poll()
+                        if connection.notifies:
+                            connection.notifies.clear()
+                            cache.invalidate()
+                except Exception as e:
+                    logging.error("API keys listener failed: %s", str(e))
+                finally:
+                    cursor.close()
+                    connection.close()
+            time.sleep(10)
+
+    thread = threading.Thread(target=listen, name="api-keys-listener", daemon=True)
+    thread.start()
+    return thread
+
+
+api_key_cache = ApiKeyCache(API_KEYS_TTL, API_KEYS_LISTEN)
+
 def retrieve_keys(microservice_id: str):
     """
     Retrieve the API key for the specified microservice from the database.
 
-    This function connects to the database, executes a query to fetch the API key
-    associated with the given microservice ID, and returns the key if found. If the 
-    database connection fails or the query encounters an error, appropriate error 
-    messages are logged.
+    The key is read from the in-memory copy of the Microservices table (api_key_cache),
+    which is refreshed from the database every API_KEYS_TTL seconds. If the database
+    connection fails or the query encounters an error, appropriate error messages are
+    logged.
 
     Args:
         microservice_id (str): The unique identifier of the microservice whose API key 
@@ -69,26 +186,8 @@ def retrieve_keys(microservice_id: str):
                    logged but not raised. The function will return None in such cases.
     """
 
-    # Retrieve the API key for the specified microservice from the database
-    connection, cursor = connect_db()
-    if connection is None or cursor is None:
-        logging.error("Database connection failed")
-        return None #json.load(open(API_KEYS_FILE_PATH, 'r'))['microservice'][microservice_id]    
-    try:
-        query = "SELECT KEY FROM Microservices WHERE ServiceID = %s"
-        cursor.execute(query, (microservice_id,))
-        row = cursor.fetchone()
-        if row:
-            result = row[0]
-        else:
-            result = None
-    except Exception as e:
-        logging.error("Database query failed: %s", str(e))
-        #result = json.load(open(API_KEYS_FILE_PATH, 'r'))['microservice'][microservice_id]
-    finally:
-        cursor.close()
-        connection.close()
-    return result
+    # Retrieve the API key for the specified microservice from the cached Microservices table
+    return api_key_cache.get(microservice_id)
     
 def get_verify_api_key(microservice_ids: list):
     """
@@ -104,8 +203,13 @@ def get_verify_api_key(microservice_ids: list):
         HTTPException: If the provided API key is not found in the list of valid API keys, an HTTP 401 Unauthorized exception is raised.
     """
     async def verify_api_key(api_key: str = Depends(api_key_header)):
-        matched_keys = [retrieve_keys(microservice_id) for microservice_id in microservice_ids]
-        if api_key not in matched_keys:
+        # every allowed key is compared in constant time, so the response time does not leak which prefix matched
+        valid = False
+        for microservice_id in microservice_ids:
+            key = retrieve_keys(microservice_id)
+            if key is not None and hmac.compare_digest(key.encode(), api_key.encode()):
+                valid = True
+        if not valid:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
     return verify_api_key
 
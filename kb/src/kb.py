@@ -11,11 +11,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, Depends
 import json
 from api_auth.api_auth import get_verify_api_key
+from instrumentation import instrument
+from response_layer import CompressionMiddleware, FastJSONResponse
 from pydantic import BaseModel
 import shutil
+import time
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,9 +27,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+instrument(app)
 
 ONTOLOGY_PATH = "./storage/sa_ontology.rdf"
 onto = None
+# Changes every time the ontology is modified, the startup time makes it unique across restarts
+ontology_version = f"{int(time.time())}-0"
 
 
 def get_kpi(kpi_id):
@@ -406,6 +414,38 @@ def is_pair_machine_kpi_exist(machine_id, kpi_id):
         json_d["forecastable"] = kpi_tmp["forecastable"]
 
     return json_d
+
+
+def get_machine_kpi_map():
+    """
+    Retrieve, for every machine, the KPIs it produces with their unit of measure and forecastability.
+
+    The map is meant to be cached by the other services, which use the version to know when to reload it.
+
+    Globals:
+        onto (Ontology): The global ontology object is used to extract machines and KPIs.
+        ontology_version (str): The current version of the ontology.
+
+    Returns:
+        dict: The version of the ontology and the map {machine: {kpi: {"unit_measure", "forecastable"}}},
+            machines are identified by the name of their IRI.
+    """
+
+    kpis = {}
+    machines = {}
+    for machine in onto.Machine.instances():
+        produced = {}
+        for kpi in machine.producesKPI:
+            if kpi.name not in kpis:
+                kpi_data = extract_datatype_properties(kpi)
+                kpis[kpi.name] = {
+                    "unit_measure": kpi_data.get("unit_measure"),
+                    "forecastable": kpi_data.get("forecastable"),
+                }
+            produced[kpi.name] = kpis[kpi.name]
+        machines[machine.name] = produced
+
+    return {"version": ontology_version, "machines": machines}
     
 
 def is_valid(kpi_info):
@@ -533,8 +573,10 @@ def add_kpi(kpi_info):
         with open(ONTOLOGY_PATH, "w") as f:
             f.write(updated_ontology_content)
 
-        global onto
+        global onto, ontology_version
         onto = get_ontology(ONTOLOGY_PATH).load(reload=True) # Reload the ontology
+        start, count = ontology_version.split("-")
+        ontology_version = f"{start}-{int(count) + 1}"
     except Exception as error:
         print(error)
         return False
@@ -604,6 +646,30 @@ async def is_pair_machine_kpi_exist_endpoint(machine_id: str, kpi_id: str, api_k
     return pair_status
 
 
+@app.get("/kb/machineKPIs")
+async def get_machine_kpi_map_endpoint(api_key: str = Depends(get_verify_api_key(["data"]))): # to add or modify the services allowed to access the API, add or remove them from the list in the get_verify_api_key function e.g. get_verify_api_key(["gui", "service1", "service2"])
+    """
+    Get all the machine/KPI pairs in a single request, to be cached by the caller.
+
+    Returns:
+        dict: The version of the ontology and the KPIs produced by every machine.
+    """
+
+    return get_machine_kpi_map()
+
+
+@app.get("/kb/version")
+async def get_version_endpoint(api_key: str = Depends(get_verify_api_key(["data", "api-layer"]))): # to add or modify the services allowed to access the API, add or remove them from the list in the get_verify_api_key function e.g. get_verify_api_key(["gui", "service1", "service2"])
+    """
+    Get the version of the ontology, it changes every time a KPI is added.
+
+    Returns:
+        dict: The version of the ontology.
+    """
+
+    return {"version": ontology_version}
+
+
 class KPI_Info(BaseModel):
     id: str
     description: str
@@ -0,0 +1,187 @@
+import gzip
+import os
+import zlib
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+
+try:
+    import brotli
+except ImportError:  # without brotli the responses are only compressed with gzip
+    brotli = None
+
+# Responses smaller than this number of bytes are sent uncompressed, compressing them costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Compression levels, fast ones: the JSON payloads compress well already at low levels
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Encodings in order of preference
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# Media types that are already compressed, or that must reach the client as they are sent (the alert streams)
+_UNCOMPRESSED_TYPES = ("text/event-stream", "image/", "audio/", "video/", "application/pdf", "application/zip",
+                       "application/gzip", "application/octet-stream")
+
+_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value):
+    """Serialize the values orjson does not know natively."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "tolist"):
+        # NumPy scalars and arrays of a dtype orjson does not serialize, e.g. float16 or object
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Serialize a value to compact JSON with orjson.
+
+    NumPy arrays and scalars, datetimes, dataclasses and pydantic models are serialized directly, without
+    converting them to Python objects first. NaN and infinity become null.
+
+    Args:
+        content: The value.
+
+    Returns:
+        bytes: The JSON text, UTF-8 encoded.
+    """
+    return orjson.dumps(content, default=_default, option=_JSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSON response serialized with orjson, see dumps."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _accepted_encoding(headers) -> str:
+    """Return the preferred encoding of ENCODINGS accepted by the client, None if there is none."""
+    for name, value in headers:
+        if name != b"accept-encoding":
+            continue
+        accepted = {}
+        for item in value.decode("latin-1").lower().split(","):
+            coding, _, parameters = item.partition(";")
+            quality = 1.0
+            parameters = parameters.strip()
+            if parameters.startswith("q="):
+                try:
+                    quality = float(parameters[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip()] = quality
+        for encoding in ENCODINGS:
+            if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+    return None
+
+
+class _Compressor:
+    """An incremental gzip or brotli compressor."""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress = compressor.process
+            self.finish = compressor.finish
+        else:
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.compress = compressor.compress
+            self.finish = compressor.flush
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a whole body with gzip or br."""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing the responses with brotli or gzip, as accepted by the client.
+
+    Responses smaller than COMPRESSION_MIN_SIZE, already encoded, marked Cache-Control: no-transform or of a media
+    type in _UNCOMPRESSED_TYPES are sent as they are. Streamed responses (e.g. the historical data) are compressed
+    chunk by chunk, without being buffered.
+    """
+
+    def __init__(self, app, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = _accepted_encoding(scope["headers"]) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                if self._compressible(message.get("headers", [])):
+                    # the headers are sent with the first body, once its size is known
+                    start = message
+                else:
+                    passthrough = True
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = list(start.get("headers", []))
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers = [(name, value) for name, value in headers if name != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    passthrough = True
+                    return
+                compressor = _Compressor(encoding)
+                await send({**start, "headers": headers})
+
+            chunk = compressor.compress(body)
+            if not more_body:
+                chunk += compressor.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compressible(headers) -> bool:
+        for name, value in headers:
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type" and value.decode("latin-1").lower().startswith(_UNCOMPRESSED_TYPES):
+                return False
+            if name == b"cache-control" and b"no-transform" in value.lower():
+                return False
+        return True
@@ -2,6 +2,7 @@ from kpi_dataframe_filter import kpi_dataframe_filter
 from kpi_data_extraction import kpi_dataframe_data_extraction
 import pandas as pd
 import requests, os
+from instrumentation import timed_upstream, trace_headers
 from sympy import symbols, parse_expr, SympifyError
 
 class kpi_engine:
@@ -511,11 +512,12 @@ class kpi_engine:
     def dynamic_kpi(df, machine_id, machine_type, start_period, end_period, kpi_id):
         fd = df
         # kpi_formula = extract formula through API and kpi_id
-        headers = {
+        headers = trace_headers({
             "x-api-key": "b3ebe1bb-a4e7-41a3-bbcc-6c281136e234",
             "Content-Type": "application/json"
-        }
-        response = requests.get(f"http://kb:8000/kb/{kpi_id}/get_kpi", headers=headers)
+        })
+        with timed_upstream("kb"):
+            response = requests.get(f"http://kb:8000/kb/{kpi_id}/get_kpi", headers=headers)
         response = response.json()
         print(response)
         if response.get("atomic") == True:
@@ -11,6 +11,8 @@ from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
 from api_auth.api_auth import get_verify_api_key
+from instrumentation import instrument, timed_upstream
+from response_layer import CompressionMiddleware, FastJSONResponse
 from fastapi import Depends
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -35,8 +37,9 @@ query_body = {
 success = False
 while not success:
     try:
-        response = requests.post(druid_url, headers=headers, json=query_body)
-        response.raise_for_status()  # Raise an error for bad status codes
+        with timed_upstream("druid"):
+            response = requests.post(druid_url, headers=headers, json=query_body)
+            response.raise_for_status()  # Raise an error for bad status codes
         df = response.json()  # Return the JSON response
         success = True
     except requests.exceptions.RequestException as e:
@@ -47,7 +50,7 @@ df = pd.DataFrame.from_dict(df, orient='columns')
 
 df.rename(columns={"__time": "time"}, inplace=True)
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,6 +59,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+instrument(app)
 
 class KPIRequest(BaseModel):
     KPI_Name: Optional[str] = "no_kpi"
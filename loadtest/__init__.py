@@ -0,0 +1,6 @@
+"""
+Load tests of the SmartFactory services.
+
+fakes serves local stand-ins for Druid and for the AI agent (and so the LLM), replaying recorded fixtures;
+runner drives a mix of requests at the API layer and reports the latency percentiles and the throughput per route.
+"""
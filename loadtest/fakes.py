@@ -0,0 +1,262 @@
+"""
+Local stand-ins for Druid and for the AI agent, so that the services can be load tested without network.
+
+Every request is answered with its recorded fixture if there is one. Otherwise the fake Druid answers from an
+in-memory timeseries (the CSV files of --dataset, or synthetic data), and the fake agent with a generic answer.
+With --record the requests are forwarded to the real upstream and its responses are recorded as fixtures.
+
+Usage:
+    python -m loadtest.fakes druid --port 8888 [--dataset database/druid/upload] [--record http://localhost:18888]
+    python -m loadtest.fakes agent --port 8000 [--record http://localhost:10050]
+    python -m loadtest.fakes all --port 18888 --agent-port 10050
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+
+from loadtest.fixtures import MACHINES, FixtureStore, load_dataset, synthetic_timeseries
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+# Maximum number of rows of a synthesized grouped result
+MAX_ROWS = 100000
+
+# The periods of TIME_FLOOR, the month is approximated
+PERIODS = {"PT1M": timedelta(minutes=1), "PT15M": timedelta(minutes=15), "PT1H": timedelta(hours=1),
+           "P1D": timedelta(days=1), "P1W": timedelta(weeks=1), "P1M": timedelta(days=30)}
+
+
+def _parse_date(value: str):
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def select_rows(query: str, rows: list) -> list:
+    """Answer a SELECT * with optional column = 'value' conditions, as run by the kpi-engine and data-processing."""
+    where = query.split(" where ", 1) if " where " in query else query.split(" WHERE ", 1)
+    conditions = re.findall(r"(\w+)\s*=\s*'([^']*)'", where[1]) if len(where) == 2 else []
+    return [row for row in rows if all(str(row.get(column)) == value for column, value in conditions)]
+
+
+def grouped_rows(query: str, parameters: list, rows: list) -> list:
+    """
+    Synthesize the result of an aggregation, as run by the historical endpoint of the API layer.
+
+    The result has the columns of the query, a row per machine (and per period with TIME_FLOOR) of the timeframe
+    and values in the range of the timeseries; the aggregation itself is not computed.
+    """
+    aliases = re.findall(r'\bAS\s+"?([^",\s]+)"?', query)
+    dates = [(i, _parse_date(value)) for i, value in enumerate(parameters)]
+    dates = [(i, date) for i, date in dates if date is not None]
+    machines = parameters[dates[-1][0] + 1:] if dates else []
+    machines = machines or MACHINES[:3]
+    period = re.search(r"TIME_FLOOR\(__time, '(\w+)'\)", query)
+    step = PERIODS.get(period.group(1), timedelta(days=1)) if period else None
+    start, end = (dates[0][1], dates[-1][1]) if len(dates) >= 2 else (datetime(2024, 3, 1), datetime(2024, 4, 1))
+    values = [row["avg"] for row in rows[:1000] if isinstance(row.get("avg"), float)] or [1.0]
+    low, high = min(values), max(values)
+
+    result = []
+    for machine in machines:
+        times = [None] if step is None else itertools.takewhile(lambda t: t < end, (start + step * i
+                                                                                    for i in itertools.count()))
+        for time_ in times:
+            row = {"name": machine}
+            for alias in aliases:
+                if alias == "timestamp":
+                    row[alias] = time_.strftime("%Y-%m-%dT%H:%M:%S" if step < timedelta(days=1) else "%Y-%m-%d")
+                else:
+                    row[alias] = round(random.Random(f"{machine}{alias}{time_}").uniform(low, high), 3)
+            result.append(row)
+            if len(result) >= MAX_ROWS:
+                return result
+    return result
+
+
+def format_result(rows: list, result_format: str) -> tuple:
+    """Serialize rows in a resultFormat of the Druid SQL API, returns the body and the media type."""
+    if result_format == "objectLines":
+        # Druid ends the lines with an empty one
+        return "".join(json.dumps(row) + "\n" for row in rows) + "\n", "text/plain"
+    if result_format == "array":
+        return json.dumps([list(row.values()) for row in rows]), "application/json"
+    return json.dumps(rows), "application/json"
+
+
+class Fake:
+    """
+    The fixtures, the recording target and the latency of a fake upstream.
+
+    Attributes:
+        kind (str): The name of the fixtures directory, e.g. druid.
+        store (FixtureStore): The recorded responses.
+        record (str): The URL of the real upstream to record, None to replay.
+        delay (float): Seconds added to every response; None to replay the recorded latency.
+    """
+
+    def __init__(self, kind: str, store: FixtureStore, record: str = None, delay: float = None):
+        self.kind = kind
+        self.store = store
+        self.record = record.rstrip("/") if record else None
+        self.delay = delay
+        self.counters = {"replayed": 0, "generated": 0, "recorded": 0}
+
+    async def answer(self, path: str, body, generate) -> Response:
+        """
+        Answer a request from its fixture, from the real upstream when recording, or from generate.
+
+        Args:
+            path (str): The path of the request, used to forward it.
+            body: The JSON body of the request, which identifies it.
+            generate (callable): Returns (body text, media type) when there is no fixture.
+        """
+        fixture = None if self.record else self.store.get(self.kind, body)
+        if fixture is None and self.record:
+            start = time.perf_counter()
+            async with httpx.AsyncClient(timeout=None) as client:
+                response = await client.post(self.record + path, json=body)
+            fixture = {"status": response.status_code, "elapsed": time.perf_counter() - start,
+                       "media_type": response.headers.get("content-type", "application/json"),
+                       "body": response.text}
+            self.store.put(self.kind, body, fixture)
+            self.counters["recorded"] += 1
+        elif fixture is not None:
+            self.counters["replayed"] += 1
+        else:
+            content, media_type = await run_in_threadpool(generate)
+            fixture = {"status": 200, "media_type": media_type, "body": content}
+            self.counters["generated"] += 1
+
+        if not self.record:
+            delay = self.delay if self.delay is not None else fixture.get("elapsed")
+            if delay:
+                await asyncio.sleep(delay)
+        return Response(content=fixture["body"], status_code=fixture["status"], media_type=fixture["media_type"])
+
+
+def create_druid_app(store: FixtureStore, rows: list, record: str = None, delay: float = None) -> FastAPI:
+    """
+    Create the fake Druid: the SQL API of the router, the task API of the coordinator and the health check.
+
+    Args:
+        store (FixtureStore): The recorded responses.
+        rows (list): The timeseries answering the queries without a fixture.
+        record (str, optional): The URL of the real router to record.
+        delay (float, optional): Seconds added to every query, the recorded latency if None.
+    """
+    app = FastAPI()
+    fake = Fake("druid", store, record, delay)
+    task_ids = itertools.count(1)
+
+    @app.post("/druid/v2/sql")
+    async def sql(request: Request):
+        body = await request.json()
+
+        def generate():
+            query = body["query"]
+            parameters = [parameter["value"] for parameter in body.get("parameters", [])]
+            result = grouped_rows(query, parameters, rows) if "GROUP BY" in query.upper() else select_rows(query, rows)
+            return format_result(result, body.get("resultFormat", "object"))
+
+        return await fake.answer("/druid/v2/sql", body, generate)
+
+    @app.post("/druid/indexer/v1/task")
+    async def task(request: Request):
+        # the ingestion of db-init, the fake serves the uploaded files with --dataset
+        await request.body()
+        return {"task": f"loadtest-{next(task_ids)}"}
+
+    @app.get("/status/health")
+    async def health():
+        return True
+
+    @app.get("/loadtest/stats")
+    async def stats():
+        return {"rows": len(rows), **fake.counters}
+
+    return app
+
+
+def create_agent_app(store: FixtureStore, record: str = None, delay: float = None) -> FastAPI:
+    """
+    Create the fake AI agent, which replaces the rag service and so the calls to the LLM.
+
+    Args:
+        store (FixtureStore): The recorded answers.
+        record (str, optional): The URL of the real rag service to record.
+        delay (float, optional): Seconds added to every answer, the recorded latency if None.
+    """
+    app = FastAPI()
+    fake = Fake("agent", store, record, delay)
+
+    @app.post("/agent/chat")
+    async def chat(request: Request):
+        question = await request.json()
+        # the answer does not depend on the user
+        body = {"userInput": question.get("userInput"), "requestType": question.get("requestType")}
+
+        def generate():
+            answer = {"textResponse": f"Recorded answer unavailable for: {body['userInput']}",
+                      "textExplanation": "", "data": "", "label": "kb_q"}
+            return json.dumps(answer), "application/json"
+
+        return await fake.answer("/agent/chat", body, generate)
+
+    @app.get("/loadtest/stats")
+    async def stats():
+        return JSONResponse(fake.counters)
+
+    return app
+
+
+async def serve(apps: list):
+    """Serve (app, port) pairs in this process until interrupted."""
+    servers = [uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning"))
+               for app, port in apps]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for Druid and the AI agent.")
+    parser.add_argument("kind", choices=["druid", "agent", "all"])
+    parser.add_argument("--port", type=int, default=8888, help="port of the fake, of Druid with all")
+    parser.add_argument("--agent-port", type=int, default=10050, help="port of the fake agent with all")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="directory of the recorded responses")
+    parser.add_argument("--dataset", help="directory of CSV timeseries, synthetic data if missing or empty")
+    parser.add_argument("--record", help="URL of the real upstream whose responses are recorded")
+    parser.add_argument("--record-agent", help="URL of the real rag service to record, with all")
+    parser.add_argument("--delay", type=float, help="seconds added to every response, the recorded latency if unset")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    store = FixtureStore(args.fixtures)
+    apps = []
+    if args.kind in ("druid", "all"):
+        rows = load_dataset(args.dataset) if args.dataset and os.path.isdir(args.dataset) else []
+        if not rows:
+            rows = synthetic_timeseries()
+        logging.info("Fake Druid serving %d rows on port %d", len(rows), args.port)
+        apps.append((create_druid_app(store, rows, args.record, args.delay), args.port))
+    if args.kind == "agent":
+        apps.append((create_agent_app(store, args.record, args.delay), args.port))
+    elif args.kind == "all":
+        apps.append((create_agent_app(store, args.record_agent, args.delay), args.agent_port))
+    asyncio.run(serve(apps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import csv
+import hashlib
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+# The machines and KPIs of the plant, as named in the knowledge base
+MACHINES = [
+    "Large Capacity Cutting Machine 1", "Large Capacity Cutting Machine 2",
+    "Medium Capacity Cutting Machine 1", "Medium Capacity Cutting Machine 2", "Medium Capacity Cutting Machine 3",
+    "Low Capacity Cutting Machine 1", "Laser Welding Machine 1", "Laser Welding Machine 2",
+    "Assembly Machine 1", "Assembly Machine 2", "Assembly Machine 3",
+    "Riveting Machine 1", "Riveting Machine 2", "Testing Machine 1", "Testing Machine 2", "Testing Machine 3"
+]
+KPIS = [
+    "working_time", "idle_time", "offline_time", "consumption", "power", "cost", "consumption_working",
+    "consumption_idle", "cycles", "good_cycles", "bad_cycles", "cost_working", "cost_idle", "average_cycle_time"
+]
+# The fields stored for every KPI
+FIELDS = ("sum", "avg", "min", "max")
+
+DRUID_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def synthetic_timeseries(start: datetime = datetime(2024, 3, 1), days: int = 60, seed: int = 0) -> list:
+    """
+    Generate a daily timeseries with the columns of the timeseries datasource, for when no dataset is given.
+
+    Args:
+        start (datetime): The first day.
+        days (int): The number of days.
+        seed (int): The seed of the values, the same seed gives the same rows.
+
+    Returns:
+        list: The rows, as returned by Druid for SELECT * (the time is in __time).
+    """
+    rng = random.Random(seed)
+    rows = []
+    for day in range(days):
+        time = (start + timedelta(days=day)).strftime(DRUID_TIME_FORMAT)
+        for index, machine in enumerate(MACHINES):
+            for kpi in KPIS:
+                low = rng.uniform(0, 50)
+                high = low + rng.uniform(0, 50)
+                rows.append({
+                    "__time": time, "asset_id": f"ast-{index:04d}", "name": machine, "kpi": kpi,
+                    "sum": round(rng.uniform(low, high) * 24, 3), "avg": round((low + high) / 2, 3),
+                    "min": round(low, 3), "max": round(high, 3)
+                })
+    return rows
+
+
+def load_dataset(directory: str) -> list:
+    """
+    Read the timeseries from the CSV files of a directory, e.g. the ones uploaded to Druid by db-init.
+
+    Args:
+        directory (str): The directory.
+
+    Returns:
+        list: The rows, as returned by Druid for SELECT *; empty if there are no CSV files.
+    """
+    rows = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".csv"):
+            continue
+        with open(os.path.join(directory, file_name), newline="") as file:
+            for row in csv.DictReader(file):
+                if "time" in row:
+                    row["__time"] = row.pop("time")
+                for field in FIELDS:
+                    if row.get(field) not in (None, ""):
+                        row[field] = float(row[field])
+                rows.append(row)
+    return rows
+
+
+class FixtureStore:
+    """
+    Recorded responses of an upstream, one JSON file per request under <directory>/<kind>/.
+
+    A request is identified by the hash of its JSON body, so the same request always gets the same response.
+
+    Attributes:
+        directory (str): The directory of the fixtures.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(body) -> str:
+        return hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, kind: str, body) -> str:
+        return os.path.join(self.directory, kind, self.key(body) + ".json")
+
+    def get(self, kind: str, body):
+        """
+        Return the recorded response of a request.
+
+        Returns:
+            dict or None: status, media_type, body (text) and elapsed (seconds), None if it was never recorded.
+        """
+        try:
+            with open(self._path(kind, body)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, kind: str, body, response: dict):
+        """Record the response of a request, see get."""
+        path = self._path(kind, body)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as file:
+                json.dump({"request": body, **response}, file, indent=1)
@@ -0,0 +1,223 @@
+"""
+Drive a mix of requests at the API layer and report the latency percentiles and the throughput per scenario.
+
+Every worker sends a request, reads the whole response and sends the next one, so the number of workers is the
+number of requests in flight. The report can be saved and used as the baseline of a later run, which then fails
+if a scenario got slower or the throughput dropped by more than the tolerance.
+
+Usage:
+    python -m loadtest.runner --base-url http://localhost:10040 --api-key <gui key> --data-key <data key> \
+        --concurrency 32 --duration 60 --output report.json [--baseline baseline.json --tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+from loadtest.scenarios import build_mix
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """Return the q-th percentile (0-100) of sorted values, with the nearest-rank method; 0 without values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+class ScenarioStats:
+    """The latencies and the status codes of the requests of a scenario."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+
+    def record(self, elapsed: float, status):
+        """Record a request, status is the status code or the name of the exception raised."""
+        self.latencies.append(elapsed)
+        self.statuses[str(status)] += 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "route": self.scenario.route,
+            "count": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0.0,
+            "throughput": count / elapsed if elapsed else 0.0,
+            "mean": sum(latencies) / count if count else 0.0,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+            "statuses": dict(self.statuses)
+        }
+
+
+async def run_load(base_url: str, mix: list, concurrency: int = 16, duration: float = 30.0, requests: int = None,
+                   warmup: float = 5.0, timeout: float = 120.0, keys: dict = None, user_ids: list = None,
+                   seed: int = 0) -> dict:
+    """
+    Send the requests of a mix at a fixed concurrency.
+
+    Args:
+        base_url (str): The URL of the API layer.
+        mix (list): The scenarios, see loadtest.scenarios.
+        concurrency (int): The number of requests in flight.
+        duration (float): Seconds of measurement, after the warmup.
+        requests (int, optional): Stop after this number of measured requests, before the end of the duration.
+        warmup (float): Seconds of requests sent before the measurement, to fill the caches and the pools.
+        timeout (float): Seconds after which a request fails.
+        keys (dict): The API keys by scenario key (gui, data).
+        user_ids (list): The users of the requests, chosen at random.
+        seed (int): The seed of the random choices, the same seed sends the same requests.
+
+    Returns:
+        dict: The report: settings, elapsed seconds, totals and the summary of every scenario.
+    """
+    keys = keys or {}
+    user_ids = user_ids or [1]
+    stats = {scenario.name: ScenarioStats(scenario) for scenario in mix}
+    weights = [scenario.weight for scenario in mix]
+    budget = {"remaining": requests}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        measure_from = loop.time() + warmup
+        deadline = measure_from + duration
+
+        async def worker(index: int):
+            rng = random.Random(seed * 1000 + index)
+            while loop.time() < deadline and budget["remaining"] != 0:
+                scenario = rng.choices(mix, weights)[0]
+                method, path, body = scenario.request(rng, rng.choice(user_ids))
+                headers = {"X-API-Key": keys.get(scenario.key, "")}
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, headers=headers)
+                    status = response.status_code
+                except httpx.HTTPError as error:
+                    status = type(error).__name__
+                elapsed = time.perf_counter() - start
+                if loop.time() - elapsed >= measure_from:
+                    stats[scenario.name].record(elapsed, status)
+                    if budget["remaining"] is not None:
+                        budget["remaining"] -= 1
+
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+        elapsed = max(min(loop.time(), deadline) - measure_from, 1e-9)
+
+    scenarios = {name: scenario_stats.summary(elapsed) for name, scenario_stats in stats.items()}
+    latencies = sorted(latency for scenario_stats in stats.values() for latency in scenario_stats.latencies)
+    count = len(latencies)
+    errors = sum(scenario_stats.errors for scenario_stats in stats.values())
+    return {
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "total": {"count": count, "errors": errors, "error_rate": errors / count if count else 0.0,
+                  "throughput": count / elapsed, "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                  "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else 0.0},
+        "scenarios": scenarios
+    }
+
+
+def format_report(report: dict) -> str:
+    """Return the report as a table, latencies in milliseconds."""
+    lines = [f"{'scenario':<24}{'route':<42}{'count':>7}{'errors':>7}{'req/s':>9}"
+             f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"]
+    rows = list(report["scenarios"].items()) + [("total", {**report["total"], "route": ""})]
+    for name, summary in rows:
+        lines.append(f"{name:<24}{summary['route']:<42}{summary['count']:>7}{summary['errors']:>7}"
+                     f"{summary['throughput']:>9.1f}{summary['p50'] * 1000:>9.1f}{summary['p95'] * 1000:>9.1f}"
+                     f"{summary['p99'] * 1000:>9.1f}{summary['max'] * 1000:>9.1f}")
+    lines.append(f"{report['total']['count']} requests in {report['elapsed']:.1f}s "
+                 f"with {report['concurrency']} concurrent workers")
+    return "\n".join(lines)
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Compare a report with a baseline report.
+
+    A scenario regresses if its p95 or p99 latency grew, or its error rate rose, by more than the tolerance;
+    the run regresses if the total throughput dropped by more than the tolerance.
+
+    Args:
+        report (dict): The report of the run.
+        baseline (dict): The report of the reference run.
+        tolerance (float): The accepted relative change, e.g. 0.2 for 20%.
+
+    Returns:
+        list: A description of every regression, empty if there are none.
+    """
+    regressions = []
+    for name, summary in report["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference or not reference["count"] or not summary["count"]:
+            continue
+        for metric in ("p95", "p99"):
+            if summary[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {summary[metric] * 1000:.1f}ms, "
+                                   f"was {reference[metric] * 1000:.1f}ms")
+        if summary["error_rate"] > reference["error_rate"] + tolerance * max(reference["error_rate"], 0.01):
+            regressions.append(f"{name}: error rate {summary['error_rate']:.1%}, was {reference['error_rate']:.1%}")
+    throughput, reference = report["total"]["throughput"], baseline.get("total", {}).get("throughput")
+    if reference and throughput < reference * (1 - tolerance):
+        regressions.append(f"throughput {throughput:.1f} req/s, was {reference:.1f} req/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the API layer and report latency and throughput.")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:10040"))
+    parser.add_argument("--api-key", default=os.getenv("LOADTEST_API_KEY", ""), help="API key of the gui")
+    parser.add_argument("--data-key", default=os.getenv("LOADTEST_DATA_KEY", ""),
+                        help="API key of data-processing, which posts the alerts")
+    parser.add_argument("--mix", help="name=weight pairs, e.g. calculate=5,historical=3; the default mix if unset")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of measurement")
+    parser.add_argument("--requests", type=int, help="stop after this number of measured requests")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds before the measurement starts")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--users", default="1", help="IDs of the users of the requests, separated by commas")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="save the report as JSON")
+    parser.add_argument("--baseline", help="JSON report of a reference run, the run fails if it regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    mix = build_mix(args.mix)
+    report = asyncio.run(run_load(
+        args.base_url, mix, concurrency=args.concurrency, duration=args.duration, requests=args.requests,
+        warmup=args.warmup, timeout=args.timeout, keys={"gui": args.api_key, "data": args.data_key},
+        user_ids=[user_id.strip() for user_id in args.users.split(",")], seed=args.seed
+    ))
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+from datetime import date, timedelta
+
+from loadtest.fixtures import FIELDS, KPIS, MACHINES
+
+# The timeframe of the dataset uploaded by db-init, and of the synthetic one
+FIRST_DAY = date(2024, 3, 1)
+DAYS = 60
+
+# Questions of the GUI chat, the fake agent answers the recorded ones as the rag service did
+QUESTIONS = [
+    "Can you describe cost_working_avg?",
+    "Compute the working_time for Assembly Machine 1 for last week",
+    "Predict for the next month the consumption_sum for Laser Welding Machine 1 based on last three months data",
+    "Which machines have the highest idle_time?",
+    "What is the difference between good_cycles and bad_cycles?"
+]
+
+
+class Scenario:
+    """
+    A kind of request of the load mix.
+
+    Attributes:
+        name (str): The name of the scenario in the report.
+        weight (float): The share of the requests of the mix, relative to the other scenarios.
+        method (str): The HTTP method.
+        path (str): The path of the request, {user_id} is replaced by the user.
+        body (callable): Called with a random.Random and the user ID, returns the JSON body; None without body.
+        key (str): The API key sending the request, gui or data.
+    """
+
+    def __init__(self, name: str, weight: float, method: str, path: str, body=None, key: str = "gui"):
+        self.name = name
+        self.weight = weight
+        self.method = method
+        self.path = path
+        self.body = body
+        self.key = key
+
+    @property
+    def route(self) -> str:
+        """The method and the path template, without the query string."""
+        return f"{self.method} {self.path.split('?')[0].replace('{user_id}', '{userId}')}"
+
+    def request(self, rng, user_id) -> tuple:
+        """Return the method, the path and the JSON body of a request."""
+        body = self.body(rng, user_id) if self.body is not None else None
+        return self.method, self.path.format(user_id=user_id), body
+
+
+def _timeframe(rng, max_days: int = DAYS) -> tuple:
+    days = rng.randint(1, max_days)
+    start = FIRST_DAY + timedelta(days=rng.randint(0, DAYS - days))
+    return start.isoformat(), (start + timedelta(days=days)).isoformat()
+
+
+def _calculate(rng, user_id):
+    start, end = _timeframe(rng)
+    return [{"KPI_Name": rng.choice(KPIS), "Machine_Name": rng.choice(MACHINES), "Date_Start": start,
+             "Date_End": end, "Aggregator": rng.choice(["sum", "avg", "min", "max"])}]
+
+
+def _historical(rng, user_id):
+    start, end = _timeframe(rng)
+    return {"kpi": f"{rng.choice(KPIS)}_{rng.choice(FIELDS)}", "timeframe": {"start_date": start, "end_date": end},
+            "machines": rng.sample(MACHINES, rng.randint(1, 4)), "group_time": "P1D"}
+
+
+def _historical_downsampled(rng, user_id):
+    start, end = _timeframe(rng)
+    return {"kpis": [f"{kpi}_{rng.choice(FIELDS)}" for kpi in rng.sample(KPIS, 2)],
+            "timeframe": {"start_date": start, "end_date": end}, "machines": rng.sample(MACHINES, 2),
+            "max_points": 200, "format": "ndjson"}
+
+
+def _predict(rng, user_id):
+    return {"value": [{"Machine_Name": rng.choice(MACHINES), "KPI_Name": rng.choice(KPIS),
+                       "Date_prediction": rng.choice([7, 14, 30])}]}
+
+
+def _agent(rng, user_id):
+    return {"userInput": rng.choice(QUESTIONS), "requestType": "chat"}
+
+
+def _alert(rng):
+    machine = rng.choice(MACHINES)
+    kpi = rng.choice(KPIS)
+    return {"title": "Outlier detected", "type": "unexpected output",
+            "description": f"{kpi} for {machine} returned a value higher than expected",
+            "triggeredAt": (FIRST_DAY + timedelta(days=rng.randint(0, DAYS))).isoformat(), "machineName": machine,
+            # no emails, so that the load measures the API and not the SMTP server
+            "isPush": True, "isEmail": False, "recipients": ["FactoryFloorManager"],
+            "severity": rng.choice(["Low", "Medium", "High"])}
+
+
+# The default mix, close to the traffic of the GUI and of the data-processing alerts
+SCENARIOS = [
+    Scenario("calculate", 20, "POST", "/smartfactory/calculate", _calculate),
+    Scenario("historical", 20, "POST", "/smartfactory/historical", _historical),
+    Scenario("historical-downsampled", 5, "POST", "/smartfactory/historical", _historical_downsampled),
+    Scenario("predict", 10, "POST", "/smartfactory/predict", _predict),
+    Scenario("agent", 5, "POST", "/smartfactory/agent/{user_id}", _agent),
+    Scenario("alert-post", 10, "POST", "/smartfactory/postAlert", lambda rng, user_id: _alert(rng), key="data"),
+    Scenario("alert-batch", 2, "POST", "/smartfactory/postAlerts",
+             lambda rng, user_id: [_alert(rng) for _ in range(20)], key="data"),
+    Scenario("alert-feed", 20, "GET", "/smartfactory/alerts/{user_id}?limit=50"),
+    Scenario("alert-unread", 8, "GET", "/smartfactory/alerts/{user_id}/unread"),
+]
+
+
+def build_mix(weights: str = None) -> list:
+    """
+    Return the scenarios of a mix.
+
+    Args:
+        weights (str, optional): name=weight pairs separated by commas, e.g. calculate=5,agent=1; the scenarios not
+                                 listed are left out. The default mix if None.
+
+    Returns:
+        list: The scenarios with a positive weight.
+
+    Raises:
+        ValueError: If a scenario does not exist.
+    """
+    if not weights:
+        return list(SCENARIOS)
+    scenarios = {scenario.name: scenario for scenario in SCENARIOS}
+    mix = []
+    for pair in weights.split(","):
+        name, _, weight = pair.partition("=")
+        if name.strip() not in scenarios:
+            raise ValueError(f"Unknown scenario: {name} (available: {', '.join(scenarios)})")
+        scenario = scenarios[name.strip()]
+        mix.append(Scenario(scenario.name, float(weight or 1), scenario.method, scenario.path, scenario.body,
+                            scenario.key))
+    return [scenario for scenario in mix if scenario.weight > 0]
@@ -18,9 +18,11 @@ from langchain_community.graphs import RdfGraph
 from langchain.prompts import PromptTemplate,FewShotPromptTemplate
 
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.callbacks import BaseCallbackHandler
 from collections import deque
 from dotenv import load_dotenv
 #from .api_auth.api_auth import get_verify_api_key
+from .instrumentation import observe_upstream, timed_upstream, trace_headers
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
@@ -92,8 +94,31 @@ observer = Observer()
 observer.schedule(event_handler, os.environ['KB_FILE_PATH'], recursive=True)
 observer.start()
 
+class LLMTimingCallback(BaseCallbackHandler):
+    """
+    Records the duration of every call to the LLM, also the ones made by the chains, as a call to the llm upstream.
+    """
+
+    def __init__(self):
+        self._started = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._observe(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._observe(run_id, error=True)
+
+    def _observe(self, run_id, error=False):
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            observe_upstream("llm", time.perf_counter() - start, error)
+
+
 # Initialize the LLM model
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash")
+llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", callbacks=[LLMTimingCallback()])
 
 # Initialize the conversation history deque
 history = {}
@@ -170,7 +195,8 @@ async def ask_kpi_engine(json_body):
 
     async with httpx.AsyncClient(timeout=httpx.Timeout(10.0)) as client:
         try:
-            response = await client.post(kpi_engine_url,json=json_body,headers=HEADER)
+            with timed_upstream("kpi-engine"):
+                response = await client.post(kpi_engine_url,json=json_body,headers=trace_headers(HEADER))
         except Exception as e:
             return {
                     "success": False,
@@ -205,7 +231,8 @@ async def ask_predictor_engine(json_body):
     
     async with httpx.AsyncClient(timeout=httpx.Timeout(20.0)) as client:
         try:
-            response = await client.post(url=predictor_engine_url,json=json_body,headers=HEADER)
+            with timed_upstream("data-processing"):
+                response = await client.post(url=predictor_engine_url,json=json_body,headers=trace_headers(HEADER))
         except Exception as e:
             return {
                     "success": False,
@@ -1,6 +1,11 @@
 from fastapi import FastAPI
 from api import endpoints
+from api.instrumentation import instrument
+from api.response_layer import CompressionMiddleware, FastJSONResponse
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+app.add_middleware(CompressionMiddleware)
+instrument(app)
 
 app.include_router(endpoints.router, prefix='/agent')
\ No newline at end of file